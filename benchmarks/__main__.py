@@ -0,0 +1,85 @@
+"""
+Benchmark suite of the report preparation and export.
+
+    python -m benchmarks run --sizes 1000 100000 -o results.json
+    python -m benchmarks compare base.json results.json
+"""
+import argparse
+import json
+import os
+import sys
+
+from .runner import SIZES, EXPORTERS, run_case, run_suite, save_results, load_results, compare
+from .shapes import SHAPES
+
+
+def _format_result(result: dict) -> str:
+    prepare = result['prepare']
+    line = (
+        f"{result['shape']:<12} {result['rows']:>9} rows {result['pages']:>7} pages  "
+        f"prepare {prepare['time']:8.3f}s {prepare['pagesPerSec'] or 0:9.1f} p/s"
+    )
+    for name, export in result['exporters'].items():
+        line += f"  {name} {export['time']:8.3f}s {export['pagesPerSec'] or 0:9.1f} p/s"
+    rss = max(filter(None, [prepare['peakRss']] + [e['peakRss'] for e in result['exporters'].values()]), default=None)
+    if rss:
+        line += f'  peak {rss / 2 ** 20:.0f} MB'
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Reptile benchmark suite')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the benchmark cases')
+    run.add_argument('--shapes', nargs='+', choices=list(SHAPES), default=list(SHAPES))
+    run.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    run.add_argument('--exporters', nargs='*', choices=list(EXPORTERS), default=list(EXPORTERS))
+    run.add_argument('--repeat', type=int, default=1, help='runs by case, the best time is kept')
+    run.add_argument('--packed', action='store_true', help='prepare packed pages')
+    run.add_argument('--trace-memory', action='store_true', help='measure the preparation peak with tracemalloc')
+    run.add_argument('--no-isolate', action='store_true', help='run the cases in the current process')
+    run.add_argument('-o', '--output', help='JSON results file')
+
+    case = commands.add_parser('case', help='run a single case and write its result as JSON')
+    case.add_argument('shape', choices=list(SHAPES))
+    case.add_argument('rows', type=int)
+    case.add_argument('--exporters', nargs='*', choices=list(EXPORTERS), default=list(EXPORTERS))
+    case.add_argument('--repeat', type=int, default=1)
+    case.add_argument('--packed', action='store_true')
+    case.add_argument('--trace-memory', action='store_true')
+
+    cmp = commands.add_parser('compare', help='compare two results files')
+    cmp.add_argument('base')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=0.1, help='relative increase reported as a regression')
+
+    args = parser.parse_args(argv)
+    if args.command == 'case':
+        result = run_case(args.shape, args.rows, args.exporters, args.repeat, args.packed, args.trace_memory)
+        print(json.dumps(result), flush=True)
+        # the result is written, the worker skips the interpreter finalization:
+        # some Qt bindings builds crash while tearing down after large exports
+        os._exit(0)
+    elif args.command == 'run':
+        results = run_suite(
+            args.shapes, args.sizes, args.exporters, args.repeat, args.packed, args.trace_memory,
+            isolate=not args.no_isolate, on_result=lambda r: print(_format_result(r), flush=True),
+        )
+        if args.output:
+            save_results(results, args.output)
+    elif args.command == 'compare':
+        diff = compare(load_results(args.base), load_results(args.new), args.threshold)
+        for item in diff:
+            flag = '  REGRESSION' if item['regression'] else ''
+            print(
+                f"{item['shape']:<12} {item['rows']:>9} {item['metric']:<18} "
+                f"{item['base']:12.4g} -> {item['new']:12.4g} {item['ratio']:7.2f}x{flag}"
+            )
+        if any(item['regression'] for item in diff):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
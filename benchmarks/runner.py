@@ -0,0 +1,243 @@
+"""
+Run the benchmark cases and compare the results of two runs.
+A case prepares a report shape with a number of rows and exports the document with every exporter,
+measuring the time, the pages per second and the peak memory of the process.
+By default every case runs in a new process, so the peak memory of a case is not affected by the previous cases.
+"""
+from typing import Callable, Dict, Iterable, List, Optional
+from pathlib import Path
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .shapes import SHAPES
+
+SIZES = (1000, 100000, 1000000)
+RESULTS_VERSION = 1
+ROOT = Path(__file__).resolve().parent.parent
+
+_clock = time.perf_counter
+
+
+def _export_pdf(doc, filename: str):
+    from reptile.exports.pdf import PDF
+    PDF(doc).export(filename)
+
+
+def _export_binary(doc, filename: str):
+    doc.save(filename)
+
+
+EXPORTERS: Dict[str, Callable] = {
+    'pdf': _export_pdf,
+    'binary': _export_binary,
+}
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Peak resident memory of the process in bytes, None if it can't be measured on this platform
+    :return:
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _rate(count: int, seconds: float) -> Optional[float]:
+    return count / seconds if seconds else None
+
+
+def run_case(
+    shape: str, rows: int, exporters: Iterable[str] = tuple(EXPORTERS), repeat=1, packed=False, trace_memory=False,
+) -> dict:
+    """
+    Run a benchmark case in the current process
+    :param shape: name of the report shape (see shapes.SHAPES)
+    :param rows: number of rows of the dataset
+    :param exporters: names of the exporters (see EXPORTERS)
+    :param repeat: run the preparation and the exports `repeat` times, the best time is kept
+    :param packed: keep the prepared pages as packed pages (see Report.prepare)
+    :param trace_memory: measure the peak memory allocated by the preparation with tracemalloc (untimed extra run)
+    :return:
+    """
+    exporters = list(exporters)
+    # the Qt engine measures the growing texts, loaded even if the pdf is not exported
+    # so the preparation does the same work with any exporter
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        import reptile.exports.pdf  # noqa: F401
+    except ImportError:
+        if 'pdf' in exporters:
+            raise
+    build = SHAPES[shape]
+    result = {'shape': shape, 'rows': rows, 'packed': packed}
+    doc = None
+    prepare_time = None
+    for _ in range(repeat):
+        doc = None
+        rep = build(rows)
+        start = _clock()
+        doc = rep.prepare(packed=packed)
+        elapsed = _clock() - start
+        prepare_time = elapsed if prepare_time is None else min(prepare_time, elapsed)
+    pages = len(doc.pages)
+    result['pages'] = pages
+    result['prepare'] = {
+        'time': prepare_time,
+        'pagesPerSec': _rate(pages, prepare_time),
+        'rowsPerSec': _rate(rows, prepare_time),
+        'peakRss': peak_rss(),
+    }
+    result['exporters'] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in exporters:
+            filename = os.path.join(tmp, f'{shape}.{name}')
+            export_time = None
+            for _ in range(repeat):
+                start = _clock()
+                EXPORTERS[name](doc, filename)
+                elapsed = _clock() - start
+                export_time = elapsed if export_time is None else min(export_time, elapsed)
+            result['exporters'][name] = {
+                'time': export_time,
+                'pagesPerSec': _rate(pages, export_time),
+                'bytes': os.path.getsize(filename),
+                # peak of the process, including the preparation and the previous exporters
+                'peakRss': peak_rss(),
+            }
+    if trace_memory:
+        # after the measures, the traced run is slower and uses more memory
+        doc = None
+        rep = build(rows)
+        tracemalloc.start()
+        try:
+            rep.prepare(packed=packed)
+            result['prepare']['peakTraced'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def _run_isolated(shape: str, rows: int, exporters: List[str], repeat: int, packed: bool, trace_memory: bool) -> dict:
+    args = [
+        sys.executable, '-m', 'benchmarks', 'case', shape, str(rows),
+        '--exporters', *exporters, '--repeat', str(repeat),
+    ]
+    if packed:
+        args.append('--packed')
+    if trace_memory:
+        args.append('--trace-memory')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(ROOT), env.get('PYTHONPATH')]))
+    proc = subprocess.run(args, cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError(f'Benchmark case {shape}/{rows} failed:\n{proc.stderr}')
+    # the result is the last line written by the case
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run_suite(
+    shapes: Iterable[str] = tuple(SHAPES), sizes: Iterable[int] = SIZES, exporters: Iterable[str] = tuple(EXPORTERS),
+    repeat=1, packed=False, trace_memory=False, isolate=True, on_result: Callable[[dict], None] = None,
+) -> dict:
+    """
+    Run the benchmark cases of every shape and size
+    :param shapes:
+    :param sizes:
+    :param exporters:
+    :param repeat:
+    :param packed:
+    :param trace_memory:
+    :param isolate: run every case in a new process
+    :param on_result: called with the result of each case when it is finished
+    :return: the results with the information of the environment, see save_results
+    """
+    exporters = list(exporters)
+    results = []
+    for rows in sizes:
+        for shape in shapes:
+            if isolate:
+                result = _run_isolated(shape, rows, exporters, repeat, packed, trace_memory)
+            else:
+                result = run_case(shape, rows, exporters, repeat, packed, trace_memory)
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return {
+        'version': RESULTS_VERSION,
+        'commit': _git_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        proc = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return proc.stdout.strip() or None
+
+
+def save_results(results: dict, filename: str):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(filename: str) -> dict:
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def _metrics(result: dict) -> Dict[str, float]:
+    metrics = {'prepare.time': result['prepare']['time'], 'prepare.peakRss': result['prepare']['peakRss']}
+    for name, export in result['exporters'].items():
+        metrics[f'{name}.time'] = export['time']
+        metrics[f'{name}.peakRss'] = export['peakRss']
+    return metrics
+
+
+def compare(base: dict, new: dict, threshold=0.1) -> List[dict]:
+    """
+    Compare the times and the memory of the cases found in both results
+    :param base: results of the reference run
+    :param new: results of the compared run
+    :param threshold: relative increase reported as a regression
+    :return: a list of {"shape", "rows", "metric", "base", "new", "ratio", "regression"}
+    """
+    base_cases = {(r['shape'], r['rows'], r.get('packed', False)): r for r in base['results']}
+    diff = []
+    for result in new['results']:
+        ref = base_cases.get((result['shape'], result['rows'], result.get('packed', False)))
+        if ref is None:
+            continue
+        ref_metrics = _metrics(ref)
+        for metric, value in _metrics(result).items():
+            old = ref_metrics.get(metric)
+            if not old or value is None:
+                continue
+            ratio = value / old
+            diff.append({
+                'shape': result['shape'],
+                'rows': result['rows'],
+                'metric': metric,
+                'base': old,
+                'new': value,
+                'ratio': ratio,
+                'regression': ratio > 1 + threshold,
+            })
+    return diff
@@ -0,0 +1,241 @@
+"""
+Synthetic datasets and report layouts of the benchmark suite.
+The rows are deterministic (seeded) and streamed while the report is prepared,
+so the dataset itself does not count in the memory usage of the preparation.
+"""
+from typing import Callable, Dict, Iterator
+import random
+import struct
+import zlib
+
+from reptile.bands import (
+    Report, DataBand, GroupHeader, GroupFooter, FooterBand, Text, Image, Barcode, DataSource,
+)
+from reptile.core import Aggregate
+from reptile.core.base import Highlight
+
+# rows by category and by subcategory of the generated datasets
+CATEGORY_SIZE = 1000
+SUBCATEGORY_SIZE = 100
+# rows printed by the detail band for every master row (subreport shape)
+DETAIL_ROWS = 3
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+    'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip'
+).split()
+
+
+def generate_rows(count: int, notes=False, seed=0) -> Iterator[dict]:
+    """
+    Generate the rows of a synthetic dataset, sorted by category and subcategory
+    :param count: number of rows
+    :param notes: generate a text of variable length by row
+    :param seed: random seed, the same seed generates the same rows
+    :return:
+    """
+    rnd = random.Random(seed)
+    subcategories = CATEGORY_SIZE // SUBCATEGORY_SIZE
+    for i in range(count):
+        row = {
+            'id': i,
+            'category': f'Category {i // CATEGORY_SIZE:04d}',
+            'subcategory': f'Subcategory {i // SUBCATEGORY_SIZE % subcategories}',
+            'name': f'Product {i}',
+            'amount': round(rnd.uniform(0, 1000), 2),
+            'code': f'{i:012d}',
+        }
+        if notes:
+            row['notes'] = ' '.join(rnd.choices(WORDS, k=rnd.randint(3, 60)))
+        yield row
+
+
+def png_image(width=32, height=32) -> bytes:
+    """
+    Encode a gradient image as PNG, without any image library
+    :param width:
+    :param height:
+    :return:
+    """
+    raw = b''.join(
+        b'\x00' + bytes(c for x in range(width) for c in (x * 255 // width, y * 255 // height, 128))
+        for y in range(height)
+    )
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw))
+        + chunk(b'IEND', b'')
+    )
+
+
+def _text(band, text: str, left=0, width=150, **attrs) -> Text:
+    obj = Text(text)
+    obj.left = left
+    obj.top = 0
+    obj.width = width
+    obj.height = 20
+    for k, v in attrs.items():
+        setattr(obj, k, v)
+    band.add_object(obj)
+    return obj
+
+
+def _new_report(rows: int, notes=False):
+    rep = Report()
+    page = rep.new_page()
+    datasource = DataSource(generate_rows(rows, notes=notes), 'data1')
+    rep.register_datasource(datasource)
+    return rep, page, datasource
+
+
+def _data_band(page, datasource) -> DataBand:
+    band = DataBand()
+    band.name = 'band1'
+    band.height = 20
+    page.add_band(band)
+    band.datasource = datasource
+    return band
+
+
+def _row_texts(band):
+    _text(band, '{{ data1.id }}', width=60)
+    _text(band, '{{ data1.name }}', left=60)
+    _text(band, '{{ data1.category }}', left=210)
+    _text(band, '{{ data1.amount }}', left=360, width=80)
+
+
+def flat(rows: int) -> Report:
+    """
+    A data band printing 4 texts by row
+    """
+    rep, page, datasource = _new_report(rows)
+    _row_texts(_data_band(page, datasource))
+    return rep
+
+
+def groups(rows: int) -> Report:
+    """
+    Nested groups (category / subcategory) with group footers and running totals
+    """
+    rep, page, datasource = _new_report(rows)
+    group = GroupHeader()
+    group.name = 'group1'
+    group.height = 20
+    page.add_band(group)
+    group.field = 'category'
+    _text(group, 'Category: {{ group.grouper }}', width=300)
+    group.aggregates.append(Aggregate.create({'name': 'category_total', 'function': 'sum', 'field': 'amount'}))
+    subgroup = GroupHeader()
+    subgroup.name = 'group2'
+    subgroup.height = 20
+    page.add_band(subgroup)
+    subgroup.parent = group
+    subgroup.field = 'subcategory'
+    _text(subgroup, '{{ group.grouper }}', left=20, width=300)
+    band = _data_band(page, datasource)
+    band.parent = subgroup
+    _row_texts(band)
+    footer = GroupFooter()
+    footer.height = 20
+    page.add_band(footer)
+    group.footer = footer
+    _text(footer, 'Total: {{ category_total }}', left=300)
+    return rep
+
+
+def can_grow(rows: int) -> Report:
+    """
+    Word wrapped texts of variable length growing the band height
+    """
+    rep, page, datasource = _new_report(rows, notes=True)
+    band = _data_band(page, datasource)
+    _text(band, '{{ data1.id }}', width=60)
+    _text(band, '{{ data1.notes }}', left=60, width=400, can_grow=True, word_wrap=True)
+    return rep
+
+
+def highlights(rows: int) -> Report:
+    """
+    Texts with highlight conditions evaluated on every row
+    """
+    rep, page, datasource = _new_report(rows)
+    band = _data_band(page, datasource)
+    _row_texts(band)
+    for obj in band.objects:
+        obj.highlight = Highlight({'condition': 'data1.amount > 500', 'background': {'color': '#ffe0e0'}})
+    return rep
+
+
+def barcodes(rows: int) -> Report:
+    """
+    A code 128 barcode by row
+    """
+    rep, page, datasource = _new_report(rows)
+    band = _data_band(page, datasource)
+    band.height = 40
+    _text(band, '{{ data1.name }}')
+    barcode = Barcode()
+    barcode.expression = 'data1.code'
+    barcode.left = 160
+    barcode.top = 0
+    barcode.width = 200
+    barcode.height = 36
+    band.add_object(barcode)
+    return rep
+
+
+def images(rows: int) -> Report:
+    """
+    An image by row, decoded again by the exporters for every row
+    """
+    rep, page, datasource = _new_report(rows)
+    band = _data_band(page, datasource)
+    band.height = 36
+    _text(band, '{{ data1.name }}')
+    image = Image()
+    image.picture = png_image()
+    image.left = 160
+    image.top = 0
+    image.width = image.height = 32
+    band.add_object(image)
+    return rep
+
+
+def subreport(rows: int) -> Report:
+    """
+    Master/detail report, a detail band prints DETAIL_ROWS rows for every master row.
+    The detail is a data band printed as the child band of the master band.
+    """
+    rep, page, datasource = _new_report(rows)
+    master = _data_band(page, datasource)
+    _row_texts(master)
+    detail = DataBand()
+    detail.name = 'detail'
+    detail.height = 20
+    page.add_band(detail)
+    detail.parent = master
+    detail.row_count = DETAIL_ROWS
+    master.child_band = detail
+    _text(detail, '{{ data1.name }} item {{ detail + 1 }}', left=20, width=300)
+    footer = FooterBand()
+    footer.height = 20
+    page.add_band(footer)
+    master.footer = footer
+    _text(footer, 'Rows: {{ line }}')
+    return rep
+
+
+SHAPES: Dict[str, Callable[[int], Report]] = {
+    'flat': flat,
+    'groups': groups,
+    'can_grow': can_grow,
+    'highlights': highlights,
+    'barcodes': barcodes,
+    'images': images,
+    'subreport': subreport,
+}
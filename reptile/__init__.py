@@ -1 +1 @@
-from .env import EnvironmentSettings
+from .env import EnvironmentSettings, LayeredContext, render_template, eval_expression
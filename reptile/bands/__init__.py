@@ -3,3 +3,4 @@ from .widgets import *
 from .barcodes import *
 from .subreport import *
 from . import templates
+from .layout import *
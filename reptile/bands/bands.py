@@ -1,15 +1,17 @@
-from typing import List, Optional, Iterable, TypedDict
+from typing import List, Optional, Iterable, TypedDict, Set
 from functools import partial
-from itertools import groupby
 from collections import defaultdict
 from decimal import Decimal
 
 from jinja2 import Template
 
-from reptile import EnvironmentSettings
+from reptile import EnvironmentSettings, LayeredContext, render_template, eval_expression
 from reptile.runtime import PreparedPage, PreparedBand
-from reptile.core import ReportObject, BasePage, Report, Margin, mm, VAlign, Font
+from reptile.core import ReportObject, BasePage, Report, Margin, mm, VAlign, Font, Aggregate
 from reptile.data import DataSource
+from reptile.data.ranges import DataRange, SortedRows, group_ranges
+from reptile.data.sorting import sort_rows
+from .expressions import parse_field, field_getter, format_value, template_names, compile_expression, _MISSING
 
 
 class Page(BasePage):
@@ -28,6 +30,7 @@ class Page(BasePage):
     stream = None
     subreport = None
     _pending_operations = None
+    _structure_resolved = False
     watermark: 'Watermark' = None
 
     def __init__(self):
@@ -88,6 +91,7 @@ class Page(BasePage):
             'width': self.width,
             'name': self.name,
             'margins': self.margins.dump(),
+            'watermark': self.watermark.dump() if self.watermark else None,
             'bands': [band.dump() for band in self.bands],
             'pageSize': self._page_size,
             'orientation': self.orientation,
@@ -98,9 +102,13 @@ class Page(BasePage):
             self.bands.append(band)
             band.page = self
 
-    def prepare(self, stream: List):
-        self._context = self.report._context
-        self.stream = stream
+    def resolve_structure(self):
+        """
+        Detect the special bands and link the bands to their groups, only once by page
+        :return:
+        """
+        if self._structure_resolved:
+            return
         # detect special bands
         for band in self.bands:
             if isinstance(band, ReportTitle):
@@ -120,21 +128,55 @@ class Page(BasePage):
                 band.group_header.children.append(band)
             elif isinstance(band, GroupFooter):
                 band.group_header.children.append(band)
+        self._structure_resolved = True
+
+    def prepare(self, stream: List, section: 'Section' = None):
+        """
+        Prepare the page bands
+        :param stream:
+        :param section: resume the preparation at a section recorded by a previous preparation
+        :return:
+        """
+        self._context = self.report._context
+        self.stream = stream
+        self.resolve_structure()
+        profiler = self.report.profiler
+        if profiler is not None:
+            profiler.enter(self)
+
+        if section is None:
+            # the objects apply the changes made since the last preparation
+            for band in self.bands:
+                for obj in band.objects:
+                    obj.clear_cache()
+            self._first_time = True
+            self._current_page = None
+            page = self.new_page(self._context)
+            start = 0
+        else:
+            page = section.restore()
+            start = section.band_index
 
-        self._first_time = True
-        page = self.new_page(self._context)
-
-        for band in self.bands:
+        sections = self.report._sections
+        for i in range(start, len(self.bands)):
+            band = self.bands[i]
             # Only root bands should be processed here
             if isinstance(band, DataBand) and band.group_header:
                 continue
             if band.parent is None and isinstance(band, (GroupHeader, DataBand)):
+                if sections is not None:
+                    sections.append(Section(self, i, page))
                 page = band.prepare(page, self._context) or page
             elif band.__class__ is Band:
+                if sections is not None:
+                    sections.append(Section(self, i, page))
                 # direct print
                 page = band.prepare(page, self._context)
 
         self.end_page(page, self._context)
+        self._current_page = None
+        if profiler is not None:
+            profiler.exit()
 
     def new_page(self, context):
         is_first_time = self._first_time
@@ -158,7 +200,7 @@ class Page(BasePage):
         if self._page_footer:
             page.ay -= self._page_footer.height
         self._current_page = page
-        self.report.stream.pages.append(page)
+        self.report.stream.add_page(page)
         for cb in self.callbacks:
             cb(page, context)
         return page
@@ -169,6 +211,7 @@ class Page(BasePage):
             page.y = page.ay - self._page_footer.height
             self._page_footer.prepare(page, context)
         self._bottom_height = 0
+        self.report.stream.close_page(page)
 
     def set_report(self, value: Report):
         if self._report and self in self._report.pages:
@@ -177,6 +220,17 @@ class Page(BasePage):
         if value:
             value.add_page(self)
 
+    def get_dependencies(self) -> Set[str]:
+        """
+        Names of the context entries used by the bands printed on every page (title, page header and footer)
+        :return:
+        """
+        names = set()
+        for band in self.bands:
+            if isinstance(band, (ReportTitle, PageHeader, PageFooter)):
+                names.update(band.get_dependencies())
+        return names
+
     def add_new_page_callback(self, cb):
         self.callbacks.append(cb)
 
@@ -184,6 +238,54 @@ class Page(BasePage):
         self.callbacks.remove(cb)
 
 
+class Section:
+    """
+    Engine state recorded before a root band of a page is prepared,
+    a later preparation can be resumed from this point (see Report.reprepare)
+    """
+    def __init__(self, page: Page, band_index: int, prepared_page: PreparedPage):
+        report = page.report
+        self.page = page
+        self.band_index = band_index
+        self.band = page.bands[band_index]
+        self.prepared_page = prepared_page
+        self.page_index = len(report.stream.pages)
+        self.band_count = len(prepared_page.bands)
+        self.y = prepared_page.y
+        self.ay = prepared_page.ay
+        self.page_count = report.page_count
+        self.context = dict(page._context)
+        self.pending_count = len(report._pending_objects)
+        self.first_time = page._first_time
+        self.bottom_height = page._bottom_height
+        self.callbacks = list(page.callbacks)
+        self.aggregates = [agg.get_state() for agg in report.aggregates]
+
+    def get_dependencies(self) -> Set[str]:
+        return self.band.get_dependencies()
+
+    def restore(self) -> PreparedPage:
+        """
+        Restore the engine state, the pages prepared after the section are discarded
+        :return: the prepared page where the section starts
+        """
+        page = self.page
+        report = page.report
+        del report.stream.pages[self.page_index:]
+        prepared = self.prepared_page
+        del prepared.bands[self.band_count:]
+        prepared.y = self.y
+        prepared.ay = self.ay
+        report.page_count = self.page_count
+        page._first_time = self.first_time
+        page._bottom_height = self.bottom_height
+        page.callbacks[:] = self.callbacks
+        page._current_page = prepared
+        for agg, state in zip(report.aggregates, self.aggregates):
+            agg.set_state(state)
+        return prepared
+
+
 class Band(ReportObject):
     background: int = None
     height: int = 40
@@ -206,6 +308,8 @@ class Band(ReportObject):
         self.objects: List['ReportObject'] = []
         self.children: List['Band'] = []
         self.subreports: List['SubReport'] = []
+        # running aggregates of the data and group bands
+        self.aggregates: List[Aggregate] = []
 
     def load(self, data: dict):
         self.height = data.get('height', self.height)
@@ -214,6 +318,7 @@ class Band(ReportObject):
         self.print_on_bottom = data.get('printOnBottom', self.print_on_bottom)
         if child_band := data.get('childBand'):
             self.page._pending_operations[child_band].append(partial(setattr, self, 'child_band'))
+        self.aggregates = [Aggregate.create(agg) for agg in data.get('aggregates', ())]
 
         for obj in data['objects']:
             widget = TAG_REGISTRY[obj['type']]()
@@ -226,7 +331,10 @@ class Band(ReportObject):
             'height': self.height,
             'width': self.width,
             'name': self.name,
+            'printOnBottom': self.print_on_bottom,
+            'childBand': self.child_band.name if self.child_band else None,
             'objects': [obj.dump() for obj in self.objects],
+            'aggregates': [agg.dump() for agg in self.aggregates],
         }
 
     def add_band(self, band: 'Band'):
@@ -241,6 +349,31 @@ class Band(ReportObject):
         if obj.parent != self:
             obj.parent = self
 
+    def get_dependencies(self, visited: set = None) -> Set[str]:
+        """
+        Names of the context entries (datasources, params...) used by the band, its objects
+        and the bands printed with it (header, footer, child band and children)
+        :param visited:
+        :return:
+        """
+        if visited is None:
+            visited = set()
+        visited.add(id(self))
+        names = set()
+        for obj in self.objects:
+            names.update(obj.get_dependencies())
+        for agg in self.aggregates:
+            if agg.expression:
+                names.update(template_names('{{ %s }}' % agg.expression))
+        datasource = getattr(self, 'datasource', None)
+        if datasource is not None:
+            names.add(datasource.name)
+        linked = [getattr(self, 'header', None), getattr(self, 'footer', None), self.child_band, *self.children]
+        for band in linked:
+            if isinstance(band, Band) and id(band) not in visited:
+                names.update(band.get_dependencies(visited))
+        return names
+
     def prepare(self, page: PreparedPage, context):
         page = self.prepare_objects(page, context)
         # if self.subreports:
@@ -263,11 +396,18 @@ class Band(ReportObject):
         else:
             band.left = page.x
             band.top = page.y
+        profiler = self.page.report.profiler
+        if profiler is not None:
+            profiler.enter(self)
         for obj in self.objects:
             # if isinstance(obj, SubReport):
             #     obj.prepare(page, context)
             # else:
+            if profiler is not None:
+                profiler.enter(obj)
             new_obj = obj.prepare(objs, context)
+            if profiler is not None:
+                profiler.exit()
             if new_obj and (new_obj.height + new_obj.top) > band.height:
                 band.height = new_obj.height + new_obj.top
         band.bottom = band.top + band.height
@@ -288,6 +428,8 @@ class Band(ReportObject):
         # save position
         self._x = band.left
         self._y = band.top
+        if profiler is not None:
+            profiler.exit()
         return page
 
     def prepare_subreports(self, page: PreparedPage, context):
@@ -385,10 +527,13 @@ class DataProxy:
         self.data = data
 
     def __getattr__(self, item):
-        if self.data and isinstance(self.data, list):
+        if self.data and (isinstance(self.data, (list, DataRange)) or hasattr(self.data, 'column')):
             return self.data[0][item]
 
     def values(self, item):
+        if hasattr(self.data, 'column'):
+            # columnar data, return the column array
+            return self.data.column(item)
         return [rec[item] or Decimal(0.00) if isinstance(rec, dict) else getattr(rec, item) for rec in self.data]
 
     def __iter__(self):
@@ -427,14 +572,21 @@ class DataBand(Band):
     def dump(self) -> dict:
         return {
             **super().dump(),
-            'datasource': self.datasource,
-            # 'row_count': self.row_count,
+            'datasource': self.datasource.name if self.datasource else None,
+            'rowCount': self.row_count,
+            'groupHeader': self.group_header.name if self.group_header else None,
             'header': self.header.name if self.header else None,
             'footer': self.footer.name if self.footer else None,
             'expression': self.expression,
             # 'group_header': self.group_header.dump() if self.group_header else None,
         }
 
+    def get_dependencies(self, visited: set = None) -> Set[str]:
+        names = super().get_dependencies(visited)
+        if self.expression:
+            names.add(self.expression)
+        return names
+
     def prepare(self, page: PreparedPage, context):
         data = self.data
         self._context = context
@@ -448,19 +600,39 @@ class DataBand(Band):
         if self.header and not self.group_header:
             page = self.header.prepare(page, context)
 
-        self._context = context
+        # the row entries are kept in the top layer of the context, overwritten on every row
+        row_context = self._context = LayeredContext(context)
+        layer = row_context.layer
+        datasource_name = self.datasource and self.datasource.name
+        name = self.name
+        line = context['line']
+        for agg in self.aggregates:
+            agg.reset(context)
+        report = self.page.report
+        aggregates = self.aggregates + [agg for agg in report._active_aggregates or () if agg.accepts(self)]
+        profiler = report.profiler
+        if profiler is not None:
+            profiler.enter(f'rows:{name or self.band_type}')
+            data = profiler.iter_rows(data, datasource_name or name or self.band_type)
         for i, row in enumerate(data):
             row = RecordHelper(row) if isinstance(row, dict) else row
-            if self.datasource and self.datasource.name:
-                context[self.datasource.name] = row
-            context['record'] = row
-            context['row'] = i + 1
-            context['line'] += 1
-            if self.name:
-                context[self.name] = row
-            even = context['even'] = bool(i % 2)
-            context['odd'] = not even
-            page = super().prepare(page, context)
+            if datasource_name:
+                layer[datasource_name] = row
+            layer['record'] = row
+            layer['row'] = i + 1
+            line += 1
+            layer['line'] = line
+            if name:
+                layer[name] = row
+            even = layer['even'] = bool(i % 2)
+            layer['odd'] = not even
+            for agg in aggregates:
+                agg.update(row_context)
+            page = super().prepare(page, row_context)
+        if profiler is not None:
+            profiler.exit()
+        # the last row remains available to the footer and the next bands
+        row_context.flush()
         if self.datasource:
             context[self.datasource.name] = DataProxy(self.datasource.data)
         # print the footer band
@@ -501,15 +673,33 @@ class GroupHeader(Band):
     footer: 'GroupFooter' = None
     _datasource: DataSource = None
     _template_expression: Template = None
+    _key_field = None
+    # None groups the consecutive rows (the data is sorted by the group), "sort" sorts the rows
+    # by the keys of all nested groups, "hash" keeps the groups in order of their first row
+    group_mode: str = None
+    # max rows of a streamed source sorted in memory (see data.sorting)
+    sort_buffer_size: int = None
 
     def load(self, structure: dict):
         super().load(structure)
         self.expression = structure.get('expression')
+        self.field = structure.get('field')
+        self.group_mode = structure.get('groupMode')
         if name := structure.get('dataBand'):
             self.page._pending_operations[name].append(partial(setattr, self, 'band'))
         if name := structure.get('footer'):
             self.page._pending_operations[name].append(partial(setattr, self, 'footer'))
 
+    def dump(self) -> dict:
+        return {
+            **super().dump(),
+            'expression': self.expression,
+            'field': self.field,
+            'groupMode': self.group_mode,
+            'dataBand': self.band.name if self.band else None,
+            'footer': self.footer.name if self.footer else None,
+        }
+
     @property
     def band(self):
         return self._band
@@ -523,21 +713,83 @@ class GroupHeader(Band):
     @property
     def template_expression(self):
         if not self._template_expression:
-            if not self.expression and self.field:
-                self.expression = 'record.' + self.field
-            assert self.expression, 'Group expression must be specified'
-            if '"' in self.expression:
-                self.expression = self.expression.replace('"', '')
+            self._prepare_expression()
             try:
-                self._template_expression = EnvironmentSettings.env.from_string('{{ %s }}' % self.expression)
+                self._template_expression = EnvironmentSettings.template_cache.from_string('{{ %s }}' % self.expression)
             except:
                 print('Error preparing expression for', self.name)
                 raise
         return self._template_expression
 
+    def _prepare_expression(self):
+        if not self.expression and self.field:
+            self.expression = 'record.' + self.field
+        assert self.expression, 'Group expression must be specified'
+        if '"' in self.expression:
+            self.expression = self.expression.replace('"', '')
+
     def eval_condition(self, row, context: dict):
         context[self._datasource.name] = row
-        return self.template_expression.render(**context)
+        context['record'] = row
+        return render_template(self.template_expression, context)
+
+    def get_group_key(self, context: dict):
+        """
+        Return the function used to compute the group key of a row.
+        Simple field references (record.field, data1['field']) are read directly from the row,
+        only complex expressions are evaluated by the template engine.
+        :param context:
+        :return:
+        """
+        if self._key_field is None:
+            self._prepare_expression()
+            self._key_field = parse_field(self.expression) or False
+        if self._key_field:
+            name, is_item, key = self._key_field
+            datasource = self.datasource
+            if name == 'record' or (datasource and name == datasource.name):
+                getter = field_getter(is_item, key)
+                return lambda row: str(format_value(getter(row)))
+        return partial(self.eval_condition, context=context)
+
+    def get_sort_key(self, context: dict):
+        """
+        Return the function used to compute the group value of a row, used to sort the rows.
+        Unlike the group key, the value is not converted to text.
+        :param context:
+        :return:
+        """
+        if self._key_field is None:
+            self._prepare_expression()
+            self._key_field = parse_field(self.expression) or False
+        if self._key_field:
+            name, is_item, key = self._key_field
+            datasource = self.datasource
+            if name == 'record' or (datasource and name == datasource.name):
+                getter = field_getter(is_item, key)
+
+                def field_key(row):
+                    value = getter(row)
+                    return None if value is _MISSING else value
+                return field_key
+        expression = compile_expression(self.expression)
+        datasource = self.datasource
+        names = ('record', datasource.name) if datasource and datasource.name else ('record',)
+
+        def expression_key(row):
+            return eval_expression(expression, LayeredContext(context, dict.fromkeys(names, row)))
+        return expression_key
+
+    def get_levels(self) -> tuple:
+        """
+        The group and its nested groups
+        :return:
+        """
+        levels = [self]
+        group = self
+        while group := next((child for child in group.children if isinstance(child, GroupHeader)), None):
+            levels.append(group)
+        return tuple(levels)
 
     @property
     def datasource(self):
@@ -551,6 +803,17 @@ class GroupHeader(Band):
                         break
         return self._datasource
 
+    def get_dependencies(self, visited: set = None) -> Set[str]:
+        if visited is None:
+            visited = set()
+        names = super().get_dependencies(visited)
+        if self.band is not None and id(self.band) not in visited:
+            names.update(self.band.get_dependencies(visited))
+        if self.expression or self.field:
+            self._prepare_expression()
+            names.update(template_names('{{ ' + self.expression + ' }}'))
+        return names
+
     def on_new_page(self, page: PreparedPage, context):
         super().prepare(page, context)
 
@@ -563,15 +826,40 @@ class GroupHeader(Band):
 
     def process(self, data: Iterable, page: PreparedPage, context):
         self.page.add_new_page_callback(self.on_new_page)
-        groups = groupby(data, key=partial(self.eval_condition, context=context))
+        profiler = self.page.report.profiler
+        if profiler is not None:
+            profiler.enter(f'groups:{self.name or self.band_type}')
+        if isinstance(data, DataProxy):
+            data = data.data
+        base = data.data if isinstance(data, DataRange) else data
+        level = base.level(self) if isinstance(base, SortedRows) else -1
+        sorted_rows = None
+        if level < 0 and self.group_mode:
+            # the keys of the nested groups are computed once, by the outer group
+            levels = self.get_levels()
+            data = sorted_rows = sort_rows(
+                data, [group.get_sort_key(context) for group in levels], self.group_mode, levels,
+                self.sort_buffer_size,
+            )
+            level = 0
+        # the groups are ranges of the data, the rows are not copied
+        groups = group_ranges(data, self.get_group_key(context), level)
         databand = None
         datasource = self.datasource
         datasource_name = datasource and datasource.name
-        for i, (grouper, lst) in enumerate(groups):
-            lst = DataProxy(list(lst))
+        # the group aggregates are updated by the rows of the group
+        active_aggregates = self.page.report._active_aggregates
+        if active_aggregates is not None:
+            active_aggregates.extend(self.aggregates)
+        for i, (grouper, rows) in enumerate(groups):
+            if level >= 0:
+                grouper = str(format_value(grouper))
+            lst = DataProxy(rows)
             group = Group(grouper, lst, i)
             context['group'] = group
             context[datasource_name] = lst
+            for agg in self.aggregates:
+                agg.reset(context)
             page = super().prepare(page, context)
 
             for child in self.children:
@@ -586,10 +874,17 @@ class GroupHeader(Band):
                     page = child.prepare(page, context)
 
         context[datasource_name] = DataProxy(datasource.data)
+        if sorted_rows is not None:
+            sorted_rows.close()
+        if active_aggregates is not None:
+            for agg in self.aggregates:
+                active_aggregates.remove(agg)
 
         self.page.remove_new_page_callback(self.on_new_page)
         if not self.parent and databand and databand.footer:
             page = databand.footer.prepare(page, context)
+        if profiler is not None:
+            profiler.exit()
 
         return page
 
@@ -620,6 +915,15 @@ class Watermark:
         if 'font' in structure:
             self.font = Font()
 
+    def dump(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'text': self.text,
+            'valign': self.valign.name,
+            'image': self.image,
+            'angle': self.angle,
+        }
+
 
 TAG_REGISTRY = {
     'ReportTitle': ReportTitle,
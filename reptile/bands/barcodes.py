@@ -1,12 +1,13 @@
 import warnings
 from io import BytesIO
-from typing import List
+from typing import List, Set
 
 from barcode import Code128, ITF
 from barcode.writer import SVGWriter, ImageWriter
 
-from reptile import EnvironmentSettings
+from reptile import EnvironmentSettings, render_template
 from reptile.bands.widgets import BandObject, TAG_REGISTRY
+from reptile.bands.expressions import template_names
 
 
 class Barcode(BandObject):
@@ -37,9 +38,11 @@ class Barcode(BandObject):
             'type': self.get_type(),
             'name': self.name,
             'field': self.field,
-            'datasource': self._datasource and self._datasource.name,
+            'datasource': self._datasource and self.datasource_name,
             'barcodeType': self.barcode_type,
             'showText': self.show_text,
+            'expression': self.expression,
+            'text': self.text,
             'left': self.left,
             'top': self.top,
             'height': self.height,
@@ -49,9 +52,15 @@ class Barcode(BandObject):
     @property
     def template(self):
         if self._template is None:
-            self._template = EnvironmentSettings.env.from_string('{{ '+ self.expression + ' }}', {'this': self})
+            self._template = EnvironmentSettings.template_cache.from_string('{{ '+ self.expression + ' }}', {'this': self})
         return self._template
 
+    def get_dependencies(self) -> Set[str]:
+        names = super().get_dependencies()
+        if self.expression:
+            names.update(template_names('{{ ' + self.expression + ' }}'))
+        return names
+
     def prepare(self, stream: List, context):
         from reptile.runtime import PreparedBarcode, SizeMode, PreparedImage
         from reptile.barcodes import code128
@@ -63,7 +72,7 @@ class Barcode(BandObject):
             else:
                 warnings.warn('Datasource not found')
         elif self.expression:
-            code = self.template.render(context).strip()
+            code = render_template(self.template, context).strip()
 
         if code:
             img = PreparedBarcode() if self.barcode_type.startswith('code128') else PreparedImage()
@@ -73,7 +82,7 @@ class Barcode(BandObject):
             img.height = self.height
             img.width = self.width
             if self.barcode_type == 'code128' or self.barcode_type == 'code128C':
-                print('barcode', code)
+                img.barcode = self.barcode_type
                 img.data = code128.get_barcode(code)
             elif self.barcode_type == 'ITF-14':
                 s = BytesIO()
@@ -0,0 +1,115 @@
+from typing import Optional, Callable, Tuple, FrozenSet
+from functools import lru_cache
+from decimal import Decimal
+import datetime
+import re
+
+from jinja2 import meta
+
+from reptile import EnvironmentSettings
+
+_re_attr = re.compile(r'^\s*([A-Za-z_]\w*)\s*\.\s*([A-Za-z_]\w*)\s*$')
+_re_item = re.compile(r'''^\s*([A-Za-z_]\w*)\s*\[\s*(['"])(.*?)\2\s*\]\s*$''')
+_re_output = re.compile(r'^([^{}]*)\{\{([^{}]*)\}\}([^{}]*)$', re.S)
+_MISSING = object()
+
+
+def parse_field(expression: str) -> Optional[Tuple[str, bool, str]]:
+    """
+    Detect simple field references like `record.field` or `data1['field']`
+    :param expression: jinja expression
+    :return: a tuple (name, is_item, key) or None for complex expressions
+    """
+    if not expression:
+        return None
+    if m := _re_attr.match(expression):
+        return m.group(1), False, m.group(2)
+    if m := _re_item.match(expression):
+        return m.group(1), True, m.group(3)
+    return None
+
+
+def is_static(text: str) -> bool:
+    """
+    Check if a text has no jinja markup, so it can be printed without rendering
+    :param text:
+    :return:
+    """
+    return '{{' not in text and '{%' not in text and '{#' not in text
+
+
+def parse_output(text: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Detect texts with a single output expression like `Name: {{ record.name }}`
+    :param text: template source
+    :return: a tuple (prefix, expression, suffix) or None
+    """
+    if m := _re_output.match(text):
+        return m.group(1), m.group(2), m.group(3)
+    return None
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(expression: str):
+    """
+    Compile an expression evaluated to a python value (see env.eval_expression)
+    :param expression:
+    :return:
+    """
+    return EnvironmentSettings.env.compile_expression(expression)
+
+
+@lru_cache(maxsize=1024)
+def template_names(source: str) -> FrozenSet[str]:
+    """
+    Names of the context variables referenced by a template
+    :param source: template source
+    :return:
+    """
+    return frozenset(meta.find_undeclared_variables(EnvironmentSettings.env.parse(source)))
+
+
+def field_getter(is_item: bool, key: str) -> Callable:
+    """
+    Return a function to read the field value of a record, with the same lookup rules of jinja
+    (attribute first for `obj.key`, item first for `obj['key']`)
+    :param is_item:
+    :param key:
+    :return:
+    """
+    if is_item:
+        def getter(rec):
+            try:
+                return rec[key]
+            except (AttributeError, TypeError, LookupError):
+                return getattr(rec, key, _MISSING)
+    else:
+        def getter(rec):
+            try:
+                return getattr(rec, key)
+            except AttributeError:
+                pass
+            try:
+                return rec[key]
+            except (TypeError, LookupError):
+                return _MISSING
+    return getter
+
+
+def format_value(val, disp=None):
+    """
+    Format a value to be printed, the same rules used by the template environment finalize function
+    :param val:
+    :param disp: the display format of the object
+    :return:
+    """
+    if val is _MISSING or val is None:
+        return ''
+    if val and disp:
+        if isinstance(val, (Decimal, float)) and disp.kind == 'Numeric':
+            return f'{{:{disp.format}}}'.format(val)
+        if isinstance(val, (datetime.date, datetime.datetime)) and disp.kind == 'DateTime':
+            return val.strftime(disp.format)
+    if isinstance(val, (Decimal, float)):
+        return '%.2f' % val
+    return val
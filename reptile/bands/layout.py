@@ -0,0 +1,109 @@
+from typing import Dict
+from pathlib import Path
+import copy
+import json
+
+from reptile.core import Report
+from reptile.data import DataSource
+from .bands import GroupHeader
+from .widgets import Text
+from .barcodes import Barcode
+
+
+class CompiledLayout:
+    """
+    Report layout loaded once and instantiated for every preparation.
+    The JSON structure is parsed, the band relations are resolved and the templates and text styles
+    are compiled when the layout is created. `instantiate` creates a runnable Report copying only
+    the objects holding preparation state (pages, bands, datasources, aggregates, images and barcodes),
+    the text objects with their compiled templates and styles are shared with the layout.
+    :param structure: report structure (see Report.load) or the filename of a JSON layout
+    :param connection: default database connection of the datasources
+    """
+    def __init__(self, structure: dict | str | Path, connection=None):
+        if not isinstance(structure, dict):
+            with open(structure, 'r') as f:
+                structure = json.loads(f.read())
+        self.report = Report(structure, default_connection=connection)
+        self.compile()
+
+    def compile(self):
+        for page in self.report.pages:
+            page.resolve_structure()
+            for band in page.bands:
+                if isinstance(band, GroupHeader):
+                    band._prepare_expression()
+                for obj in band.objects:
+                    if isinstance(obj, Text):
+                        if obj.allow_expressions and obj.text is not None:
+                            obj._classify()
+                            obj.template
+                        obj.style
+                        if obj.highlight and obj.highlight.condition:
+                            obj.highlight.template
+                            obj.highlight_style
+                    elif isinstance(obj, Barcode) and obj.expression:
+                        obj.template
+
+    def instantiate(self, connection=None, variables: dict = None) -> Report:
+        """
+        Create a report ready to be prepared
+        :param connection: database connection replacing the default connection of the layout
+        :param variables: report variables
+        :return:
+        """
+        proto = self.report
+        memo: Dict[int, object] = {}
+        clones = []
+
+        def clone(obj):
+            if isinstance(obj, DataSource):
+                new_obj = obj.clone()
+            else:
+                new_obj = object.__new__(type(obj))
+                new_obj.__dict__.update(obj.__dict__)
+            memo[id(obj)] = new_obj
+            clones.append(new_obj)
+            return new_obj
+
+        rep = clone(proto)
+        for agg in proto.aggregates:
+            clone(agg)
+        for ds in proto.datasources:
+            ds = clone(ds)
+            if connection is not None and ds.connection is proto.connection:
+                ds.connection = connection
+        for page in proto.pages:
+            clone(page)
+            for band in page.bands:
+                clone(band)
+                for agg in band.aggregates:
+                    clone(agg)
+                for obj in band.objects:
+                    # texts are not modified by the preparation, they are shared with the layout
+                    if not isinstance(obj, Text):
+                        clone(obj)
+        for obj in clones:
+            _remap(obj, memo)
+        if connection is not None:
+            rep.connection = connection
+        rep.variables = dict(proto.variables)
+        if variables:
+            rep.variables.update(variables)
+        rep.context = dict(proto.context)
+        rep.datasource_timings = {}
+        return rep
+
+
+def _remap(obj, memo: dict):
+    # point the references of a cloned object to the clones, the containers are copied
+    attrs = obj.__dict__
+    for k, v in attrs.items():
+        if isinstance(v, list):
+            attrs[k] = [memo.get(id(item), item) for item in v]
+        elif isinstance(v, dict):
+            attrs[k] = copy.copy(v)
+        else:
+            new_value = memo.get(id(v))
+            if new_value is not None:
+                attrs[k] = new_value
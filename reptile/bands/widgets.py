@@ -1,19 +1,28 @@
-from typing import Optional, List, TYPE_CHECKING
+from typing import Optional, List, Set, TYPE_CHECKING
+import base64
 import enum
 import logging
 
 from jinja2 import Template
 
-from reptile import EnvironmentSettings
+from reptile import EnvironmentSettings, render_template
 from reptile.core import (
     ReportObject, Border, DisplayFormat, Highlight, Padding, Font, VAlign, HAlign
 )
-from reptile.runtime import PreparedText, SizeMode
+from reptile.runtime import PreparedText, SizeMode, TextStyle
+from reptile.runtime.placeholders import compile_placeholders
 from reptile.data import DataSource
 from .bands import TAG_REGISTRY, Band
+from .expressions import template_names, is_static, parse_output, parse_field, field_getter, format_value, _MISSING
+from reptile.utils.text import display_format
 
 logger = logging.getLogger('reptile')
 
+# how the text of a Text object is rendered
+_RENDER_STATIC = 1
+_RENDER_FIELD = 2
+_RENDER_TEMPLATE = 3
+
 
 class BandObject(ReportObject):
     left: float = None
@@ -25,12 +34,41 @@ class BandObject(ReportObject):
     def process(self, context: dict):
         pass
 
+    def clear_cache(self):
+        """
+        Clear the values computed from the attributes of the object, called at the start of each preparation
+        :return:
+        """
+
     def prepare(self, stream: List, context):
         obj = self.process(context)
         if obj is not None:
             stream.append(obj)
         return obj
 
+    def get_dependencies(self) -> Set[str]:
+        """
+        Names of the context entries (datasources, params...) used by the object
+        :return:
+        """
+        datasource = getattr(self, '_datasource', None)
+        if datasource is None:
+            return set()
+        return {datasource if isinstance(datasource, str) else datasource.name}
+
+    def get_type(self) -> str:
+        return type(self).__name__
+
+    def dump(self) -> dict:
+        return {
+            'type': self.get_type(),
+            'name': self.name,
+            'width': self.width,
+            'height': self.height,
+            'x': self.left,
+            'y': self.top,
+        }
+
     def load(self, structure: dict):
         self.name = structure.get('name')
         self.left = structure.get('x', structure.get('left'))
@@ -39,35 +77,62 @@ class BandObject(ReportObject):
         self.width = structure.get('width')
 
 
+def _style_attr(name: str):
+    # assigning a style attribute clears the cached styles of the text
+    attr = '_' + name
+
+    def fget(self):
+        return getattr(self, attr)
+
+    def fset(self, value):
+        setattr(self, attr, value)
+        self._style = self._highlight_style = None
+
+    return property(fget, fset)
+
+
 class Text(BandObject):
     DEFAULT_PADDING = {'top': 1, 'right': 2, 'bottom': 1, 'left': 2}
     tag_name = 'text'
     _field: str = None
     _template: Template = None
     _context: dict = None
-    background: str = None
+    _style: TextStyle = None
+    _highlight_style: TextStyle = None
+    _render_mode: int = None
+    _render_args: tuple = None
+    _background: str = None
+    _font: Font = None
+    _halign: HAlign = HAlign.LEFT
+    _valign: VAlign = VAlign.TOP
+    _border: Border = None
+    _word_wrap = False
+    _padding: Padding = None
+    _brush_style = None
+    _highlight: Highlight = None
+    background = _style_attr('background')
+    font = _style_attr('font')
+    halign = _style_attr('halign')
+    valign = _style_attr('valign')
+    border = _style_attr('border')
+    word_wrap = _style_attr('word_wrap')
+    padding = _style_attr('padding')
+    brush_style = _style_attr('brush_style')
+    highlight = _style_attr('highlight')
     color: int = None
     auto_size = False
     can_grow = False
     can_shrink = False
-    font: Font = None
-    halign: HAlign = HAlign.LEFT
-    valign: VAlign = VAlign.TOP
-    border: Border = None
-    word_wrap = False
-    padding: Padding
     top = 0
     left = 0
     width = 120
     height = 20
     allow_tags: bool = False
     allow_expressions: bool = True
-    brush_style = None
     # datasource: DataSource = None
     text: Optional[str] = None
     display_format: DisplayFormat = None
     calc_size = None
-    highlight: Highlight = None
     opacity = 1
 
     def __init__(self, text: str = None):
@@ -83,6 +148,8 @@ class Text(BandObject):
 
     def load(self, structure: dict):
         super().load(structure)
+        self.clear_cache()
+        self._render_mode = self._render_args = None
         self.text = structure.get('text')
         if 'font' in structure:
             f = structure['font']
@@ -152,11 +219,17 @@ class Text(BandObject):
             'vAlign': self.valign,
             'hAlign': self.halign,
             'canGrow': self.can_grow,
+            'canShrink': self.can_shrink,
+            'autoSize': self.auto_size,
             'wrap': self.word_wrap,
             'allowTags': self.allow_tags,
+            'allowExpressions': self.allow_expressions,
             'border': (self.border and self.border.dump()) or None,
             'displayFormat': self.display_format and self.display_format.dump(),
             'background': self.background,
+            'color': self.color,
+            'brushStyle': self.brush_style,
+            'highlight': self.highlight and self.highlight.dump(),
             'width': self.width,
             'height': self.height,
             'x': self.left,
@@ -172,6 +245,7 @@ class Text(BandObject):
     def field(self, value):
         self._field = value
         self.text = None
+        self._render_mode = None
 
     @property
     def template(self):
@@ -179,11 +253,97 @@ class Text(BandObject):
             text = self.text
             if self.display_format and '}}' in text:
                 text = text.replace('}}', f'|display_format(("{self.display_format.kind}","{self.display_format.format}"))' + '}}', 1)
-            self._template = EnvironmentSettings.env.from_string(text, {'this': self})
+            self._template = EnvironmentSettings.template_cache.from_string(text, {'this': self})
         return self._template
 
-    def template2(self, text: str):
-        return Template(text, variable_start_string='${', variable_end_string='}')
+    def _classify(self):
+        # static texts are copied, single field references are read directly from the context,
+        # any other text is rendered by jinja
+        text = self.text
+        self._render_mode = _RENDER_TEMPLATE
+        if text is None or '\r' in text:
+            return
+        if text.endswith('\n'):
+            # jinja strips a single trailing newline
+            text = text[:-1]
+        if is_static(text):
+            self._render_mode = _RENDER_STATIC
+            self._render_args = text
+        elif output := parse_output(text):
+            prefix, expression, suffix = output
+            if field := parse_field(expression):
+                name, is_item, key = field
+                self._render_mode = _RENDER_FIELD
+                self._render_args = (prefix, name, field_getter(is_item, key), suffix)
+
+    def render(self, context: dict) -> str:
+        """
+        Render the text of the object
+        :param context:
+        :return:
+        """
+        if self._render_mode is None:
+            self._classify()
+        mode = self._render_mode
+        if mode == _RENDER_STATIC:
+            return self._render_args
+        if mode == _RENDER_FIELD:
+            prefix, name, getter, suffix = self._render_args
+            rec = context.get(name, _MISSING)
+            if rec is not _MISSING:
+                val = getter(rec)
+                if val is not _MISSING:
+                    disp = self.display_format
+                    if disp:
+                        val = display_format(val, (f'{disp.kind}', f'{disp.format}'))
+                    return f'{prefix}{format_value(val, disp)}{suffix}'
+            # undefined values are handled by jinja
+        return render_template(self.template, context)
+
+    def _style_values(self) -> tuple:
+        font = self.font
+        return (
+            font.name, font.size or 9, font.bold, font.italic, font.color or '#000000', self.background,
+            self.brush_style, self.valign, self.halign, self.border, self.word_wrap, self.padding,
+        )
+
+    def clear_cache(self):
+        self._style = self._highlight_style = None
+
+    @property
+    def style(self) -> TextStyle:
+        """
+        Interned style of the prepared texts, computed on the first use.
+        Cleared when a style attribute is assigned and at the start of each preparation,
+        so the changes made in place (e.g. font.size) are applied by the next preparation.
+        :return:
+        """
+        style = self._style
+        if style is None:
+            style = self._style = TextStyle.get(*self._style_values())
+        return style
+
+    @property
+    def highlight_style(self) -> TextStyle:
+        """
+        Style of the prepared texts when the highlight condition is true
+        :return:
+        """
+        style = self._highlight_style
+        if style is None:
+            values = self._style_values()
+            style = self._highlight_style = TextStyle.get(
+                *values[:5], self.highlight.background or '#ffffff', self.highlight.brush_style, *values[7:],
+            )
+        return style
+
+    def get_dependencies(self) -> Set[str]:
+        names = super().get_dependencies()
+        if self.allow_expressions and self.text:
+            names.update(template_names(self.text))
+        if self.highlight and self.highlight.condition:
+            names.update(template_names('{{%s}}' % self.highlight.condition))
+        return names
 
     def process(self, context, level=3) -> PreparedText:
         new_obj = PreparedText()
@@ -192,12 +352,17 @@ class Text(BandObject):
         new_obj.left = self.left
         new_obj.top = self.top
         new_obj.allow_tags = self.allow_tags
-        new_obj.padding = self.padding
+        if self.highlight and self.highlight.eval_condition(context):
+            new_obj.style = self.highlight_style
+        else:
+            new_obj.style = self.style
         if self.allow_expressions:
             try:
-                new_obj.text = self.template.render(**context)
+                new_obj.text = self.render(context)
                 if '${' in new_obj.text:
-                    context['report']._pending_objects.append((self.template2(new_obj.text), new_obj))
+                    context['report']._pending_objects.append(
+                        (compile_placeholders(new_obj.text), new_obj, context['page_index'])
+                    )
             except Exception as e:
                 logger.error(f"Error evaluating object: {self.name or ''}")
                 logger.exception(e)
@@ -205,22 +370,6 @@ class Text(BandObject):
                 new_obj.error = True
         else:
             new_obj.text = self.text
-        new_obj.font_name = self.font.name
-        if self.font.size:
-            new_obj.font_size = self.font.size
-        if self.font.color:
-            new_obj.color = self.font.color
-        new_obj.font_bold = self.font.bold
-        new_obj.font_italic = self.font.italic
-        new_obj.background = self.background
-        new_obj.brush_style = self.brush_style
-        if self.highlight and self.highlight.eval_condition(context):
-            new_obj.brush_style = self.highlight.brush_style
-            new_obj.background = self.highlight.background or '#ffffff'
-        new_obj.valign = self.valign
-        new_obj.halign = self.halign
-        new_obj.border = self.border
-        new_obj.wrap = self.word_wrap
         new_obj.can_grow = self.can_grow
         if (self.can_grow or self.can_shrink) and level > 1 and self.calc_size:
             w, h = self.calc_size(new_obj)
@@ -277,10 +426,24 @@ class Image(BandObject):
             value = self.parent.page.report.get_datasource(value)
         self._datasource = value
 
+    def dump(self) -> dict:
+        datasource = self._datasource
+        return {
+            **super().dump(),
+            'field': self.field,
+            'datasource': datasource if isinstance(datasource, str) or datasource is None else datasource.name,
+            'sizeMode': self.size_mode,
+            'filename': self.filename,
+            'url': self.url,
+            'picture': self.picture and base64.b64encode(self.picture).decode('ascii'),
+        }
+
     def load(self, structure: dict):
         from reptile.runtime import SizeMode
         super().load(structure)
         self.field = structure.get('field')
+        if picture := structure.get('picture'):
+            self.picture = base64.b64decode(picture)
         size_mode = structure.get('sizeMode')
         if size_mode == 'stretch':
             # compatibility with old reports
@@ -308,6 +471,15 @@ class Line(BandObject):
         self.color = data.get('color', self.color)
         self.line_style = data.get('lineStyle', self.line_style)
 
+    def dump(self) -> dict:
+        return {
+            **super().dump(),
+            'lineWidth': self.line_width,
+            'direction': self.direction,
+            'color': self.color,
+            'lineStyle': self.line_style,
+        }
+
     def prepare(self, stream: List, context):
         from reptile.runtime import PreparedLine
         line = PreparedLine()
@@ -367,6 +539,16 @@ class Table(BandObject):
             y = self.top + h
         self.height = y
 
+    def dump(self) -> dict:
+        return {
+            **super().dump(),
+            'columns': [{'name': col.name, 'width': col.width} for col in self.columns],
+            'rows': [
+                {'name': row.name, 'height': row.height, 'cells': [cell.dump() for cell in row.cells]}
+                for row in self.rows
+            ],
+        }
+
     def add_column(self, column):
         self.columns.append(column)
 
@@ -2,7 +2,14 @@ from .base import *
 from .reports import *
 from reptile import EnvironmentSettings
 from reptile.utils.text import format_mask, format_number
+from . import aggregates
+from .aggregates import Aggregate
+from .profiler import PrepareProfiler
 
 
 EnvironmentSettings.env.globals['format_mask'] = format_mask
 EnvironmentSettings.env.globals['format_number'] = format_number
+EnvironmentSettings.env.globals['sum'] = aggregates.Sum
+EnvironmentSettings.env.globals['avg'] = aggregates.Avg
+EnvironmentSettings.env.globals['SUM'] = aggregates.SUM
+EnvironmentSettings.env.globals['AVG'] = aggregates.AVG
@@ -0,0 +1,227 @@
+"""
+Aggregate functions available to the report templates.
+Columnar values (numpy arrays) are reduced by the array methods instead of python iteration.
+"""
+from functools import partial
+import copy
+
+from reptile.env import eval_expression
+
+
+def _values(data, member=None):
+    if member is not None:
+        return data.values(member)
+    return data
+
+
+def Sum(data, member: str = None):
+    values = _values(data, member)
+    if hasattr(values, 'dtype'):
+        return values.sum()
+    return sum(values)
+
+
+def Avg(data, member: str = None):
+    values = _values(data, member)
+    if hasattr(values, 'dtype'):
+        return values.mean() if len(values) else 0
+    values = list(values)
+    if values:
+        return sum(values) / len(values)
+    return 0
+
+
+def SUM(expr, band=None, flag=None):
+    return Sum(expr)
+
+
+def AVG(expr, band=None, flag=None):
+    return Avg(expr)
+
+
+class Aggregate:
+    """
+    Running aggregate computed while the rows are processed, without scanning the data again.
+    Declared on a DataBand (reset when the band starts printing its rows), on a GroupHeader
+    (reset on every group) or on the report (all rows of the preparation).
+    The current value is stored in the report context under the aggregate name.
+    :param name: name of the value in the report context
+    :param expression: value of the row, e.g. `record.amount`
+    :param band: name of the data band providing the rows, all data bands by default
+    """
+    function: str = None
+    initial_value = None
+    _getter = None
+
+    def __init__(self, name: str, expression: str = None, band: str = None):
+        self.name = name
+        self.expression = expression
+        self.band = band
+        self.reset()
+
+    @classmethod
+    def create(cls, structure: dict) -> 'Aggregate':
+        """
+        Create an aggregate from the report structure
+        :param structure: {"name", "function", "expression" or "field", "dataBand"}
+        :return:
+        """
+        expression = structure.get('expression')
+        if not expression and structure.get('field'):
+            expression = 'record.' + structure['field']
+        return AGGREGATES[structure.get('function', 'sum').lower()](
+            structure['name'], expression, structure.get('dataBand'),
+        )
+
+    def dump(self) -> dict:
+        return {
+            'name': self.name,
+            'function': self.function,
+            'expression': self.expression,
+            'dataBand': self.band,
+        }
+
+    def accepts(self, band) -> bool:
+        return self.band is None or self.band == band.name
+
+    def reset(self, context=None):
+        self.count = 0
+        if context is not None:
+            context[self.name] = self.value
+
+    def update(self, context):
+        """
+        Add the value of the current row
+        :param context: row context
+        :return:
+        """
+        if self._getter is None:
+            assert self.expression, f'Aggregate expression must be specified: {self.name}'
+            self._getter = _value_getter(self.expression)
+        value = self._getter(context)
+        if value is not None:
+            self.add(value)
+        context[self.name] = self.value
+
+    def add(self, value):
+        self.count += 1
+
+    @property
+    def value(self):
+        return self.count
+
+    def get_state(self) -> dict:
+        """
+        Copy of the accumulated values, used to resume a preparation (see Section)
+        :return:
+        """
+        return {k: copy.copy(v) for k, v in vars(self).items() if k != '_getter'}
+
+    def set_state(self, state: dict):
+        self.__dict__.update({k: copy.copy(v) for k, v in state.items()})
+
+
+class CountAggregate(Aggregate):
+    function = 'count'
+
+    def update(self, context):
+        if self.expression is None:
+            # count the rows
+            self.count += 1
+            context[self.name] = self.count
+        else:
+            super().update(context)
+
+
+class SumAggregate(Aggregate):
+    function = 'sum'
+
+    def reset(self, context=None):
+        self.total = 0
+        super().reset(context)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+
+    @property
+    def value(self):
+        return self.total
+
+
+class AvgAggregate(SumAggregate):
+    function = 'avg'
+
+    @property
+    def value(self):
+        if self.count:
+            return self.total / self.count
+        return 0
+
+
+class MinAggregate(Aggregate):
+    function = 'min'
+
+    def reset(self, context=None):
+        self.current = None
+        super().reset(context)
+
+    def add(self, value):
+        self.count += 1
+        if self.current is None or value < self.current:
+            self.current = value
+
+    @property
+    def value(self):
+        return self.current
+
+
+class MaxAggregate(MinAggregate):
+    function = 'max'
+
+    def add(self, value):
+        self.count += 1
+        if self.current is None or value > self.current:
+            self.current = value
+
+
+class DistinctCountAggregate(Aggregate):
+    function = 'distinct'
+
+    def reset(self, context=None):
+        self.values = set()
+        super().reset(context)
+
+    def add(self, value):
+        self.values.add(value)
+
+    @property
+    def value(self):
+        return len(self.values)
+
+
+AGGREGATES = {
+    'sum': SumAggregate,
+    'count': CountAggregate,
+    'avg': AvgAggregate,
+    'min': MinAggregate,
+    'max': MaxAggregate,
+    'distinct': DistinctCountAggregate,
+}
+
+
+def _value_getter(expression: str):
+    # simple field references are read directly from the record, other expressions are evaluated by jinja
+    from reptile.bands.expressions import parse_field, field_getter, compile_expression, _MISSING
+    if field := parse_field(expression):
+        name, is_item, key = field
+        get = field_getter(is_item, key)
+
+        def getter(context):
+            rec = context.get(name)
+            if rec is None:
+                return None
+            value = get(rec)
+            return None if value is _MISSING else value
+        return getter
+    return partial(eval_expression, compile_expression(expression))
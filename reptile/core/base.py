@@ -4,7 +4,7 @@ import re
 
 from jinja2 import Template
 
-from reptile import EnvironmentSettings
+from reptile import EnvironmentSettings, render_template
 from .units import mm
 
 ERROR_TEXT = '-'
@@ -132,10 +132,27 @@ class Highlight:
             if background:
                 self.background = background.get('color')
 
-    def eval_condition(self, context):
+    @property
+    def template(self) -> Template:
         if self._template is None:
-            self._template = EnvironmentSettings.env.from_string('{{%s}}' % self.condition)
-        return self._template.render(**context).strip() == 'True'
+            self._template = EnvironmentSettings.template_cache.from_string('{{%s}}' % self.condition)
+        return self._template
+
+    def dump(self) -> Optional[dict]:
+        if self.condition is None:
+            return None
+        return {
+            'condition': self.condition,
+            'font': {'name': self.font_name, 'size': self.font_size},
+            'color': self.color,
+            'brushStyle': self.brush_style,
+            'background': {'color': self.background},
+        }
+
+    def eval_condition(self, context):
+        if self.condition is None:
+            return False
+        return render_template(self.template, context).strip() == 'True'
 
 
 class Padding:
@@ -170,6 +187,14 @@ class Margin:
         self.right = right * mm
         self.bottom = bottom * mm
 
+    def dump(self) -> dict:
+        return {
+            'left': self.left,
+            'top': self.top,
+            'right': self.right,
+            'bottom': self.bottom,
+        }
+
 
 class BasePage(ReportObject):
     pass
@@ -0,0 +1,171 @@
+from typing import Optional
+from collections import OrderedDict
+import hashlib
+import logging
+import threading
+import json
+import time
+import os
+
+from reptile.runtime import binary
+
+logger = logging.getLogger('reptile')
+
+
+class PreparedReportCache:
+    """
+    Opt-in cache of prepared reports.
+    The key is a hash of the report layout (Report.dump), the level, the report variables and context,
+    and the fingerprints of the datasources (SQL text and parameters, a `version` token set by the caller,
+    or a hash of the rows of an in-memory list).
+    Reports with a datasource that can't be identified are prepared without cache.
+    Documents are stored as binary containers (see runtime.binary), in memory with a size based LRU eviction
+    and optionally on disk.
+    :param max_size: max size in bytes of the documents kept in memory
+    :param directory: directory of the disk cache, disabled by default
+    :param ttl: seconds before an entry expires, entries never expire by default
+    """
+    def __init__(self, max_size=64 * 1024 * 1024, directory: str = None, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.directory = directory
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, report, level=3) -> Optional[str]:
+        """
+        Compute the cache key of the report, None when a datasource can't be identified
+        :param report:
+        :param level:
+        :return:
+        """
+        fingerprints = {}
+        for ds in report.datasources:
+            fp = ds.fingerprint()
+            if fp is None:
+                return None
+            fingerprints[ds.name] = fp
+        structure = {
+            'layout': report.dump(),
+            'level': level,
+            'variables': report.variables,
+            'context': report.context,
+            'datasources': fingerprints,
+        }
+        data = json.dumps(structure, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def prepare(self, report, level=3) -> binary.BinaryDocument:
+        """
+        Get the prepared document of the report from the cache, preparing and storing it on a miss
+        :param report:
+        :param level:
+        :return: the prepared document as a BinaryDocument, on a hit or on a miss
+        """
+        key = self.key(report, level)
+        if key is None:
+            logger.debug('Report not cacheable, a datasource has no fingerprint')
+            data = binary.dumps(report.prepare(level))
+        else:
+            doc = self.get(key)
+            if doc is not None:
+                report.page_count = len(doc)
+                return doc
+            data = self.put(key, report.prepare(level))
+        # the cached copy is the final document
+        report.release_prepare_state()
+        return binary.BinaryDocument(data)
+
+    def get(self, key: str) -> Optional[binary.BinaryDocument]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, data = entry
+                if self._expired(created):
+                    self._remove(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return binary.BinaryDocument(data)
+        filename = self._filename(key)
+        if filename and os.path.exists(filename):
+            if self._expired(os.path.getmtime(filename), time.time()):
+                self._unlink(filename)
+            else:
+                # read into memory, the document doesn't keep the file open
+                with open(filename, 'rb') as f:
+                    data = f.read()
+                with self._lock:
+                    self.hits += 1
+                return binary.BinaryDocument(data)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, document) -> bytes:
+        """
+        Store a prepared document
+        :param key:
+        :param document: a prepared document (ReportStream) or an iterable of pages
+        :return: the binary container of the document
+        """
+        data = binary.dumps(document)
+        if len(data) <= self.max_size:
+            with self._lock:
+                self._remove(key)
+                self._entries[key] = (time.monotonic(), data)
+                self.size += len(data)
+                while self.size > self.max_size:
+                    self._remove(next(iter(self._entries)))
+        filename = self._filename(key)
+        if filename:
+            tmp = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, filename)
+        return data
+
+    def _expired(self, created: float, now: float = None) -> bool:
+        if self.ttl is None:
+            return False
+        return (time.monotonic() if now is None else now) - created > self.ttl
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def _filename(self, key: str) -> Optional[str]:
+        if self.directory:
+            return os.path.join(self.directory, f'{key}.rptb')
+
+    @staticmethod
+    def _unlink(filename: str):
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._remove(key)
+        filename = self._filename(key)
+        if filename:
+            self._unlink(filename)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.rptb'):
+                    self._unlink(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return len(self._entries)
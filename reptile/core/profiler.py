@@ -0,0 +1,198 @@
+from typing import Dict, List, Optional
+import json
+import time
+import tracemalloc
+
+_clock = time.perf_counter
+
+
+class ProfileNode:
+    """
+    Statistics of a frame of the preparation (report, page, band, object), by call path
+    """
+    __slots__ = ('name', 'calls', 'time', 'memory', 'children')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.time = 0.0
+        # net allocated bytes, only when the allocations are tracked
+        self.memory = 0
+        self.children: Dict[str, 'ProfileNode'] = {}
+
+    @property
+    def self_time(self) -> float:
+        return max(self.time - sum(child.time for child in self.children.values()), 0.0)
+
+    def dump(self) -> dict:
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'time': self.time,
+            'selfTime': self.self_time,
+            'memory': self.memory,
+            'children': [child.dump() for child in self.children.values()],
+        }
+
+
+class PrepareProfiler:
+    """
+    Opt-in profiler of the report preparation.
+    Records the wall time, call count and optionally the allocated memory of the pages, bands and objects,
+    by call path (e.g. page / group / data band / band / object), and the time spent fetching the data.
+    Results can be exported to JSON or to the collapsed stack format used by flame graph tools.
+    Usage::
+
+        profiler = PrepareProfiler()
+        report.profiler = profiler
+        report.prepare()
+        profiler.save_collapsed('prepare.folded')
+
+    :param memory: track the allocated memory with tracemalloc (slower)
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.root = ProfileNode('report')
+        self.datasource_timings: Dict[str, float] = {}
+        self._stack: List[list] = []
+        self._started_tracing = False
+        self.active = False
+
+    def start(self, report=None):
+        """
+        Start profiling a preparation, called by Report.prepare
+        :param report:
+        :return:
+        """
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._stack = []
+        self.active = True
+        self._push(self.root)
+
+    def stop(self, report=None):
+        """
+        Finish the preparation profile, called at the end of Report.prepare
+        :param report:
+        :return:
+        """
+        if not self.active:
+            return
+        self.active = False
+        while self._stack:
+            self.exit()
+        if report is not None:
+            self.add_datasource_timings(report.datasource_timings)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def add_datasource_timings(self, timings: Dict[str, float]):
+        node = self.root.children.get('datasources')
+        if node is None:
+            node = self.root.children['datasources'] = ProfileNode('datasources')
+        for name, seconds in timings.items():
+            self.datasource_timings[name] = self.datasource_timings.get(name, 0.0) + seconds
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = ProfileNode(name)
+            child.calls += 1
+            child.time += seconds
+            node.time += seconds
+
+    def _push(self, node: ProfileNode):
+        self._stack.append([node, _clock(), tracemalloc.get_traced_memory()[0] if self.memory else 0])
+
+    def enter(self, obj):
+        """
+        Enter the frame of an object (page, band or band object), the frames are named by type and name
+        :param obj: the object or the frame name
+        :return:
+        """
+        if isinstance(obj, str):
+            name = obj
+        else:
+            name = getattr(obj, 'name', None)
+            name = f'{type(obj).__name__}:{name}' if name else type(obj).__name__
+        children = self._stack[-1][0].children
+        node = children.get(name)
+        if node is None:
+            node = children[name] = ProfileNode(name)
+        self._push(node)
+
+    def exit(self):
+        node, start, memory = self._stack.pop()
+        node.calls += 1
+        node.time += _clock() - start
+        if self.memory:
+            node.memory += tracemalloc.get_traced_memory()[0] - memory
+
+    def iter_rows(self, rows, name: str):
+        """
+        Iterate the rows of a datasource, the time spent fetching each row is recorded in the `fetch:<name>` frame
+        :param rows:
+        :param name: datasource name
+        :return:
+        """
+        frame = f'fetch:{name}'
+        it = iter(rows)
+        while True:
+            self.enter(frame)
+            try:
+                row = next(it)
+            except StopIteration:
+                self.exit()
+                return
+            self.exit()
+            yield row
+
+    def find(self, *path: str) -> Optional[ProfileNode]:
+        """
+        Find the statistics of a frame by its path, e.g. find('Page', 'DataBand:band1')
+        :param path:
+        :return:
+        """
+        node = self.root
+        for name in path:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def dump(self) -> dict:
+        return {
+            'profile': self.root.dump(),
+            'datasources': dict(self.datasource_timings),
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.dump(), **kwargs)
+
+    def save_json(self, filename: str):
+        with open(filename, 'w') as f:
+            f.write(self.to_json(indent=2))
+
+    def to_collapsed(self, unit=1e6) -> str:
+        """
+        Export the self time of each call path in the collapsed stack format ("a;b;c value"),
+        the input of flamegraph.pl, speedscope and similar tools
+        :param unit: time unit multiplier, microseconds by default
+        :return:
+        """
+        lines = []
+
+        def walk(node: ProfileNode, prefix: str):
+            path = f'{prefix};{node.name}' if prefix else node.name
+            value = int(node.self_time * unit)
+            if value:
+                lines.append(f'{path} {value}')
+            for child in node.children.values():
+                walk(child, path)
+
+        walk(self.root, '')
+        return '\n'.join(lines) + '\n'
+
+    def save_collapsed(self, filename: str):
+        with open(filename, 'w') as f:
+            f.write(self.to_collapsed())
@@ -1,5 +1,9 @@
-from typing import List, TYPE_CHECKING, Iterable, Optional, TypedDict
+from typing import List, TYPE_CHECKING, Iterable, Iterator, Optional, TypedDict
 import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import queue
+import time
 from pathlib import Path
 from enum import Enum
 import json
@@ -8,10 +12,24 @@ from decimal import Decimal
 import reptile
 from reptile import EnvironmentSettings
 from reptile.core.base import ReportObject, Margin, BasePage
+from reptile.core.aggregates import Aggregate
 from reptile.runtime import ReportStream, PreparedPage
 from reptile.core.units import mm
 if TYPE_CHECKING:
     from reptile.data.base import DataSource
+    from reptile.runtime.lazy import LazyDocument
+    from reptile.core.profiler import PrepareProfiler
+
+
+_END_OF_STREAM = object()
+
+
+class _PrepareCancelled(Exception):
+    pass
+
+
+def _discard_page(page):
+    pass
 
 
 class ReportType(Enum):
@@ -25,9 +43,17 @@ class Report:
     title: str = None
     page_count = 0
     _pending_objects: list = None
+    # engine states recorded by the last preparation (see reprepare)
+    _sections: list = None
+    # aggregates updated by the rows of the data bands (report and open groups)
+    _active_aggregates: list = None
     _level = 3
+    # max datasources opened concurrently
+    max_workers = 4
     # prepared document stream
     stream: 'ReportStream' = None
+    # opt-in preparation profiler (see core.profiler)
+    profiler: 'PrepareProfiler' = None
 
     def __init__(self, file: str | Path | dict = None, default_connection=None):
         self.pages: List[BasePage] = []
@@ -36,6 +62,8 @@ class Report:
         self.variables = {}
         self.objects = []
         self.context = {}
+        self.aggregates: List[Aggregate] = []
+        self.datasource_timings = {}
         # default database connection
         self.connection = default_connection
         self._context = None
@@ -56,7 +84,12 @@ class Report:
                 datasource = self.connection.datasource_factory(name=ds.get('name'), sql=ds['sql'])
             else:
                 datasource = reptile.data.base.DataSource(ds.get('data'), ds.get('name'))
+            if 'prefetch' in ds:
+                datasource.prefetch = ds['prefetch']
+            datasource.depends_on = ds.get('dependsOn')
             self.register_datasource(datasource)
+        for agg in rep.get('aggregates', ()):
+            self.aggregates.append(Aggregate.create(agg))
         for p in rep['pages']:
             from reptile.bands import Page
             page = Page()
@@ -67,6 +100,7 @@ class Report:
         return {
             'report': {
                 'datasources': [ds.dump() for ds in self.datasources],
+                'aggregates': [agg.dump() for agg in self.aggregates],
                 'pages': [p.dump() for p in self.pages]
             }
         }
@@ -90,43 +124,314 @@ class Report:
         self.add_page(page)
         return page
 
-    def prepare(self, level=3) -> ReportStream:
+    def prepare(
+        self, level=3, on_page=None, page_count: int = None, packed=False, hold_pending=True, track_sections=False,
+    ) -> ReportStream:
+        """
+        Prepare the report document
+        :param level: preparation level
+        :param on_page: streaming mode, closed pages are sent to this callback instead of being kept by the stream
+        :param page_count: page count known in advance (computed by a previous pass)
+        :param packed: keep the closed pages as compact packed pages (see runtime.packed)
+        :param hold_pending: streaming mode, hold the pages with page count dependent objects until the end
+        :param track_sections: record the engine state before each root band and the datasource fingerprints,
+            so `reprepare` can resume the preparation (ignored in streaming and packed modes)
+        :return:
+        """
         self._level = level
-        self.stream = stream = ReportStream(self)
+        if self.profiler is not None:
+            self.profiler.start(self)
+        self.stream = stream = ReportStream(self, on_page, page_count, packed, hold_pending)
         self._pending_objects = []
+        # the sections are recorded only when the pages are kept unchanged by the stream
+        self._sections = [] if track_sections and on_page is None and not packed else None
+        self._resolved_objects = []
         self.page_count = 0
         self._context = {
             'page_index': 0,
-            'page_count': 0,
+            'page_count': page_count or 0,
             'report': self,
             'date': datetime.date.today(),
             'time': datetime.datetime.now().strftime('%H:%M'),
             'params': self.variables,
         }
         self._context.update(self.context)
+        self._active_aggregates = list(self.aggregates)
+        for agg in self.aggregates:
+            agg.reset(self._context)
         # detect subreports
         # for obj in self.objects:
         #     if isinstance(obj, SubReport):
         #         obj.report_page = self[obj.page_name]
         # initialize context with datasource
+        self.open_datasources()
+        if self._sections is not None:
+            self._prepared_variables = dict(self.variables)
+            self._fingerprints = {ds.name: ds.fingerprint() for ds in self.datasources}
         for ds in self.datasources:
-            if ds.name and hasattr(ds, 'params'):
-                ds.params.assign(self.variables)
-                ds.open(self.variables)
             # init data context
-            data = ds.data
-            self._context[ds.name] = data if isinstance(data, dict) else DataProxy(data)
+            self._set_data_context(ds)
 
         for page in self.pages:
             if not page.subreport:
                 page.prepare(stream.pages)
 
+        return self._finish_prepare()
+
+    def _set_data_context(self, ds: 'DataSource'):
+        data = ds.data
+        self._context[ds.name] = data if isinstance(data, dict) else DataProxy(data)
+
+    def _finish_prepare(self) -> ReportStream:
         self._context['page_count'] = self.page_count
-        for txt, obj in self._pending_objects:
-            obj.text = txt.render(self._context)
+        self.resolve_pending()
+        self.stream.flush()
 
         self.execute()
-        return stream
+        if self.profiler is not None:
+            self.profiler.stop(self)
+        return self.stream
+
+    def reprepare(self, changed: Iterable[str] = None) -> ReportStream:
+        """
+        Prepare the report again after a change of the variables or of the parameters of some datasources.
+        The pages prepared before the first root band depending on the changes are kept,
+        the preparation is resumed from this band; the changed datasources are opened again.
+        A full preparation, tracking the sections, is done when the page header, footer or title depend
+        on the changes or when the last preparation didn't track the sections (see prepare).
+        :param changed: names of the changed datasources, by default the datasources whose
+            fingerprint (e.g. SQL parameters) changed since the last preparation
+        :return:
+        """
+        if self._sections is None or self.stream is None:
+            return self.prepare(self._level, track_sections=True)
+        changed = set(changed or ())
+        if self.variables != self._prepared_variables:
+            changed.add('params')
+        for ds in self.datasources:
+            if hasattr(ds, 'params'):
+                ds.params.assign(self.variables)
+            if ds.fingerprint() != self._fingerprints.get(ds.name):
+                changed.add(ds.name)
+        # the datasources depending on a changed datasource are changed too
+        while True:
+            dependents = {
+                ds.name for ds in self.datasources
+                if ds.name not in changed and changed.intersection(ds.depends_on or ())
+            }
+            if not dependents:
+                break
+            changed.update(dependents)
+        if not changed:
+            return self.stream
+        if any(changed.intersection(page.get_dependencies()) for page in self.pages):
+            for ds in self.datasources:
+                if ds.name in changed:
+                    self._reopen_datasource(ds)
+            return self.prepare(self._level, track_sections=True)
+        for i, section in enumerate(self._sections):
+            if changed.intersection(section.get_dependencies()):
+                break
+        else:
+            self._prepared_variables = dict(self.variables)
+            return self.stream
+        del self._sections[i:]
+        context = self._context
+        context.clear()
+        context.update(section.context)
+        context['params'] = self.variables
+        self._prepared_variables = dict(self.variables)
+        for ds in self.datasources:
+            if ds.name in changed:
+                self._reopen_datasource(ds)
+                self._fingerprints[ds.name] = ds.fingerprint()
+                self._set_data_context(ds)
+        self._pending_objects = self._resolved_objects[:section.pending_count]
+        self._resolved_objects = []
+        pages = [page for page in self.pages if not page.subreport]
+        section.page.prepare(self.stream.pages, section)
+        for page in pages[pages.index(section.page) + 1:]:
+            page.prepare(self.stream.pages)
+        return self._finish_prepare()
+
+    def release_prepare_state(self):
+        """
+        Release the state kept for `reprepare` (sections and page count dependent objects) once the document
+        is final, the next reprepare is a full preparation
+        :return:
+        """
+        self._sections = None
+        self._resolved_objects = []
+        self._pending_objects = []
+
+    def _reopen_datasource(self, ds: 'DataSource'):
+        # only the datasources with parameters fetch their data again, the others keep their data
+        if hasattr(ds, 'params'):
+            ds.close()
+            self.open_datasource(ds)
+
+    def iter_pages(
+        self, level=3, double_pass=False, buffer_size=1, hold_pending=True,
+    ) -> Iterator[PreparedPage]:
+        """
+        Prepare the report yielding each page as soon as it is closed by the band engine.
+        Pages containing page count dependent objects (${...}) are held until the end of the preparation,
+        unless double_pass is set, in that case a first pass computes the page count and the pages
+        are released as soon as they are closed.
+        :param level: preparation level
+        :param double_pass: run a first pass to compute the page count
+        :param buffer_size: max number of prepared pages waiting for the consumer
+        :param hold_pending: hold the pages with page count dependent objects, otherwise these pages are
+            released unresolved and their objects are rendered in place at the end of the preparation
+        :return:
+        """
+        page_count = None
+        if double_pass:
+            self.prepare(level, on_page=_discard_page, page_count=0)
+            page_count = self.page_count
+
+        pages = queue.Queue(maxsize=buffer_size)
+        cancelled = threading.Event()
+
+        def emit(page):
+            while True:
+                if cancelled.is_set():
+                    raise _PrepareCancelled()
+                try:
+                    pages.put(page, timeout=.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def run():
+            try:
+                self.prepare(level, on_page=emit, page_count=page_count, hold_pending=hold_pending)
+                emit(_END_OF_STREAM)
+            except _PrepareCancelled:
+                pass
+            except BaseException as e:
+                try:
+                    emit(e)
+                except _PrepareCancelled:
+                    pass
+
+        worker = threading.Thread(target=run, name='reptile-prepare', daemon=True)
+        worker.start()
+        try:
+            while True:
+                page = pages.get()
+                if page is _END_OF_STREAM:
+                    break
+                if isinstance(page, BaseException):
+                    raise page
+                yield page
+        finally:
+            cancelled.set()
+            worker.join()
+
+    def prepare_lazy(self, level=3) -> 'LazyDocument':
+        """
+        Prepare the report on demand, the pages are produced when they are requested (see LazyDocument)
+        :param level: preparation level
+        :return:
+        """
+        from reptile.runtime.lazy import LazyDocument
+        return LazyDocument(self, level)
+
+    def resolve_pending(self):
+        """
+        Render the objects that depend on the page count
+        :return:
+        """
+        context = self._context
+        page_count = context['page_count']
+        for placeholders, obj, page_index in self._pending_objects:
+            obj.text = placeholders.render(page_index, page_count, context)
+        if self._sections is not None:
+            # rendered again by reprepare
+            self._resolved_objects.extend(self._pending_objects)
+        self._pending_objects.clear()
+
+    def open_datasources(self):
+        """
+        Open the report datasources, up to `max_workers` datasources are opened concurrently.
+        A datasource is only opened after the datasources listed in its `depends_on` attribute.
+        Only the datasources reading their data when they are opened (not `in_memory`) on a thread safe
+        connection (ConnectionPool, every query runs on its own pooled connection) or without connection are
+        opened by the workers, the other datasources are opened by the calling thread, one at a time.
+        SQL datasources fetch their rows lazily, unless their `prefetch` attribute is set.
+        The time spent opening each datasource is stored in `datasource_timings`, by name
+        (unnamed datasources are keyed by their position, e.g. "#2").
+        :return:
+        """
+        self.datasource_timings = {}
+        pending = {id(ds): ds for ds in self.datasources}
+        names = {ds.name for ds in self.datasources}
+        for ds in self.datasources:
+            for dep in ds.depends_on or ():
+                if dep not in names:
+                    raise ValueError(f'Datasource "{ds.name}" depends on an unknown datasource "{dep}"')
+
+        def in_worker(ds: 'DataSource'):
+            if ds.in_memory:
+                return False
+            conn = ds.connection
+            return conn is None or getattr(conn, 'thread_safe', False)
+
+        open_datasource = self.open_datasource
+        opened_names = set()
+        if self.max_workers <= 1 or not any(in_worker(ds) for ds in pending.values()):
+            while pending:
+                ready = [ds for ds in pending.values() if all(dep in opened_names for dep in ds.depends_on or ())]
+                if not ready:
+                    raise ValueError('Circular dependency between datasources')
+                for ds in ready:
+                    open_datasource(ds)
+                    opened_names.add(ds.name)
+                    del pending[id(ds)]
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='reptile-open') as executor:
+            running = {}
+            while pending or running:
+                ready = [ds for ds in pending.values() if all(dep in opened_names for dep in ds.depends_on or ())]
+                local = []
+                for ds in ready:
+                    del pending[id(ds)]
+                    if in_worker(ds):
+                        running[executor.submit(open_datasource, ds)] = ds
+                    else:
+                        local.append(ds)
+                # a connection that is not thread safe is only used by the calling thread,
+                # its datasources are opened while the workers open the other datasources
+                for ds in local:
+                    open_datasource(ds)
+                    opened_names.add(ds.name)
+                if local:
+                    continue
+                if not running:
+                    raise ValueError('Circular dependency between datasources')
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    ds = running.pop(fut)
+                    # propagate the first error
+                    fut.result()
+                    opened_names.add(ds.name)
+
+    def open_datasource(self, ds: 'DataSource'):
+        """
+        Open a datasource and record the time spent
+        :param ds:
+        :return:
+        """
+        start = time.perf_counter()
+        if ds.name and hasattr(ds, 'params'):
+            ds.params.assign(self.variables)
+            ds.open(self.variables)
+        else:
+            ds.open()
+        key = ds.name or f'#{self.datasources.index(ds)}'
+        self.datasource_timings[key] = time.perf_counter() - start
 
     def get_datasource(self, name):
         for ds in self.datasources:
@@ -249,13 +554,16 @@ class DataProxy:
         self.data = data
 
     def __getattr__(self, item):
-        if self.data and isinstance(self.data, list):
+        if self.data and (isinstance(self.data, list) or hasattr(self.data, 'column')):
             obj = self.data[0]
             if hasattr(obj, item):
                 return getattr(obj, item)
             return self.data[0][item]
 
     def values(self, item):
+        if hasattr(self.data, 'column'):
+            # columnar data, return the column array
+            return self.data.column(item)
         return [rec[item] or Decimal(0.00) if isinstance(rec, dict) else getattr(rec, item) for rec in self.data]
 
     def __iter__(self):
@@ -1,6 +1,11 @@
-from typing import Optional, Iterable
+from typing import Optional, Iterable, List
+import hashlib
+import pickle
+import copy
 
 from reptile.core import ReportObject, Report
+from .buffer import StreamedData
+from .connection import parse_sql
 
 
 class DataSource(ReportObject):
@@ -9,6 +14,12 @@ class DataSource(ReportObject):
     _report = None
     connection = None
     name: str = None
+    # names of the datasources that must be opened before this one (master/detail)
+    depends_on: List[str] = None
+    # caller supplied token identifying the version of the data (see PreparedReportCache)
+    version = None
+    # the data is kept in memory, opening the datasource does no I/O (see Report.open_datasources)
+    in_memory = True
 
     def __init__(self, data = None, name: str = None):
         self._data = data
@@ -27,6 +38,35 @@ class DataSource(ReportObject):
             self.open()
         return self._data
 
+    def fingerprint(self):
+        """
+        Identify the data of the datasource: the `version` token when it is set, otherwise a hash of the rows
+        of an in-memory list (set `version` to skip the hash of large lists).
+        None if the data can't be identified, e.g. rows streamed from an iterator
+        :return:
+        """
+        if self.version is not None:
+            return self.version
+        if isinstance(self._data, (list, tuple)):
+            try:
+                return hashlib.sha256(pickle.dumps(self._data, pickle.HIGHEST_PROTOCOL)).hexdigest()
+            except (pickle.PicklingError, TypeError, AttributeError):
+                return None
+
+    def clone(self) -> 'DataSource':
+        """
+        Copy of the datasource definition, without report
+        :return:
+        """
+        ds = copy.copy(self)
+        ds._report = None
+        return ds
+
+    def dump(self) -> dict:
+        return {
+            'name': self.name,
+        }
+
     def set_report(self, value: Report):
         if self._report and self in self._report.pages:
             self._report.datasources.remove(self)
@@ -35,5 +75,112 @@ class DataSource(ReportObject):
             value.datasources.append(self)
 
 
+class SQLParams(dict):
+    """
+    Named parameters of a SQL datasource (`:name` markers in the SQL text).
+    The revision is incremented when a value changes, so the fetched rows can be invalidated.
+    """
+    revision = 0
+
+    def __setitem__(self, key, value):
+        if key not in self or self[key] != value:
+            self.revision += 1
+        super().__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def assign(self, values: dict):
+        for k in self:
+            if k in values:
+                self[k] = values[k]
+
+
 class SQLDataSource(DataSource):
-    sql: str = None
+    """
+    SQL datasource streaming its rows from a server-side cursor.
+    Rows are fetched in batches of `batch_size` while the bands iterate the data, a single pass keeps no rows.
+    The rows are kept (spilled to disk above `spill_threshold` rows) when they are read again,
+    see StreamedData. The data is fetched again when a parameter changes.
+    """
+    _sql: str = None
+    batch_size = 1000
+    spill_threshold = 10000
+    # fetch the rows when the datasource is opened
+    prefetch = False
+    in_memory = False
+    # params revision of the fetched data
+    _revision = None
+
+    def __init__(self, name: str = None, sql: str = None, connection=None, params: dict = None):
+        super().__init__(None, name)
+        self.params = SQLParams()
+        self.connection = connection
+        self.sql = sql
+        if params:
+            self.params.update(params)
+
+    @property
+    def sql(self) -> str:
+        return self._sql
+
+    @sql.setter
+    def sql(self, value: str):
+        self._sql = value
+        # the parameters of the sql are declared with no value
+        if value:
+            for name in parse_sql(value, '?')[1]:
+                self.params.setdefault(name, None)
+
+    @property
+    def data(self):
+        if self._opened and self._revision != self.params.revision:
+            # the parameters changed since the rows were fetched
+            self._data.close()
+            self._opened = False
+        return super().data
+
+    def open(self, params: dict = None):
+        if params:
+            self.params.assign(params)
+        if self._opened and self._revision != self.params.revision:
+            self._data.close()
+            self._opened = False
+        if not self._opened:
+            self._data = StreamedData(self._execute, self.spill_threshold)
+            self._revision = self.params.revision
+            self._opened = True
+            if self.prefetch:
+                self.fetch()
+
+    def fetch(self):
+        """
+        Execute the query and fetch all the rows, kept for the passes of the bands
+        :return:
+        """
+        self.data.buffer
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+        super().close()
+
+    def _execute(self):
+        return self.connection.iter_execute(self.sql, self.params, batch_size=self.batch_size)
+
+    def fingerprint(self):
+        return [self.sql, dict(self.params), self.version]
+
+    def clone(self) -> 'SQLDataSource':
+        ds = super().clone()
+        ds._data = None
+        ds._opened = False
+        ds.params = SQLParams(self.params)
+        return ds
+
+    def dump(self) -> dict:
+        return {
+            'name': self.name,
+            'sql': self.sql,
+        }
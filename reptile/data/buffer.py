@@ -0,0 +1,179 @@
+from typing import Callable, Iterable, Iterator, List
+from array import array
+import itertools
+import pickle
+import tempfile
+
+
+class SpillBuffer:
+    """
+    Random access sequence of rows stored in a temporary file.
+    Only the file offsets are kept in memory.
+    """
+    def __init__(self, rows: Iterable = ()):
+        self._file = tempfile.TemporaryFile()
+        self._offsets = array('q')
+        for row in rows:
+            self.append(row)
+
+    def append(self, row):
+        f = self._file
+        f.seek(0, 2)
+        self._offsets.append(f.tell())
+        pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        self._file.seek(self._offsets[item])
+        return pickle.load(self._file)
+
+    def __iter__(self):
+        f = self._file
+        load = pickle.load
+        for offset in self._offsets:
+            f.seek(offset)
+            yield load(f)
+
+    def close(self):
+        self._file.close()
+
+
+class StreamedData:
+    """
+    Rows fetched on demand from a row iterator factory (e.g. a server-side cursor).
+    The first pass streams the rows from the source without keeping them.
+    The rows are kept only when they are read again: a second pass calls the factory again and keeps
+    the rows for the next passes, random access (len, indexing) fetches and keeps all rows.
+    The kept rows are stored in a list for small results, in a SpillBuffer above the spill threshold.
+    """
+    def __init__(self, factory: Callable[[], Iterator], spill_threshold=10000):
+        self._factory = factory
+        self.spill_threshold = spill_threshold
+        # source peeked by __bool__, read by the next pass: (peeked rows, iterator)
+        self._pending = None
+        # a pass streamed the rows without keeping them
+        self._streamed = False
+        self._has_rows = None
+        # source of the kept rows and rows kept so far
+        self._source = None
+        self._rows = None
+        self._complete = False
+
+    @property
+    def buffered(self) -> bool:
+        return self._complete
+
+    def __iter__(self):
+        if self._complete:
+            return iter(self._rows)
+        if self._rows is None and not self._streamed:
+            self._streamed = True
+            return self._stream()
+        return self._iter_rows()
+
+    def _next_source(self):
+        # the source peeked by __bool__, or a new call of the factory
+        pending = self._pending
+        if pending is None:
+            return (), iter(self._factory())
+        self._pending = None
+        return pending
+
+    def _stream(self):
+        # single pass, the rows are not kept
+        head, source = self._next_source()
+        try:
+            rows = itertools.chain(head, source)
+            row = next(rows, _END)
+            self._has_rows = row is not _END
+            if row is _END:
+                return
+            yield row
+            yield from rows
+        finally:
+            _close(source)
+
+    def _iter_rows(self):
+        # read the rows already kept, then fetch and keep the next rows from the source
+        if self._rows is None:
+            self._start()
+        i = 0
+        while True:
+            rows = self._rows
+            if i < len(rows):
+                yield rows[i]
+                i += 1
+            elif self._complete:
+                return
+            else:
+                row = self._fetch()
+                if row is _END:
+                    return
+                yield row
+                i += 1
+
+    def _start(self):
+        head, self._source = self._next_source()
+        self._rows = list(head)
+
+    def _fetch(self):
+        row = next(self._source, _END)
+        if row is _END:
+            self._complete = True
+            self._source = None
+            return row
+        rows = self._rows
+        if isinstance(rows, list) and len(rows) >= self.spill_threshold:
+            rows = self._rows = SpillBuffer(rows)
+        rows.append(row)
+        return row
+
+    def __bool__(self):
+        if self._rows is not None:
+            return len(self._rows) > 0 or len(self.buffer) > 0
+        if self._has_rows is None:
+            # the first row is peeked, the source is read by the next pass
+            source = iter(self._factory())
+            row = next(source, _END)
+            self._has_rows = row is not _END
+            self._pending = ((row,) if self._has_rows else ()), source
+        return self._has_rows
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __getitem__(self, item):
+        return self.buffer[item]
+
+    @property
+    def buffer(self):
+        if not self._complete:
+            if self._rows is None:
+                self._start()
+            while self._fetch() is not _END:
+                pass
+        return self._rows
+
+    def close(self):
+        if isinstance(self._rows, SpillBuffer):
+            self._rows.close()
+        # release the cursors of the unfinished fetches
+        if self._pending is not None:
+            _close(self._pending[1])
+        _close(self._source)
+        self._pending = self._source = None
+        self._rows = self._has_rows = None
+        self._streamed = self._complete = False
+
+
+def _close(source):
+    close = getattr(source, 'close', None)
+    if close is not None:
+        close()
+
+
+_END = object()
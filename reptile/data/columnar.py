@@ -0,0 +1,159 @@
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .base import DataSource
+
+
+class ColumnarRow:
+    """
+    Lightweight view of a row of a columnar dataset.
+    Values are read from the column arrays on access, with attribute and item access (like RecordHelper).
+    """
+    __slots__ = ('_columns', '_index')
+
+    def __init__(self, columns: Dict[str, np.ndarray], index: int):
+        self._columns = columns
+        self._index = index
+
+    def __getitem__(self, item):
+        return self._columns[item][self._index]
+
+    def __getattr__(self, item):
+        try:
+            return self._columns[item][self._index]
+        except KeyError:
+            raise AttributeError(item)
+
+    def __contains__(self, item):
+        return item in self._columns
+
+    def get(self, item, default=None):
+        col = self._columns.get(item)
+        if col is None:
+            return default
+        return col[self._index]
+
+    def keys(self):
+        return self._columns.keys()
+
+    def to_dict(self) -> dict:
+        i = self._index
+        return {k: col[i] for k, col in self._columns.items()}
+
+    def __repr__(self):
+        return f'<ColumnarRow {self._index}>'
+
+
+class ColumnarData:
+    """
+    Sequence of records stored as one array per column
+    """
+    __slots__ = ('columns', '_length')
+
+    def __init__(self, columns: Dict[str, Iterable]):
+        self.columns: Dict[str, np.ndarray] = {
+            k: v if isinstance(v, np.ndarray) else _to_array(v) for k, v in columns.items()
+        }
+        lengths = {len(col) for col in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError('All columns must have the same length')
+        self._length = lengths.pop() if lengths else 0
+
+    @classmethod
+    def from_records(cls, records: List, fields: Optional[List[str]] = None) -> 'ColumnarData':
+        """
+        Create a columnar dataset from a list of dicts or objects
+        :param records:
+        :param fields: the fields to be stored, the keys of the first record by default
+        :return:
+        """
+        if fields is None:
+            if not records:
+                return cls({})
+            rec = records[0]
+            fields = list(rec.keys() if isinstance(rec, dict) else vars(rec))
+        if records and not isinstance(records[0], dict):
+            return cls({f: [getattr(rec, f) for rec in records] for f in fields})
+        return cls({f: [rec.get(f) for rec in records] for f in fields})
+
+    @classmethod
+    def from_arrow(cls, table) -> 'ColumnarData':
+        """
+        Create a columnar dataset from an Arrow table or record batch.
+        Primitive columns without nulls are converted without copying.
+        :param table: pyarrow.Table or pyarrow.RecordBatch
+        :return:
+        """
+        return cls({
+            name: table.column(i).to_numpy(zero_copy_only=False)
+            for i, name in enumerate(table.schema.names)
+        })
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def values(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def sum(self, name: str):
+        return self.columns[name].sum()
+
+    def avg(self, name: str):
+        col = self.columns[name]
+        return col.mean() if len(col) else 0
+
+    def min(self, name: str):
+        return self.columns[name].min()
+
+    def max(self, name: str):
+        return self.columns[name].max()
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            # slices of numpy arrays are views, no data is copied
+            return ColumnarData({k: col[item] for k, col in self.columns.items()})
+        if item < 0:
+            item += self._length
+        if not 0 <= item < self._length:
+            raise IndexError(item)
+        return ColumnarRow(self.columns, item)
+
+    def __iter__(self):
+        columns = self.columns
+        for i in range(self._length):
+            yield ColumnarRow(columns, i)
+
+
+def _to_array(values) -> np.ndarray:
+    values = list(values)
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'US':
+        # keep python strings, numpy fixed width strings are not compatible with str methods in templates
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+    return arr
+
+
+class ColumnarDataSource(DataSource):
+    """
+    Datasource storing its data as numpy column arrays.
+    Accepts a dict of columns, a list of records, a ColumnarData or an Arrow table/record batch.
+    """
+    def __init__(self, data=None, name: str = None):
+        super().__init__(None, name)
+        if data is not None:
+            self.set_data(data)
+
+    def set_data(self, data):
+        if isinstance(data, ColumnarData):
+            self._data = data
+        elif isinstance(data, dict):
+            self._data = ColumnarData(data)
+        elif hasattr(data, 'schema') and hasattr(data, 'column'):
+            self._data = ColumnarData.from_arrow(data)
+        else:
+            self._data = ColumnarData.from_records(list(data))
@@ -1,12 +1,83 @@
-from reptile.engine import ReportObject
+from typing import Iterator, Tuple
+from functools import lru_cache
+import re
+
+from reptile.core import ReportObject
+
+_re_param = re.compile(r'(?<![:\w]):([A-Za-z_]\w*)')
+
+
+@lru_cache(maxsize=512)
+def parse_sql(sql: str, param_marker: str) -> Tuple[str, Tuple[str]]:
+    """
+    Parse the named parameters of the sql text
+    :param sql:
+    :param param_marker: the driver parameter marker
+    :return: the sql using the driver marker and the parameter names in order
+    """
+    names = []
+
+    def repl(m):
+        names.append(m.group(1))
+        return param_marker
+
+    return _re_param.sub(repl, sql), tuple(names)
+
+
+def fetch_rows(cur, sql: str, args: list, batch_size=1000) -> Iterator[dict]:
+    """
+    Execute the sql on the cursor and yield the rows as dicts, fetching `batch_size` rows at a time
+    """
+    if args:
+        cur.execute(sql, args)
+    else:
+        cur.execute(sql)
+    names = [col[0] for col in cur.description]
+    while rows := cur.fetchmany(batch_size):
+        for row in rows:
+            yield dict(zip(names, row))
 
 
 class BaseConnection(ReportObject):
     connection_string: str = None
     param_marker = '%s'
+    # the connection can execute queries from several threads at once
+    thread_safe = False
 
-    def execute(self, sql):
+    def execute(self, sql, *args, **kwargs):
         raise NotImplemented()
 
     def cursor(self):
         raise NotImplemented()
+
+    def prepare_sql(self, sql: str, params: dict = None):
+        """
+        Replace the named parameters (:name) by the connection parameter marker
+        :param sql:
+        :param params:
+        :return: the sql and the list of arguments
+        """
+        driver_sql, names = parse_sql(sql, self.param_marker)
+        if not names:
+            return sql, []
+        params = params or {}
+        return driver_sql, [params.get(name) for name in names]
+
+    def iter_execute(self, sql: str, params: dict = None, batch_size=1000) -> Iterator[dict]:
+        """
+        Execute the sql and yield the rows as dicts, fetching `batch_size` rows at a time
+        :param sql:
+        :param params:
+        :param batch_size:
+        :return:
+        """
+        sql, args = self.prepare_sql(sql, params)
+        cur = self.cursor()
+        try:
+            yield from fetch_rows(cur, sql, args, batch_size)
+        finally:
+            cur.close()
+
+    def datasource_factory(self, name: str = None, sql: str = None):
+        from .base import SQLDataSource
+        return SQLDataSource(name, sql=sql, connection=self)
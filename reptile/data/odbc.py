@@ -13,6 +13,9 @@ class OdbcConnection(BaseConnection):
             self._connection = pyodbc.connect(self.connection_string)
         return self._connection
 
+    def cursor(self):
+        return self.connection.cursor()
+
     def execute(self, sql, *args, **kwargs):
         conn = self.connection
         cur = conn.cursor()
@@ -0,0 +1,273 @@
+from typing import Callable, Iterator, List, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import logging
+import time
+
+from .connection import BaseConnection, fetch_rows
+
+logger = logging.getLogger('reptile')
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """
+    Database connection owned by a pool, with a per connection cache of prepared statements.
+    Statements are cached as cursors keyed by the sql text, re-executing the same sql on the
+    same cursor lets the driver reuse the prepared statement.
+    """
+    def __init__(self, raw, statement_cache_size=64):
+        self.raw = raw
+        self.created = self.last_used = time.monotonic()
+        self.statement_cache_size = statement_cache_size
+        self._statements = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire_cursor(self, sql: str):
+        """
+        Get the cursor prepared for the sql, the cursor must be returned by `release_cursor`
+        :param sql:
+        :return:
+        """
+        cur = self._statements.pop(sql, None)
+        if cur is None:
+            self.misses += 1
+            return self.raw.cursor()
+        self.hits += 1
+        return cur
+
+    def release_cursor(self, sql: str, cur):
+        if self.statement_cache_size <= 0:
+            cur.close()
+            return
+        old = self._statements.pop(sql, None)
+        if old is not None:
+            old.close()
+        self._statements[sql] = cur
+        while len(self._statements) > self.statement_cache_size:
+            _, evicted = self._statements.popitem(last=False)
+            evicted.close()
+
+    def discard_cursor(self, cur):
+        """
+        Close a cursor whose execution failed instead of caching it
+        :param cur:
+        :return:
+        """
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+    def close(self):
+        for cur in self._statements.values():
+            try:
+                cur.close()
+            except Exception:
+                pass
+        self._statements.clear()
+        self.raw.close()
+
+
+class ConnectionPool(BaseConnection):
+    """
+    Thread safe pool of database connections shared by the reports of a process.
+    The pool can be used as the report connection, every execution acquires a connection
+    and returns it to the pool at the end of the fetch.
+    :param connect: factory of DB-API connections
+    :param min_size: connections kept open
+    :param max_size: max number of connections
+    :param idle_timeout: seconds before closing an idle connection above min_size
+    :param health_check: sql or callable(raw_connection) to validate an idle connection before use
+    :param statement_cache_size: prepared statements cached by connection
+    """
+    # every execution uses its own pooled connection
+    thread_safe = True
+
+    def __init__(
+        self, connect: Callable, min_size=1, max_size=10, idle_timeout=300.0,
+        health_check: str | Callable = None, statement_cache_size=64, param_marker: str = None,
+    ):
+        assert 0 <= min_size <= max_size, 'Invalid pool size'
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.statement_cache_size = statement_cache_size
+        if param_marker:
+            self.param_marker = param_marker
+        self._idle: List[PooledConnection] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        for i in range(min_size):
+            self._idle.append(self._new_connection())
+
+    def _new_connection(self) -> PooledConnection:
+        conn = PooledConnection(self._connect(), self.statement_cache_size)
+        self._size += 1
+        return conn
+
+    def _close(self, conn: PooledConnection):
+        # called without the lock, the pool size is adjusted by the caller
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning('Error closing pooled connection: %s', e)
+
+    def _check(self, conn: PooledConnection) -> bool:
+        if not self.health_check:
+            return True
+        try:
+            if callable(self.health_check):
+                return self.health_check(conn.raw) is not False
+            cur = conn.raw.cursor()
+            try:
+                cur.execute(self.health_check)
+                cur.fetchall()
+            finally:
+                cur.close()
+            return True
+        except Exception as e:
+            logger.warning('Pooled connection failed the health check: %s', e)
+            return False
+
+    def _prune(self) -> List[PooledConnection]:
+        # remove the connections idle for too long, keeping min_size connections,
+        # called with the lock, the removed connections are closed by the caller without the lock
+        if self.idle_timeout is None:
+            return []
+        limit = time.monotonic() - self.idle_timeout
+        expired = []
+        for conn in list(self._idle):
+            if self._size <= self.min_size:
+                break
+            if conn.last_used < limit:
+                self._idle.remove(conn)
+                self._size -= 1
+                expired.append(conn)
+        return expired
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        """
+        Get a connection from the pool, waiting at most `timeout` seconds when the pool is exhausted.
+        The health check, the connection and the close of the discarded connections run without the lock.
+        :param timeout:
+        :return:
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError('Connection pool is closed')
+                    expired = self._prune()
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # reserve the slot before connecting outside the lock
+                        self._size += 1
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeout('No connection available in the pool')
+                    self._cond.wait(remaining)
+            for old in expired:
+                self._close(old)
+            if conn is None:
+                break
+            if self._check(conn):
+                return conn
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+        try:
+            conn = PooledConnection(self._connect(), self.statement_cache_size)
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn: PooledConnection):
+        with self._cond:
+            conn.last_used = time.monotonic()
+            closed = self._closed
+            if closed:
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+        if closed:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def execute(self, sql, params: dict = None):
+        sql, args = self.prepare_sql(sql, params)
+        with self.connection() as conn:
+            cur = conn.acquire_cursor(sql)
+            try:
+                if args:
+                    cur.execute(sql, args)
+                else:
+                    cur.execute(sql)
+                rows = cur.fetchall()
+            except Exception:
+                # the cursor may be left in an unusable state
+                conn.discard_cursor(cur)
+                raise
+            conn.release_cursor(sql, cur)
+            return rows
+
+    def iter_execute(self, sql: str, params: dict = None, batch_size=1000) -> Iterator[dict]:
+        sql, args = self.prepare_sql(sql, params)
+        with self.connection() as conn:
+            cur = conn.acquire_cursor(sql)
+            failed = False
+            try:
+                yield from fetch_rows(cur, sql, args, batch_size)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                if failed:
+                    conn.discard_cursor(cur)
+                else:
+                    conn.release_cursor(sql, cur)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            idle = list(self._idle)
+            return {
+                'size': self._size,
+                'idle': len(idle),
+                'in_use': self._size - len(idle),
+                'statement_hits': sum(c.hits for c in idle),
+                'statement_misses': sum(c.misses for c in idle),
+            }
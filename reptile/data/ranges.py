@@ -0,0 +1,166 @@
+from typing import Callable, Iterable, Iterator, List, Sequence, Tuple
+from itertools import groupby
+
+
+class DataRange:
+    """
+    Zero-copy view of the rows [start, stop) of a sequence.
+    Slicing a range returns a range over the same base sequence, so nested groups never copy rows.
+    """
+    __slots__ = ('data', 'start', 'stop')
+
+    def __init__(self, data, start: int = 0, stop: int = None):
+        if isinstance(data, DataRange):
+            start += data.start
+            stop = data.stop if stop is None else data.start + stop
+            data = data.data
+        elif stop is None:
+            stop = len(data)
+        self.data = data
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __bool__(self):
+        return self.stop > self.start
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return DataRange(self.data, self.start + start, self.start + max(start, stop))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        return self.data[self.start + item]
+
+    def __iter__(self):
+        return map(self.data.__getitem__, range(self.start, self.stop))
+
+    def __repr__(self):
+        return f'<DataRange {self.start}:{self.stop}>'
+
+
+class SortedRows:
+    """
+    Rows reordered by the grouping engine with the precomputed group key tuple of each row.
+    The keys are indexed by the nesting level of the groups (see GroupHeader.group_mode),
+    so the nested groups are split without evaluating their expressions again.
+    :param rows: rows in the group order, a list or a SpillBuffer
+    :param keys: the key tuple of each row
+    :param owners: the objects computing each key level, e.g. the nested group headers
+    """
+    def __init__(self, rows: Sequence, keys: List[tuple], owners: tuple = ()):
+        self.rows = rows
+        self.keys = keys
+        self.owners = owners
+
+    def level(self, owner) -> int:
+        """
+        Key level computed by the owner, -1 if the owner is not a key level
+        :param owner:
+        :return:
+        """
+        try:
+            return self.owners.index(owner)
+        except ValueError:
+            return -1
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, item):
+        return self.rows[item]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        close = getattr(self.rows, 'close', None)
+        if close is not None:
+            close()
+
+
+def is_sequence(data) -> bool:
+    """
+    Check if the rows can be read by index without loading or copying them
+    :param data:
+    :return:
+    """
+    if isinstance(data, (list, tuple, range, DataRange, SortedRows)):
+        return True
+    if hasattr(data, 'column'):
+        # columnar data, sliced by views of the column arrays
+        return True
+    # streamed data already loaded into memory
+    return getattr(data, 'buffered', False) and isinstance(data.buffer, list)
+
+
+def data_slice(data, start: int, stop: int):
+    """
+    Zero-copy slice of a sequence of rows
+    :param data:
+    :param start:
+    :param stop:
+    :return:
+    """
+    if hasattr(data, 'column'):
+        # slices of the column arrays are views
+        return data[start:stop]
+    return DataRange(data, start, stop)
+
+
+def group_ranges(data: Iterable, key: Callable, level: int = -1) -> Iterator[Tuple[object, Iterable]]:
+    """
+    Split consecutive rows with the same key into groups.
+    Groups of sequences are zero-copy ranges of the data, other iterables (streamed rows)
+    are split into lists because their rows can be read only once.
+    :param data: rows sorted by the group key
+    :param key: function computing the group key of a row
+    :param level: key level precomputed by SortedRows, the key function is not called
+    :return: an iterator of (key, rows)
+    """
+    if level >= 0:
+        yield from _sorted_ranges(data, level)
+        return
+    if not is_sequence(data):
+        for grouper, rows in groupby(data, key=key):
+            yield grouper, list(rows)
+        return
+    if getattr(data, 'buffered', False):
+        data = data.buffer
+    start = 0
+    grouper = None
+    for i, row in enumerate(data):
+        k = key(row)
+        if i == 0:
+            grouper = k
+        elif k != grouper:
+            yield grouper, data_slice(data, start, i)
+            start = i
+            grouper = k
+    if len(data):
+        yield grouper, data_slice(data, start, len(data))
+
+
+def _sorted_ranges(data, level: int):
+    if isinstance(data, DataRange):
+        base, start, stop = data.data, data.start, data.stop
+    else:
+        base, start, stop = data, 0, len(data)
+    keys = base.keys
+    grouper = None
+    for i in range(start, stop):
+        k = keys[i][level]
+        if i == start:
+            grouper = k
+        elif k != grouper:
+            yield grouper, DataRange(base, start, i)
+            start = i
+            grouper = k
+    if stop > start:
+        yield grouper, DataRange(base, start, stop)
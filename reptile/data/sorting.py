@@ -0,0 +1,171 @@
+from typing import Callable, Iterable, List
+import heapq
+from numbers import Number
+import pickle
+import tempfile
+
+from .buffer import SpillBuffer
+from .ranges import SortedRows, is_sequence
+
+# max rows of a streamed source sorted in memory, larger sources are sorted by an external merge sort
+SORT_BUFFER_SIZE = 500000
+
+
+def _order_key(keys: tuple) -> tuple:
+    # None values are sorted last and never compared with other values
+    return tuple((value is None, value) for value in keys)
+
+
+def _text_order_key(keys: tuple) -> tuple:
+    # values of different types are compared by their text
+    return tuple((value is None, '' if value is None else str(value)) for value in keys)
+
+
+def sort_rows(
+    data: Iterable, key_funcs: List[Callable], mode='sort', owners: tuple = (), buffer_size: int = None,
+) -> SortedRows:
+    """
+    Reorder the rows so that the rows of every nested group are consecutive.
+    :param data: rows
+    :param key_funcs: functions computing the key of a row for each group level
+    :param mode: "sort" for a stable sort by the keys, "hash" to keep the groups in order of first appearance
+    :param owners: the objects computing each key level (see SortedRows)
+    :param buffer_size: max rows of a streamed source sorted in memory, SORT_BUFFER_SIZE by default
+    :return:
+    """
+    if len(key_funcs) == 1:
+        func = key_funcs[0]
+
+        def row_key(row):
+            return func(row),
+    else:
+        def row_key(row):
+            return tuple(f(row) for f in key_funcs)
+
+    if mode == 'hash':
+        return _hash_partition(data, row_key, owners)
+    if buffer_size is None:
+        buffer_size = SORT_BUFFER_SIZE
+    if is_sequence(data):
+        rows = data if isinstance(data, list) else list(data)
+        keys = [row_key(row) for row in rows]
+        order = list(range(len(rows)))
+        try:
+            order.sort(key=lambda i: _order_key(keys[i]))
+        except TypeError:
+            order.sort(key=lambda i: _text_order_key(keys[i]))
+        return SortedRows([rows[i] for i in order], [keys[i] for i in order], owners)
+    return _external_sort(iter(data), row_key, owners, buffer_size)
+
+
+def _hash_partition(data: Iterable, row_key: Callable, owners: tuple) -> SortedRows:
+    # nested buckets by key level, in order of first appearance, flattened depth first
+    root = {}
+    for row in data:
+        keys = row_key(row)
+        node = root
+        for value in keys[:-1]:
+            node = node.setdefault(value, {})
+        node.setdefault(keys[-1], []).append((keys, row))
+    rows = []
+    key_list = []
+    stack = [iter(root.values())]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+        elif isinstance(node, dict):
+            stack.append(iter(node.values()))
+        else:
+            for keys, row in node:
+                key_list.append(keys)
+                rows.append(row)
+    return SortedRows(rows, key_list, owners)
+
+
+def _comparable(types: set) -> bool:
+    # values of a single type, or numbers, are compared directly
+    return len(types) < 2 or all(issubclass(t, Number) for t in types)
+
+
+def _external_sort(rows: Iterable, row_key: Callable, owners: tuple, buffer_size: int) -> SortedRows:
+    # sorted runs of buffer_size rows are written to temporary files and merged.
+    # the runs are compared with each other by the merge, so the types of the keys are tracked by level:
+    # when a level has values of incomparable types every run is sorted by the text of the keys
+    order_key = lambda item: _order_key(item[0])
+    text_key = lambda item: _text_order_key(item[0])
+    key_types = []
+    text_order = False
+    runs = []
+    chunk = []
+
+    def sort_chunk():
+        nonlocal text_order
+        if not text_order:
+            try:
+                chunk.sort(key=order_key)
+                return
+            except TypeError:
+                text_order = True
+        chunk.sort(key=text_key)
+
+    for row in rows:
+        keys = row_key(row)
+        if not key_types:
+            key_types = [set() for _ in keys]
+        for types, value in zip(key_types, keys):
+            if value is not None:
+                types.add(type(value))
+        chunk.append((keys, row))
+        if len(chunk) >= buffer_size:
+            sort_chunk()
+            runs.append((_write_run(chunk), text_order))
+            chunk = []
+    sort_chunk()
+    if not runs:
+        return SortedRows([row for _, row in chunk], [keys for keys, _ in chunk], owners)
+    runs.append((_write_run(chunk), text_order))
+    if text_order or not all(_comparable(types) for types in key_types):
+        # the runs sorted by the values are sorted again by the text of the keys
+        key = text_key
+        runs = [f if sorted_by_text else _sort_run(f, key) for f, sorted_by_text in runs]
+    else:
+        key = order_key
+        runs = [f for f, _ in runs]
+    keys = []
+
+    def merged():
+        # ties are taken from the earlier run, so the merge is stable
+        for item in heapq.merge(*[_read_run(f) for f in runs], key=key):
+            keys.append(item[0])
+            yield item[1]
+        for f in runs:
+            f.close()
+
+    return SortedRows(SpillBuffer(merged()), keys, owners)
+
+
+def _sort_run(f, key: Callable):
+    items = list(_read_run(f))
+    f.close()
+    items.sort(key=key)
+    return _write_run(items)
+
+
+def _write_run(items: list):
+    f = tempfile.TemporaryFile()
+    dump = pickle.dump
+    for item in items:
+        dump(item, f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    load = pickle.load
+    while True:
+        try:
+            yield load(f)
+        except EOFError:
+            return
+
@@ -1,14 +1,28 @@
+import sqlite3
+
 from .connection import BaseConnection
-from .datasource import SqlDataSource
 
 
 class SqliteConnection(BaseConnection):
+    param_marker = '?'
+
     def __init__(self, dbname=None, db=None):
         self._dbname = dbname
         self._conn = db
 
+    @property
+    def connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._dbname, check_same_thread=False)
+        return self._conn
+
     def cursor(self):
-        return self._conn.cursor()
+        return self.connection.cursor()
+
+    def execute(self, sql, *args, **kwargs):
+        cur = self.cursor()
+        cur.execute(sql, *args, **kwargs)
+        return cur.fetchall()
 
     def create_datasource(self, name=None, sql=None):
-        return SqlDataSource(name, sql=sql, connection=self)
+        return self.datasource_factory(name, sql)
@@ -1,9 +1,10 @@
+from functools import lru_cache
 import os
 from PySide6.QtGui import QPageSize, QTextDocument, QFont, Qt, QPainter, QPixmap, QFontMetrics, QPen, QColor, QFontDatabase
 from PySide6.QtCore import QSize, QRectF, QRect, QLine, QPoint, Qt as QtCore
 
 from reptile.runtime.stream import (
-    PreparedText, PreparedPage, PreparedBand, PreparedImage, PreparedLine, SizeMode, PreparedBarcode,
+    PreparedText, PreparedPage, PreparedBand, PreparedImage, PreparedLine, SizeMode, PreparedBarcode, TextStyle,
 )
 from reptile.bands.widgets import Text, HAlign, VAlign
 
@@ -11,22 +12,46 @@ from reptile.bands.widgets import Text, HAlign, VAlign
 TAG_REGISTRY = {}
 
 
-def calc_text_size(self, obj: PreparedText):
-    from PySide6.QtGui import QFont, QFontMetrics
-    from PySide6.QtCore import Qt
-    font = QFont(obj.font_name)
-    if obj.font_size:
-        font.setPointSizeF(obj.font_size)
-    if obj.font_bold:
+@lru_cache(maxsize=256)
+def get_font(name: str, size: float = None, bold=False, italic=False) -> QFont:
+    """
+    Get a shared font object, fonts are cached by (name, size, bold, italic)
+    """
+    font = QFont(name)
+    if size:
+        font.setPointSizeF(size)
+    if bold:
         font.setBold(True)
-    if obj.font_italic:
+    if italic:
         font.setItalic(True)
-    fm = QFontMetrics(font)
-    flags = 0 | 0 | Qt.TextWordWrap
-    r = fm.boundingRect(0, 0, obj.width, 0, flags, obj.text)
-    height = r.height() + 4
-    del font
-    del fm
+    return font
+
+
+@lru_cache(maxsize=256)
+def get_font_metrics(name: str, size: float = None, bold=False, italic=False) -> QFontMetrics:
+    return QFontMetrics(get_font(name, size, bold, italic))
+
+
+@lru_cache(maxsize=8192)
+def measure_text_height(font_key: tuple, width: int, flags: int, text: str) -> int:
+    """
+    Memoized height of a text drawn with the font into a given width
+    """
+    r = get_font_metrics(*font_key).boundingRect(0, 0, width, 0, flags, text)
+    return r.height()
+
+
+def font_cache_info() -> dict:
+    return {
+        'fonts': get_font.cache_info()._asdict(),
+        'metrics': get_font_metrics.cache_info()._asdict(),
+        'heights': measure_text_height.cache_info()._asdict(),
+    }
+
+
+def calc_text_size(self, obj: PreparedText):
+    font_key = (obj.font_name, obj.font_size or None, bool(obj.font_bold), bool(obj.font_italic))
+    height = measure_text_height(font_key, obj.width, int(Qt.TextWordWrap), obj.text) + 4
     return obj.width, height
 
 Text.calc_size = calc_text_size
@@ -191,15 +216,17 @@ class TextRenderer:
         return h_align_map.get(self.halign, 0) | v_align_map.get(self.valign, 0) | ww
 
     @classmethod
-    def draw(cls, x, y, self: PreparedText, painter: QPainter):
+    def draw(cls, x, y, self: PreparedText, painter: QPainter, style: TextStyle = None):
+        """
+        Draw the text
+        :param style: text style currently applied to the painter, the font and pen are set only when it changes
+        :return: the text style applied to the painter
+        """
         font = None
+        apply_style = self.style is not style
         if self.font_name:
-            font = QFont(self.font_name, self.font_size)
-            if self.font_bold:
-                font.setBold(True)
-            if self.font_italic:
-                font.setItalic(True)
-        if self.color:
+            font = get_font(self.font_name, self.font_size or None, bool(self.font_bold), bool(self.font_italic))
+        if self.color and apply_style:
             color = QColor(self.color)
             painter.setPen(color)
         brushStyle = self.brush_style or 1
@@ -234,16 +261,19 @@ class TextRenderer:
             rect.setY(rect.y() + self.border.width)
         if self.allow_tags:
             doc = QTextDocument()
-            doc.setDefaultFont(font)
+            if font:
+                doc.setDefaultFont(font)
             doc.setHtml(self.text)
             doc.setDocumentMargin(0)
             painter.save()
             painter.translate(tx + self.padding.left, ty + self.padding.top)
             doc.drawContents(painter, QRectF(0, 0, self.width, self.height))
             painter.restore()
+            # the painter font was not set
+            return None
         else:
             # painter.save()
-            if font:
+            if font and apply_style:
                 painter.setFont(font)
             flags = cls.textFlags(self)
             if self.valign == VAlign.TOP:
@@ -256,6 +286,7 @@ class TextRenderer:
                 rect.setWidth(rect.width() - self.padding.right)
             painter.drawText(rect, flags, self.text)
             # painter.restore()
+        return self.style
 
     @classmethod
     def getLines(cls, self, x1, y1, x2, y2):
@@ -1,8 +1,12 @@
 import re
+from collections import OrderedDict
 from decimal import Decimal
 import textwrap
 import datetime
-from jinja2 import Environment
+import threading
+from collections.abc import MutableMapping
+from jinja2 import Environment, Template
+from jinja2.runtime import Context, Undefined, missing
 from reptile.utils.text import format_mask, format_number, _format_number, display_format
 
 
@@ -16,6 +20,185 @@ def default_format(value):
     return str(value)
 
 
+class TemplateCache:
+    """
+    Process-wide LRU cache of compiled template code.
+    The cache is keyed by the final template source (including the display format filter injected by `Text`),
+    so every report instance loaded from the same layout reuses the same compiled code.
+    """
+    def __init__(self, env: Environment, maxsize=2048):
+        self.env = env
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, source: str):
+        """
+        Return the compiled code for the template source
+        :param source:
+        :return:
+        """
+        with self._lock:
+            code = self._items.get(source)
+            if code is not None:
+                self._items.move_to_end(source)
+                self.hits += 1
+                return code
+            self.misses += 1
+        code = self.env.compile(source)
+        with self._lock:
+            self._items[source] = code
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return code
+
+    def from_string(self, source: str, globals: dict = None) -> Template:
+        """
+        Create a template object from a cached compiled code
+        :param source:
+        :param globals: template specific globals
+        :return:
+        """
+        env = self.env
+        return env.template_class.from_code(env, self.compile(source), env.make_globals(globals), None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+    def info(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LayeredContext(MutableMapping):
+    """
+    Evaluation context with a top layer over a parent context.
+    Entries of the top layer shadow the parent entries, the other writes go to the parent,
+    so the values set during a row (e.g. the page index) remain visible after the layer is discarded.
+    Bands keep the per-row entries (record, line...) in the top layer and overwrite them on every row,
+    instead of writing them into the report context.
+    :param parent: parent context
+    :param layer: top layer entries
+    """
+    __slots__ = ('parent', 'layer')
+
+    def __init__(self, parent, layer: dict = None):
+        self.parent = parent
+        self.layer = {} if layer is None else layer
+
+    def __getitem__(self, key):
+        try:
+            return self.layer[key]
+        except KeyError:
+            return self.parent[key]
+
+    def get(self, key, default=None):
+        try:
+            return self.layer[key]
+        except KeyError:
+            return self.parent.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.layer or key in self.parent
+
+    def __setitem__(self, key, value):
+        if key in self.layer:
+            self.layer[key] = value
+        else:
+            self.parent[key] = value
+
+    def __delitem__(self, key):
+        if key in self.layer:
+            del self.layer[key]
+        else:
+            del self.parent[key]
+
+    def __iter__(self):
+        yield from self.layer
+        for key in self.parent:
+            if key not in self.layer:
+                yield key
+
+    def __len__(self):
+        return len(self.layer.keys() | self.parent.keys())
+
+    def __bool__(self):
+        return bool(self.layer) or bool(self.parent)
+
+    def flush(self):
+        """
+        Copy the top layer entries to the parent context
+        :return:
+        """
+        self.parent.update(self.layer)
+
+
+class TemplateContext(Context):
+    """
+    Jinja context reading the variables directly from the report context (a dict or a LayeredContext),
+    then from the template globals, instead of merging them into a new dict for every render.
+    """
+    def __init__(self, template: Template, context):
+        super().__init__(template.environment, context, template.name, template.blocks)
+        self.template_globals = template.globals
+
+    def resolve_or_missing(self, key: str):
+        if key in self.vars:
+            return self.vars[key]
+        value = self.parent.get(key, missing)
+        if value is missing:
+            return self.template_globals.get(key, missing)
+        return value
+
+    def __contains__(self, name):
+        return name in self.vars or name in self.parent or name in self.template_globals
+
+    def get_all(self) -> dict:
+        return {**self.template_globals, **self.parent, **self.vars}
+
+
+def render_template(template: Template, context) -> str:
+    """
+    Render a template with the report context, the context mapping is not copied
+    :param template:
+    :param context:
+    :return:
+    """
+    env = template.environment
+    try:
+        return env.concat(template.root_render_func(TemplateContext(template, context)))
+    except Exception:
+        env.handle_exception()
+
+
+def eval_expression(expression, context):
+    """
+    Evaluate a compiled expression (Environment.compile_expression) with the report context
+    :param expression:
+    :param context:
+    :return:
+    """
+    template = expression._template
+    ctx = TemplateContext(template, context)
+    for _ in template.root_render_func(ctx):
+        pass
+    value = ctx.vars['result']
+    if isinstance(value, Undefined):
+        return None
+    return value
+
+
 class EnvironmentSettings:
     env = Environment()
     env.cache = None
@@ -26,6 +209,7 @@ class EnvironmentSettings:
     env.globals['re'] = re
     env.globals['textwrap'] = textwrap
     env.filters['display_format'] = display_format
+    template_cache = TemplateCache(env)
     error_text = '-'
 
     class DecimalSettings:
@@ -1,15 +1,24 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import tempfile
+import logging
+import math
+import os
 
 from PySide6.QtGui import (
     QPainter, QFont, QGuiApplication, QPageSize, QPageLayout, QPdfWriter, QPen, QColor, QTextOption,
 )
 from PySide6.QtPrintSupport import QPrinter
-from PySide6.QtCore import QMarginsF, QSizeF, QSize, QPoint, Qt, QRectF
+from PySide6.QtCore import QMarginsF, QSizeF, QSize, QPoint, Qt, QRectF, QFile, QIODevice
 
 from reptile.runtime import PreparedBand, PreparedText, PreparedImage, PreparedLine, PreparedBarcode
+from reptile.runtime.binary import BinaryDocument
 from reptile.engines.qt import BandRenderer, TextRenderer, ImageRenderer, LineRenderer, BarcodeRenderer
 from reptile.bands import Watermark
 from reptile.core.units import mm
+from .stats import ExportStats, _clock
+
+logger = logging.getLogger('reptile')
 
 
 class QReportEngine:
@@ -18,30 +27,101 @@ class QReportEngine:
 
 
 class PDF:
+    # opt-in export instrumentation, see ExportStats
+    stats: ExportStats = None
+
     def __init__(self, document):
+        """
+        :param document: a prepared document or an iterable of prepared pages (see Report.iter_pages)
+        """
         self.document = document
         self.printer = None
         self.painter = None
         self._isFirstPage = False
+        self._text_style = None
+        self._output = None
 
     def export(self, filename) -> bytes:
-        self.printer = QPdfWriter(filename)
-        self.printer.setPageMargins(QMarginsF(0, 0, 0, 0))
-        self.printer.setResolution(96)
-        pages = self.document.pages
-        if pages:
-            page = pages[0]
-            self.printer.setPageSize(QPageSize(QSizeF(page.width / mm, page.height / mm), QPageSize.Millimeter))
-        self.painter = QPainter()
-        self.painter.setFont(QFont('Helvetica', 9))
-        self.painter.begin(self.printer)
-        self._isFirstPage = True
-        for page in pages:
-            self.exportPage(page)
-            self._isFirstPage = False
-        self.painter.end()
-        del self.painter
-        del self.printer
+        stats = self.stats
+        self._output = output = None
+        try:
+            if stats is not None:
+                # the output is written to a file device to measure the bytes written by page
+                self._output = output = QFile(filename)
+                if not output.open(QIODevice.WriteOnly):
+                    raise OSError(f'Unable to open "{filename}" for writing: {output.errorString()}')
+                self.printer = QPdfWriter(output)
+            else:
+                self.printer = QPdfWriter(filename)
+            self.printer.setPageMargins(QMarginsF(0, 0, 0, 0))
+            self.printer.setResolution(96)
+            pages = iter(getattr(self.document, 'pages', self.document))
+            page = next(pages, None)
+            if page is not None:
+                self.printer.setPageSize(QPageSize(QSizeF(page.width / mm, page.height / mm), QPageSize.Millimeter))
+            self.painter = QPainter()
+            self.painter.setFont(QFont('Helvetica', 9))
+            self.painter.begin(self.printer)
+            if stats is not None:
+                stats.start(output.pos())
+            self._isFirstPage = True
+            while page is not None:
+                self.exportPage(page)
+                self._isFirstPage = False
+                page = next(pages, None)
+            self.painter.end()
+            if stats is not None:
+                stats.stop(output.pos())
+        finally:
+            if self.painter is not None and self.painter.isActive():
+                self.painter.end()
+            if output is not None:
+                output.close()
+            self._output = None
+            self.painter = self.printer = None
+
+    def export_parallel(self, filename, processes: int = None, chunk_size: int = None):
+        """
+        Export the document splitting the pages into chunks rendered by worker processes,
+        the intermediate files are merged into the output file in the page order.
+        Requires pypdf to merge the chunks, without it the document is exported sequentially.
+        Scripts using this method must be protected by `if __name__ == '__main__'` (spawned workers).
+        The export stats are not collected by the workers.
+        :param filename:
+        :param processes: number of worker processes, the cpu count by default
+        :param chunk_size: pages by chunk, by default the pages are split evenly between the processes
+        :return:
+        """
+        try:
+            from pypdf import PdfWriter
+        except ImportError:
+            logger.warning('pypdf is not installed, exporting the document sequentially')
+            return self.export(filename)
+        if isinstance(self.document, BinaryDocument) and self.document.filename:
+            # the workers load their pages from the container file
+            pages = self.document
+            split = pages.view
+        else:
+            pages = list(getattr(self.document, 'pages', self.document))
+            split = lambda start, stop: pages[start:stop]
+        processes = processes or os.cpu_count() or 1
+        if not chunk_size:
+            chunk_size = max(1, math.ceil(len(pages) / processes))
+        chunks = [split(i, i + chunk_size) for i in range(0, len(pages), chunk_size)]
+        if processes <= 1 or len(chunks) <= 1:
+            return PDF(pages).export(filename)
+        with tempfile.TemporaryDirectory() as tmp:
+            files = [os.path.join(tmp, f'{i}.pdf') for i in range(len(chunks))]
+            with ProcessPoolExecutor(
+                max_workers=min(processes, len(chunks)), mp_context=multiprocessing.get_context('spawn'),
+            ) as executor:
+                list(executor.map(_export_chunk, chunks, files))
+            writer = PdfWriter()
+            for f in files:
+                writer.append(f)
+            # share the identical resources (fonts, images) of the chunks
+            writer.compress_identical_objects()
+            writer.write(filename)
 
     def export_bytes(self):
         with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
@@ -73,22 +153,58 @@ class PDF:
         self.painter.restore()
 
     def exportPage(self, page):
+        # text style applied to the painter, reset on every page
+        self._text_style = None
         if not self._isFirstPage:
             self.printer.newPage()
+        stats = self.stats
+        if stats is not None:
+            stats.start_page(self._output.pos())
         if page.watermark:
+            t = _clock()
             self.draw_watermark(page.watermark, page)
+            if stats is not None:
+                stats.add('watermark', t)
         for band in page.bands:
             self.exportBand(band)
+        if stats is not None:
+            stats.end_page()
 
     def exportBand(self, band: PreparedBand):
-        BandRenderer.draw(band, self.painter)
+        # with stats, every object is timed by renderer
+        stats = self.stats
+        painter = self.painter
+        t = _clock()
+        BandRenderer.draw(band, painter)
+        if stats is not None:
+            stats.add('band', t)
+        style = self._text_style
         for obj in band.objects:
+            if stats is not None:
+                t = _clock()
             if isinstance(obj, PreparedText):
-                TextRenderer.draw(band.left, band.top, obj, self.painter)
-            elif isinstance(obj, PreparedImage):
-                ImageRenderer.draw(band.left, band.top, obj, self.painter)
-            elif isinstance(obj, PreparedLine):
-                LineRenderer.draw(band.left, band.top, obj, self.painter)
-            elif isinstance(obj, PreparedBarcode):
-                BarcodeRenderer.draw(band.left, band.top, obj, self.painter)
+                style = TextRenderer.draw(band.left, band.top, obj, painter, style)
+                renderer = 'rich_text' if getattr(obj, 'allow_tags', False) else 'text'
+            else:
+                style = None
+                if isinstance(obj, PreparedImage):
+                    ImageRenderer.draw(band.left, band.top, obj, painter)
+                    renderer = 'image'
+                    if stats is not None:
+                        stats.add_image(len(obj.picture or b''))
+                elif isinstance(obj, PreparedLine):
+                    LineRenderer.draw(band.left, band.top, obj, painter)
+                    renderer = 'line'
+                elif isinstance(obj, PreparedBarcode):
+                    BarcodeRenderer.draw(band.left, band.top, obj, painter)
+                    renderer = 'barcode'
+                else:
+                    continue
+            if stats is not None:
+                stats.add(renderer, t)
+        self._text_style = style
+
 
+def _export_chunk(pages, filename):
+    PDF(pages).export(filename)
+    return filename
@@ -0,0 +1,191 @@
+from typing import Dict, List, Optional
+import json
+import logging
+import time
+
+_clock = time.perf_counter
+
+logger = logging.getLogger('reptile')
+
+
+class RendererStats:
+    """
+    Objects drawn by a renderer and the time spent drawing them
+    """
+    __slots__ = ('name', 'count', 'time')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.time = 0.0
+
+    def dump(self) -> dict:
+        return {
+            'name': self.name,
+            'count': self.count,
+            'time': self.time,
+        }
+
+
+class PageStats:
+    """
+    Statistics of an exported page
+    """
+    __slots__ = ('index', 'objects', 'images', 'time', 'bytes')
+
+    def __init__(self, index: int):
+        self.index = index
+        # objects drawn, bands included
+        self.objects = 0
+        self.images = 0
+        self.time = 0.0
+        # bytes written to the output file, known when the next page is started
+        self.bytes = 0
+
+    def dump(self) -> dict:
+        return {
+            'index': self.index,
+            'objects': self.objects,
+            'images': self.images,
+            'time': self.time,
+            'bytes': self.bytes,
+        }
+
+
+class ExportStats:
+    """
+    Opt-in instrumentation of the export phase.
+    Records the count and drawing time of the objects by renderer (band, text, rich_text, image, line,
+    barcode, watermark), the images decoded and the time and bytes written by page.
+    The bytes of a page are the output written between the start of the page and the start of the next page,
+    the shared resources (fonts, images) and the file trailer are written with the last page.
+    Usage::
+
+        stats = ExportStats(log_pages=True)
+        pdf = PDF(doc)
+        pdf.stats = stats
+        pdf.export('report.pdf')
+        print(stats.renderer('rich_text').time)
+
+    :param log_pages: log the statistics of each page when it is finished
+    """
+    def __init__(self, log_pages=False):
+        self.log_pages = log_pages
+        self.renderers: Dict[str, RendererStats] = {}
+        self.pages: List[PageStats] = []
+        self.images_decoded = 0
+        self.image_bytes = 0
+        self.time = 0.0
+        self.bytes = 0
+        self.active = False
+        self._page: Optional[PageStats] = None
+        self._page_start = 0.0
+        self._page_offset = 0
+        self._start = 0.0
+        self._offset = 0
+
+    def start(self, offset: int = 0):
+        """
+        Start an export, called by PDF.export
+        :param offset: current size of the output
+        :return:
+        """
+        self.active = True
+        self._page = None
+        self._start = _clock()
+        self._offset = offset
+
+    def stop(self, offset: int = 0):
+        """
+        Finish the export, called by PDF.export when the output is complete
+        :param offset: final size of the output
+        :return:
+        """
+        if not self.active:
+            return
+        self.active = False
+        self._close_page(offset)
+        self.time += _clock() - self._start
+        self.bytes += offset - self._offset
+
+    def start_page(self, offset: int = 0):
+        """
+        Start a new page, the previous page is finished
+        :param offset: current size of the output
+        :return:
+        """
+        self._close_page(offset)
+        self._page = page = PageStats(len(self.pages) + 1)
+        self.pages.append(page)
+        self._page_offset = offset
+        self._page_start = _clock()
+
+    def end_page(self):
+        """
+        All objects of the current page were drawn
+        :return:
+        """
+        self._page.time += _clock() - self._page_start
+
+    def _close_page(self, offset: int):
+        page = self._page
+        if page is None:
+            return
+        page.bytes = offset - self._page_offset
+        self._page = None
+        if self.log_pages:
+            logger.info(
+                'Page %d exported: %d objects, %d images, %.2f ms, %d bytes',
+                page.index, page.objects, page.images, page.time * 1000, page.bytes,
+            )
+
+    def add(self, renderer: str, start: float):
+        """
+        Record an object drawn by a renderer
+        :param renderer: renderer name
+        :param start: clock value when the drawing started
+        :return:
+        """
+        stats = self.renderers.get(renderer)
+        if stats is None:
+            stats = self.renderers[renderer] = RendererStats(renderer)
+        stats.count += 1
+        stats.time += _clock() - start
+        if self._page is not None:
+            self._page.objects += 1
+
+    def add_image(self, size: int):
+        """
+        Record a decoded image
+        :param size: encoded image size in bytes
+        :return:
+        """
+        self.images_decoded += 1
+        self.image_bytes += size
+        if self._page is not None:
+            self._page.images += 1
+
+    def renderer(self, name: str) -> RendererStats:
+        """
+        Statistics of a renderer, empty if the renderer was not used
+        :param name:
+        :return:
+        """
+        return self.renderers.get(name) or RendererStats(name)
+
+    def dump(self) -> dict:
+        return {
+            'time': self.time,
+            'bytes': self.bytes,
+            'imagesDecoded': self.images_decoded,
+            'imageBytes': self.image_bytes,
+            'renderers': [r.dump() for r in self.renderers.values()],
+            'pages': [page.dump() for page in self.pages],
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.dump(), **kwargs)
+
+    def save_json(self, filename: str):
+        with open(filename, 'w') as f:
+            f.write(self.to_json(indent=2))
@@ -1,11 +1,11 @@
 from typing import List
-from itertools import groupby
 from functools import partial
 from collections import defaultdict
 import jinja2
 from jinja2 import pass_context
 
 import reptile
+from reptile.data.ranges import group_ranges
 
 report_env = reptile.EnvironmentSettings.env
 
@@ -326,10 +326,10 @@ class GridGroup:
         return self.template_expression.render(**context)
 
     def render(self, datasource, stream, context):
-        data = groupby(datasource, key=partial(self.eval_expression, context=context))
+        # the groups are ranges of the data, the rows are not copied
+        data = group_ranges(datasource, key=partial(self.eval_expression, context=context))
         line = 0
         for i, (grouper, lst) in enumerate(data):
-            lst = list(lst)
             group = Group(grouper, lst, i)
             context['group'] = group
             context['records'] = lst
@@ -0,0 +1,463 @@
+"""
+Binary container for prepared reports.
+
+The file stores every page as an independent record followed by a metadata record
+holding the text style table and the page index, so a reader can memory-map the file
+and decode any page without decoding the whole document.
+
+Layout::
+
+    header   b'RPTB' u16 version u16 reserved
+    pages    one encoded record by page
+    meta     {'level', 'styles', 'index': [(offset, length), ...]}
+    trailer  u64 meta offset, u32 meta length, b'RPTB'
+"""
+from typing import BinaryIO, Iterator, List, Optional
+from functools import lru_cache
+import enum
+import mmap
+import os
+import struct
+
+from .stream import (
+    PreparedPage, PreparedBand, PreparedText, PreparedImage, PreparedLine, PreparedBarcode, SizeMode,
+    TextStyle, TEXT_STYLE_FIELDS,
+)
+
+MAGIC = b'RPTB'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHH')
+_TRAILER = struct.Struct('<QI4s')
+
+# value tags
+_NONE = 0
+_TRUE = 1
+_FALSE = 2
+_INT8 = 3
+_INT64 = 4
+_BIGINT = 5
+_FLOAT = 6
+_STR = 7
+_BYTES = 8
+_LIST = 9
+_DICT = 10
+_OBJECT = 11
+_ENUM = 12
+
+# prepared object kinds
+_TEXT = 0
+_IMAGE = 1
+_LINE = 2
+_BARCODE = 3
+
+_u8 = struct.Struct('<B')
+_i8 = struct.Struct('<b')
+_u32 = struct.Struct('<I')
+_i64 = struct.Struct('<q')
+_f64 = struct.Struct('<d')
+
+
+@lru_cache(maxsize=None)
+def _value_classes() -> dict:
+    # classes of the value objects (margins, borders, fonts...) allowed in a container
+    from reptile.core.base import Border, Padding, Margin, Font, VAlign, HAlign
+    from reptile.bands.bands import Watermark
+    from reptile.style import Fill
+    from .stream import Border as BorderFlag
+    return {
+        'Border': Border, 'Padding': Padding, 'Margin': Margin, 'Font': Font, 'Watermark': Watermark,
+        'Fill': Fill, 'VAlign': VAlign, 'HAlign': HAlign, 'SizeMode': SizeMode, 'BorderFlag': BorderFlag,
+    }
+
+
+@lru_cache(maxsize=None)
+def _class_names() -> dict:
+    return {cls: name for name, cls in _value_classes().items()}
+
+
+class BinaryFormatError(Exception):
+    pass
+
+
+class Encoder:
+    """
+    Compact msgpack-like encoder of python values and report value objects
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def encode(self, value):
+        buf = self.buffer
+        if value is None:
+            buf.append(_NONE)
+        elif value is True:
+            buf.append(_TRUE)
+        elif value is False:
+            buf.append(_FALSE)
+        elif isinstance(value, enum.Enum):
+            name = _class_names().get(type(value))
+            if name is None:
+                raise TypeError(f'Unsupported enum type: {type(value).__name__}')
+            buf.append(_ENUM)
+            self._str(name)
+            self.encode(value.value)
+        elif isinstance(value, int):
+            if -128 <= value < 128:
+                buf.append(_INT8)
+                buf += _i8.pack(value)
+            elif -2 ** 63 <= value < 2 ** 63:
+                buf.append(_INT64)
+                buf += _i64.pack(value)
+            else:
+                buf.append(_BIGINT)
+                self._str(str(value))
+        elif isinstance(value, float):
+            buf.append(_FLOAT)
+            buf += _f64.pack(value)
+        elif isinstance(value, str):
+            buf.append(_STR)
+            self._str(value)
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            buf.append(_BYTES)
+            buf += _u32.pack(len(value))
+            buf += value
+        elif isinstance(value, (list, tuple)):
+            buf.append(_LIST)
+            buf += _u32.pack(len(value))
+            for v in value:
+                self.encode(v)
+        elif isinstance(value, dict):
+            buf.append(_DICT)
+            buf += _u32.pack(len(value))
+            for k, v in value.items():
+                self.encode(k)
+                self.encode(v)
+        else:
+            name = _class_names().get(type(value))
+            if name is None:
+                raise TypeError(f'Unsupported type: {type(value).__name__}')
+            buf.append(_OBJECT)
+            self._str(name)
+            self.encode(_object_state(value))
+
+    def _str(self, s: str):
+        data = s.encode('utf-8')
+        self.buffer += _u32.pack(len(data))
+        self.buffer += data
+
+
+def _object_state(obj) -> dict:
+    slots = getattr(type(obj), '__slots__', None)
+    if slots:
+        return {attr: getattr(obj, attr) for attr in slots if hasattr(obj, attr)}
+    return dict(vars(obj))
+
+
+class Decoder:
+    """
+    Decoder of the values written by the Encoder, reads from any buffer (bytes, mmap)
+    """
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.offset = offset
+
+    def decode(self):
+        buf = self.buffer
+        tag = buf[self.offset]
+        self.offset += 1
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _INT8:
+            value = _i8.unpack_from(buf, self.offset)[0]
+            self.offset += 1
+            return value
+        if tag == _INT64:
+            value = _i64.unpack_from(buf, self.offset)[0]
+            self.offset += 8
+            return value
+        if tag == _BIGINT:
+            return int(self._str())
+        if tag == _FLOAT:
+            value = _f64.unpack_from(buf, self.offset)[0]
+            self.offset += 8
+            return value
+        if tag == _STR:
+            return self._str()
+        if tag == _BYTES:
+            return self._bytes()
+        if tag == _LIST:
+            n = self._u32()
+            return [self.decode() for i in range(n)]
+        if tag == _DICT:
+            n = self._u32()
+            res = {}
+            for i in range(n):
+                k = self.decode()
+                res[k] = self.decode()
+            return res
+        if tag == _OBJECT:
+            cls = self._class()
+            state = self.decode()
+            obj = cls.__new__(cls)
+            for k, v in state.items():
+                setattr(obj, k, v)
+            return obj
+        if tag == _ENUM:
+            cls = self._class()
+            return cls(self.decode())
+        raise BinaryFormatError(f'Invalid value tag {tag} at {self.offset - 1}')
+
+    def _class(self):
+        name = self._str()
+        cls = _value_classes().get(name)
+        if cls is None:
+            raise BinaryFormatError(f'Unknown object type: {name}')
+        return cls
+
+    def _u32(self) -> int:
+        value = _u32.unpack_from(self.buffer, self.offset)[0]
+        self.offset += 4
+        return value
+
+    def _bytes(self) -> bytes:
+        n = self._u32()
+        start = self.offset
+        self.offset += n
+        return bytes(self.buffer[start:self.offset])
+
+    def _str(self) -> str:
+        return self._bytes().decode('utf-8')
+
+
+class _StyleTable:
+    def __init__(self):
+        self.styles: List[TextStyle] = []
+        self._index = {}
+
+    def get_id(self, style: TextStyle) -> int:
+        i = self._index.get(style)
+        if i is None:
+            i = self._index[style] = len(self.styles)
+            self.styles.append(style)
+        return i
+
+
+def _encode_page(page, styles: _StyleTable) -> bytes:
+    enc = Encoder()
+    bands = []
+    for band in page.bands:
+        objects = []
+        for obj in band.objects or ():
+            if isinstance(obj, PreparedText):
+                objects.append((
+                    _TEXT, obj.left, obj.top, obj.width, obj.height, obj.text, styles.get_id(obj.style),
+                    getattr(obj, 'allow_tags', False), obj.can_grow, obj.error,
+                ))
+            elif isinstance(obj, PreparedImage):
+                objects.append((_IMAGE, obj.left, obj.top, obj.width, obj.height, obj.picture, obj.size_mode))
+            elif isinstance(obj, PreparedLine):
+                objects.append((
+                    _LINE, obj.left, obj.top, obj.width, obj.height,
+                    obj.direction, obj.line_width, obj.color, obj.line_style,
+                ))
+            elif isinstance(obj, PreparedBarcode):
+                objects.append((
+                    _BARCODE, obj.left, obj.top, obj.width, obj.height,
+                    obj.barcode, obj.data, obj.size_mode, obj.thickness,
+                ))
+            else:
+                raise TypeError(f'Unsupported prepared object: {type(obj).__name__}')
+        bands.append((band.left, band.top, band.width, band.height, band.bottom, band.band_type, band.fill, objects))
+    enc.encode((
+        page.height, page.width, getattr(page, 'index', None), page.margin,
+        getattr(page, 'x', None), getattr(page, 'y', None), getattr(page, 'ay', None), page.watermark, bands,
+    ))
+    return bytes(enc.buffer)
+
+
+def _decode_page(buffer, offset: int, styles: List[TextStyle]) -> PreparedPage:
+    height, width, index, margin, x, y, ay, watermark, bands = Decoder(buffer, offset).decode()
+    page = PreparedPage(height, width)
+    page.index = index
+    page.margin = margin
+    if x is not None:
+        page.x = x
+        page.y = y
+        page.ay = ay
+    page.watermark = watermark
+    for left, top, w, h, bottom, band_type, fill, objects in bands:
+        band = PreparedBand(left, top, w, h, bottom)
+        band.band_type = band_type
+        band.fill = fill
+        band.objects = [_decode_object(obj, styles) for obj in objects]
+        page.bands.append(band)
+    return page
+
+
+def _decode_object(values: list, styles: List[TextStyle]):
+    kind = values[0]
+    if kind == _TEXT:
+        obj = PreparedText(values[5])
+        obj.style = styles[values[6]]
+        obj.allow_tags, obj.can_grow, obj.error = values[7:10]
+    elif kind == _IMAGE:
+        obj = PreparedImage()
+        obj.picture, obj.size_mode = values[5:7]
+    elif kind == _LINE:
+        obj = PreparedLine()
+        obj.direction, obj.line_width, obj.color, obj.line_style = values[5:9]
+    elif kind == _BARCODE:
+        obj = PreparedBarcode()
+        obj.barcode, obj.data, obj.size_mode, obj.thickness = values[5:9]
+    else:
+        raise BinaryFormatError(f'Unknown object kind: {kind}')
+    obj.left, obj.top, obj.width, obj.height = values[1:5]
+    return obj
+
+
+def save(document, file: str | os.PathLike | BinaryIO):
+    """
+    Write a prepared document to a binary container, the pages are encoded one at a time
+    :param document: a prepared document (ReportStream) or an iterable of prepared pages
+    :param file: filename or binary file object
+    :return:
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'wb') as f:
+            return save(document, f)
+    styles = _StyleTable()
+    index = []
+    start = file.tell()
+    file.write(_HEADER.pack(MAGIC, VERSION, 0))
+    for page in getattr(document, 'pages', document):
+        data = _encode_page(page, styles)
+        index.append((file.tell() - start, len(data)))
+        file.write(data)
+    report = getattr(document, 'report', None)
+    enc = Encoder()
+    enc.encode({
+        'level': getattr(report, '_level', None),
+        'styles': [[getattr(style, attr) for attr in TEXT_STYLE_FIELDS] for style in styles.styles],
+        'index': index,
+    })
+    meta_offset = file.tell() - start
+    file.write(enc.buffer)
+    file.write(_TRAILER.pack(meta_offset, len(enc.buffer), MAGIC))
+
+
+def dumps(document) -> bytes:
+    """
+    Encode a prepared document to bytes
+    :param document:
+    :return:
+    """
+    import io
+    f = io.BytesIO()
+    save(document, f)
+    return f.getvalue()
+
+
+class BinaryDocument:
+    """
+    Prepared document loaded from a binary container.
+    Pages are decoded on access; a file is memory-mapped, so only the touched pages are read.
+    The document can be iterated as a sequence of prepared pages (e.g. by the exporters),
+    and a file-backed document (or a slice of it) is pickled by its filename.
+    :param source: filename or bytes
+    :param start: first page of the view
+    :param stop: page after the last page of the view
+    """
+    def __init__(self, source: str | os.PathLike | bytes, start=0, stop: Optional[int] = None):
+        self.filename = None
+        self._file = None
+        if isinstance(source, (str, os.PathLike)):
+            self.filename = os.fspath(source)
+            self._file = open(self.filename, 'rb')
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buffer = source
+        magic, version, _ = _HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise BinaryFormatError('Not a prepared report container')
+        if version > VERSION:
+            raise BinaryFormatError(f'Unsupported container version: {version}')
+        meta_offset, meta_length, magic = _TRAILER.unpack_from(self._buffer, len(self._buffer) - _TRAILER.size)
+        if magic != MAGIC:
+            raise BinaryFormatError('Truncated prepared report container')
+        meta = Decoder(self._buffer, meta_offset).decode()
+        self.level = meta['level']
+        self.styles: List[TextStyle] = [TextStyle.get(*values) for values in meta['styles']]
+        self._index = meta['index']
+        self._start, self._stop, _ = slice(start, stop).indices(len(self._index))
+        self._stop = max(self._start, self._stop)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        offset, length = self._index[self._start + item]
+        return _decode_page(self._buffer, offset, self.styles)
+
+    def __iter__(self) -> Iterator[PreparedPage]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def pages(self) -> 'BinaryDocument':
+        # the document is a lazy sequence of pages, like ReportStream.pages
+        return self
+
+    def dump(self) -> dict:
+        return {
+            'pages': [p.dump() for p in self],
+            'level': self.level,
+        }
+
+    def view(self, start: int, stop: int = None) -> 'BinaryDocument':
+        """
+        Get a document restricted to the pages start..stop of this document
+        :param start:
+        :param stop:
+        :return:
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if self.filename:
+            return BinaryDocument(self.filename, self._start + start, self._start + stop)
+        return BinaryDocument(self._buffer, self._start + start, self._start + stop)
+
+    def __reduce__(self):
+        if self.filename:
+            return BinaryDocument, (self.filename, self._start, self._stop)
+        return BinaryDocument, (bytes(self._buffer), self._start, self._stop)
+
+    def close(self):
+        if self._file is not None:
+            self._buffer.close()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load(source: str | os.PathLike | bytes) -> BinaryDocument:
+    """
+    Open a binary container, the pages are loaded on demand
+    :param source: filename or bytes
+    :return:
+    """
+    return BinaryDocument(source)
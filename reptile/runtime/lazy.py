@@ -0,0 +1,91 @@
+from typing import List, Iterator, Optional
+import sys
+
+from .stream import PreparedPage
+
+
+class LazyDocument:
+    """
+    Prepared document produced on demand.
+    The band engine runs in a worker thread paused between the requested pages, so its whole state
+    (datasource cursors, groups, line and row counters, page count) is kept until more pages are requested.
+    Page count dependent objects (${...}) keep their placeholders until the preparation finishes,
+    then they are rendered in place on the already returned pages.
+    """
+    def __init__(self, report, level=3):
+        self.report = report
+        self.finished = False
+        self._pages: List[PreparedPage] = []
+        self._iter = report.iter_pages(level, hold_pending=False)
+
+    @property
+    def prepared_pages(self) -> List[PreparedPage]:
+        return self._pages
+
+    @property
+    def page_count(self) -> Optional[int]:
+        """
+        The number of pages, None until the preparation finishes
+        :return:
+        """
+        if self.finished:
+            return len(self._pages)
+
+    def prepare(self, stop: int) -> int:
+        """
+        Prepare the pages up to the page number `stop`
+        :param stop:
+        :return: the number of prepared pages
+        """
+        pages = self._pages
+        while not self.finished and len(pages) < stop:
+            page = next(self._iter, None)
+            if page is None:
+                self.finished = True
+            else:
+                pages.append(page)
+        return len(pages)
+
+    def finish(self) -> int:
+        """
+        Prepare the remaining pages
+        :return: the page count
+        """
+        return self.prepare(sys.maxsize)
+
+    def get_pages(self, start: int, stop: int) -> List[PreparedPage]:
+        """
+        Get the pages start..stop (0 based, stop excluded), preparing them if needed
+        :param start:
+        :param stop:
+        :return:
+        """
+        self.prepare(stop)
+        return self._pages[start:stop]
+
+    def __getitem__(self, item: int) -> PreparedPage:
+        if item < 0:
+            self.finish()
+        else:
+            self.prepare(item + 1)
+        return self._pages[item]
+
+    def __iter__(self) -> Iterator[PreparedPage]:
+        i = 0
+        while i < self.prepare(i + 1):
+            yield self._pages[i]
+            i += 1
+
+    def close(self):
+        """
+        Stop the preparation
+        :return:
+        """
+        self._iter.close()
+        self.finished = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
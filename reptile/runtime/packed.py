@@ -0,0 +1,179 @@
+from typing import List, Dict, Optional
+from array import array
+import math
+
+from .stream import PreparedPage, PreparedBand, PreparedText
+from .placeholders import resolve_placeholders
+
+_TEXT = 0
+_TEXT_ERROR = 1
+_OTHER = 2
+_NAN = math.nan
+
+
+def _num(value):
+    return _NAN if value is None else value
+
+
+def _value(value: float):
+    return None if value != value else value
+
+
+class PackedTables:
+    """
+    String pool and style table shared by the packed pages of a document
+    """
+    def __init__(self):
+        self.strings: List[str] = []
+        # (text style, allow tags, can grow)
+        self.styles: List[tuple] = []
+        self._string_index: Dict[str, int] = {}
+        self._style_index: Dict[tuple, int] = {}
+        # final page count, used to resolve the ${...} placeholders of the packed texts
+        self.page_count: Optional[int] = None
+
+    def intern_string(self, s: Optional[str]) -> int:
+        if s is None:
+            return -1
+        i = self._string_index.get(s)
+        if i is None:
+            i = self._string_index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def intern_style(self, style: tuple) -> int:
+        i = self._style_index.get(style)
+        if i is None:
+            i = self._style_index[style] = len(self.styles)
+            self.styles.append(style)
+        return i
+
+    def get_string(self, i: int) -> Optional[str]:
+        if i < 0:
+            return None
+        return self.strings[i]
+
+
+class PackedPage:
+    """
+    Compact representation of a prepared page: band and text geometry are stored in arrays,
+    text contents and styles are indexes into the tables shared by the document.
+    Images, lines and barcodes are kept as objects.
+    The `bands` property rebuilds transient prepared bands, so exporters can iterate a packed page
+    the same way they iterate a PreparedPage.
+    """
+    __slots__ = (
+        'tables', 'height', 'width', 'index', 'margin', 'x', 'y', 'ay', 'watermark',
+        'band_geometry', 'band_types', 'band_offsets', 'band_fills',
+        'kinds', 'geometry', 'texts', 'styles', 'extras',
+    )
+
+    def __init__(self, tables: PackedTables):
+        self.tables = tables
+        self.band_geometry = array('d')
+        self.band_types = array('l')
+        self.band_offsets = array('l', [0])
+        self.band_fills = None
+        self.kinds = array('b')
+        self.geometry = array('d')
+        self.texts = array('l')
+        self.styles = array('l')
+        self.extras = []
+
+    @classmethod
+    def pack(cls, page: PreparedPage, tables: PackedTables) -> 'PackedPage':
+        packed = cls(tables)
+        packed.height = page.height
+        packed.width = page.width
+        packed.index = getattr(page, 'index', None)
+        packed.margin = page.margin
+        packed.x = getattr(page, 'x', None)
+        packed.y = getattr(page, 'y', None)
+        packed.ay = getattr(page, 'ay', None)
+        packed.watermark = page.watermark
+        intern_string = tables.intern_string
+        intern_style = tables.intern_style
+        kinds = packed.kinds
+        geometry = packed.geometry
+        texts = packed.texts
+        styles = packed.styles
+        for i, band in enumerate(page.bands):
+            packed.band_geometry.extend((
+                _num(band.left), _num(band.top), _num(band.width), _num(band.height), _num(band.bottom),
+            ))
+            packed.band_types.append(intern_string(band.band_type))
+            if band.fill is not None:
+                if packed.band_fills is None:
+                    packed.band_fills = {}
+                packed.band_fills[i] = band.fill
+            for obj in band.objects or ():
+                geometry.extend((_num(obj.left), _num(obj.top), _num(obj.width), _num(obj.height)))
+                if type(obj) is PreparedText:
+                    kinds.append(_TEXT_ERROR if obj.error else _TEXT)
+                    texts.append(intern_string(obj.text))
+                    styles.append(intern_style((obj.style, getattr(obj, 'allow_tags', None), obj.can_grow)))
+                else:
+                    kinds.append(_OTHER)
+                    texts.append(-1)
+                    styles.append(len(packed.extras))
+                    packed.extras.append(obj)
+            packed.band_offsets.append(len(kinds))
+        return packed
+
+    def get_text(self, i: int) -> Optional[str]:
+        text = self.tables.get_string(self.texts[i])
+        if text and '${' in text and self.tables.page_count is not None:
+            text = resolve_placeholders(text, self.index, self.tables.page_count)
+        return text
+
+    def get_object(self, i: int):
+        if self.kinds[i] == _OTHER:
+            return self.extras[self.styles[i]]
+        obj = PreparedText(self.get_text(i))
+        obj.style, obj.allow_tags, obj.can_grow = self.tables.styles[self.styles[i]]
+        g = i * 4
+        geometry = self.geometry
+        obj.left = _value(geometry[g])
+        obj.top = _value(geometry[g + 1])
+        obj.width = _value(geometry[g + 2])
+        obj.height = _value(geometry[g + 3])
+        obj.error = self.kinds[i] == _TEXT_ERROR
+        return obj
+
+    def get_band(self, i: int) -> PreparedBand:
+        g = i * 5
+        geometry = self.band_geometry
+        band = PreparedBand(
+            _value(geometry[g]), _value(geometry[g + 1]), _value(geometry[g + 2]), _value(geometry[g + 3]),
+            _value(geometry[g + 4]),
+        )
+        band.band_type = self.tables.get_string(self.band_types[i])
+        if self.band_fills and i in self.band_fills:
+            band.fill = self.band_fills[i]
+        band.objects = [self.get_object(j) for j in range(self.band_offsets[i], self.band_offsets[i + 1])]
+        return band
+
+    def iter_bands(self):
+        for i in range(len(self.band_types)):
+            yield self.get_band(i)
+
+    @property
+    def bands(self) -> List[PreparedBand]:
+        return list(self.iter_bands())
+
+    def unpack(self) -> PreparedPage:
+        page = PreparedPage(self.height, self.width, None)
+        page.margin = self.margin
+        page.index = self.index
+        if self.x is not None:
+            page.x = self.x
+            page.y = self.y
+            page.ay = self.ay
+        page.watermark = self.watermark
+        page.bands = self.bands
+        return page
+
+    def dump(self) -> dict:
+        return {
+            'bands': [b.dump() for b in self.iter_bands()]
+        }
@@ -0,0 +1,72 @@
+from functools import lru_cache
+import re
+
+from reptile import EnvironmentSettings
+
+_re_placeholder = re.compile(r'\$\{\s*(.*?)\s*\}')
+_re_name = re.compile(r'^[A-Za-z_]\w*$')
+
+
+class Placeholders:
+    """
+    Compiled text with late-binding ${...} placeholders.
+    Simple names (page_index, page_count) are resolved by a plain substitution,
+    other expressions are evaluated once per resolution through a cached jinja expression.
+    """
+    __slots__ = ('parts',)
+
+    def __init__(self, text: str):
+        parts = []
+        pos = 0
+        for m in _re_placeholder.finditer(text):
+            if m.start() > pos:
+                parts.append((False, text[pos:m.start()]))
+            expr = m.group(1)
+            if _re_name.match(expr):
+                parts.append((True, expr))
+            else:
+                parts.append((True, _compile_expression(expr)))
+            pos = m.end()
+        if pos < len(text):
+            parts.append((False, text[pos:]))
+        self.parts = tuple(parts)
+
+    def render(self, page_index: int, page_count: int, context: dict = None) -> str:
+        res = []
+        for is_expr, value in self.parts:
+            if not is_expr:
+                res.append(value)
+            elif value == 'page_count':
+                res.append(str(page_count))
+            elif value == 'page_index':
+                res.append(str(page_index))
+            elif isinstance(value, str):
+                res.append(str(context.get(value, '') if context else ''))
+            else:
+                variables = dict(context or (), page_index=page_index, page_count=page_count)
+                res.append(str(value(variables)))
+        return ''.join(res)
+
+
+@lru_cache(maxsize=1024)
+def _compile_expression(expr: str):
+    return EnvironmentSettings.env.compile_expression(expr)
+
+
+@lru_cache(maxsize=1024)
+def compile_placeholders(text: str) -> Placeholders:
+    return Placeholders(text)
+
+
+def resolve_placeholders(text: str, page_index: int, page_count: int, context: dict = None) -> str:
+    """
+    Resolve the ${...} placeholders of a prepared text
+    :param text:
+    :param page_index:
+    :param page_count:
+    :param context:
+    :return:
+    """
+    if '${' not in text:
+        return text
+    return compile_placeholders(text).render(page_index, page_count, context)
@@ -1,5 +1,6 @@
 import enum
-from typing import List, Type, Optional
+import threading
+from typing import List, NamedTuple, Type, Optional
 from dataclasses import dataclass
 
 
@@ -24,12 +25,123 @@ class PreparedObject:
         self.y: Optional[float] = None
 
 
+TEXT_STYLE_FIELDS = (
+    'font_name', 'font_size', 'font_bold', 'font_italic', 'color', 'background', 'brush_style',
+    'valign', 'halign', 'border', 'wrap', 'padding',
+)
+
+
+class BorderStyle(NamedTuple):
+    """
+    Immutable snapshot of the border of a text, shared by the text styles
+    """
+    left: bool = False
+    top: bool = False
+    right: bool = False
+    bottom: bool = False
+    width: float = 1
+    color: Optional[int] = 0x000000
+    style: Optional[int] = None
+
+    def __bool__(self):
+        return bool(self.left or self.top or self.right or self.bottom)
+
+
+class PaddingStyle(NamedTuple):
+    """
+    Immutable snapshot of the padding of a text, shared by the text styles
+    """
+    left: float = 0
+    top: float = 0
+    right: float = 0
+    bottom: float = 0
+
+    def __bool__(self):
+        return bool(self.left or self.top or self.right or self.bottom)
+
+
+def _snapshot(cls, value):
+    # the border and padding of the report objects are mutable, the style keeps a copy of their values
+    if value is None or type(value) is cls:
+        return value
+    if isinstance(value, (tuple, list)):
+        return cls(*value)
+    return cls(*(getattr(value, attr, default) for attr, default in cls._field_defaults.items()))
+
+
+class TextStyle:
+    """
+    Immutable text style shared by the prepared texts.
+    Styles are interned by `TextStyle.get`, equal styles are the same instance with the same id,
+    so the exporters can compare the style of consecutive texts by identity.
+    """
+    __slots__ = ('id',) + TEXT_STYLE_FIELDS
+    _registry = {}
+    _lock = threading.Lock()
+
+    def __init__(self, style_id: int, values: tuple):
+        object.__setattr__(self, 'id', style_id)
+        for attr, value in zip(TEXT_STYLE_FIELDS, values):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('TextStyle is immutable')
+
+    @classmethod
+    def get(
+        cls, font_name='Helvetica', font_size=9, font_bold=False, font_italic=False, color='#000000',
+        background=None, brush_style=None, valign=None, halign=None, border=None, wrap=False, padding=None,
+    ) -> 'TextStyle':
+        """
+        Get the interned style for the given attributes
+        :return:
+        """
+        values = (
+            font_name, font_size, font_bold, font_italic, color, background, brush_style,
+            valign, halign, _snapshot(BorderStyle, border), wrap, _snapshot(PaddingStyle, padding),
+        )
+        style = cls._registry.get(values)
+        if style is None:
+            with cls._lock:
+                style = cls._registry.get(values)
+                if style is None:
+                    style = cls._registry[values] = cls(len(cls._registry), values)
+        return style
+
+    def replace(self, **kwargs) -> 'TextStyle':
+        """
+        Get the interned style with the given attributes replaced
+        :param kwargs:
+        :return:
+        """
+        values = {attr: getattr(self, attr) for attr in TEXT_STYLE_FIELDS}
+        values.update(kwargs)
+        return self.get(**values)
+
+    def __reduce__(self):
+        # interned again when unpickled (e.g. by the export processes)
+        return _text_style, tuple(getattr(self, attr) for attr in TEXT_STYLE_FIELDS)
+
+    def __repr__(self):
+        return f'<TextStyle {self.id}>'
+
+
+def _text_style(*values) -> TextStyle:
+    return TextStyle.get(*values)
+
+
+def _style_property(attr):
+    def fget(self):
+        return getattr(self.style, attr)
+
+    def fset(self, value):
+        self.style = self.style.replace(**{attr: value})
+
+    return property(fget, fset)
+
+
 class PreparedText(PreparedObject):
-    __slots__ = (
-        'left', 'top', 'height', 'width', 'allow_tags', 'text', 'font_name', 'font_size', 'font_bold', 'font_italic',
-        'background', 'brush_style', 'valign', 'halign', 'border', 'wrap', 'can_grow', 'error', 'color', 'can_grow',
-        'padding',
-    )
+    __slots__ = ('left', 'top', 'height', 'width', 'allow_tags', 'text', 'style', 'can_grow', 'error')
 
     def __init__(self, text=None, x=0, y=0):
         self.text = text
@@ -37,17 +149,24 @@ class PreparedText(PreparedObject):
         self.top = y
         self.width = None
         self.height = 0
-        self.font_bold = False
-        self.font_italic = False
-        self.font_name = 'Helvetica'
-        self.font_size = 9
-        self.padding = None
-        self.background = None
-        self.wrap = False
+        self.style = DEFAULT_TEXT_STYLE
         self.error = False
-        self.color = '#000000'
         self.can_grow = False
 
+    # style attributes, assigning a value replaces the style of the object
+    font_name = _style_property('font_name')
+    font_size = _style_property('font_size')
+    font_bold = _style_property('font_bold')
+    font_italic = _style_property('font_italic')
+    color = _style_property('color')
+    background = _style_property('background')
+    brush_style = _style_property('brush_style')
+    valign = _style_property('valign')
+    halign = _style_property('halign')
+    border = _style_property('border')
+    wrap = _style_property('wrap')
+    padding = _style_property('padding')
+
     def dump(self):
         return {
             'left': self.left,
@@ -61,6 +180,9 @@ class PreparedText(PreparedObject):
         }
 
 
+DEFAULT_TEXT_STYLE = TextStyle.get()
+
+
 class SizeMode(enum.IntEnum):
     NORMAL = 0
     CENTER = 1
@@ -216,9 +338,64 @@ class PreparedPage:
 class ReportStream:
     _page: PreparedPage = None
 
-    def __init__(self, report):
+    def __init__(self, report, on_page=None, page_count: int = None, packed=False, hold_pending=True):
         self.report = report
         self.pages: List[PreparedPage] = []
+        # streaming mode: closed pages are handed to the on_page callback instead of being kept
+        self.on_page = on_page
+        # page count known in advance (double pass)
+        self.page_count = page_count
+        # hold the pages with page count dependent objects until the end of the preparation,
+        # otherwise these objects are rendered in place at the end
+        self.hold_pending = hold_pending
+        self._held: List[PreparedPage] = []
+        # closed pages are kept as packed pages
+        self.packed_tables = None
+        if packed:
+            from .packed import PackedTables
+            self.packed_tables = PackedTables()
+
+    def add_page(self, page: PreparedPage):
+        if self.on_page is None:
+            self.pages.append(page)
+
+    def close_page(self, page: PreparedPage):
+        """
+        Notify the stream that the page will not be modified anymore
+        :param page:
+        :return:
+        """
+        if self.on_page is None:
+            if self.packed_tables is not None and self.pages and self.pages[-1] is page:
+                self._pack_page(page)
+            return
+        report = self.report
+        if report._pending_objects and self.page_count is not None:
+            report.resolve_pending()
+        if self.hold_pending and (report._pending_objects or self._held):
+            # the page count is unknown yet, so the page must wait the end of the preparation
+            self._held.append(page)
+        else:
+            self.on_page(page)
+
+    def _pack_page(self, page: PreparedPage):
+        from .packed import PackedPage
+        # the pending objects belong to this page, the packed texts are resolved on access
+        self.report._pending_objects.clear()
+        self.pages[-1] = PackedPage.pack(page, self.packed_tables)
+
+    def flush(self):
+        """
+        Emit all pages held by pending objects
+        :return:
+        """
+        if self.packed_tables is not None:
+            self.packed_tables.page_count = self.report.page_count
+        held = self._held
+        self._held = []
+        if self.on_page is not None:
+            for page in held:
+                self.on_page(page)
 
     def add_line(self, line):
         self.page.lines.append(line)
@@ -257,6 +434,15 @@ class ReportStream:
             'level': self.report._level,
         }
 
+    def save(self, file):
+        """
+        Save the prepared report to a binary container (see runtime.binary)
+        :param file: filename or binary file object
+        :return:
+        """
+        from .binary import save
+        save(self, file)
+
 
 class PreparedBarcode:
     __slots__ = ('barcode', 'data', 'left', 'top', 'height', 'width', 'size_mode', 'thickness')
@@ -1,6 +1,8 @@
 import json
 import unittest
-from reptile.bands import Report, Page, Band, Text
+from reptile import EnvironmentSettings
+from reptile.bands import Report, Page, Band, Text, DataBand
+from reptile.core import Font
 
 
 class CoreTestCase(unittest.TestCase):
@@ -61,6 +63,116 @@ class CoreTestCase(unittest.TestCase):
         text.can_shrink = True
         new_text = text.process({})
 
+    def test_template_cache(self):
+        cache = EnvironmentSettings.template_cache
+        cache.clear()
+        texts = []
+        for i in range(3):
+            rep = Report()
+            page = rep.new_page()
+            band = DataBand()
+            page.add_band(band)
+            band.row_count = 2
+            text = Text('Line: {{ line }} of {{ this.name }}')
+            text.name = 'text%s' % i
+            band.add_object(text)
+            texts.append(text)
+            doc = rep.prepare(1)
+            self.assertEqual(doc.pages[0].bands[1].objects[0].text, 'Line: 2 of text%s' % i)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 2)
+        self.assertIsNot(texts[0].template, texts[1].template)
+
+    def test_text_style(self):
+        from reptile.core import Highlight
+        text = Text('{{ record.value }}')
+        text.font.size = 12
+        text.highlight = Highlight({'condition': 'record.value > 1', 'background': {'color': '#ff0000'}})
+        other = Text('Other')
+        other.font.size = 12
+        objs = [text.process({'record': {'value': i}}) for i in range(3)]
+        self.assertIs(objs[0].style, objs[1].style)
+        self.assertIs(objs[0].style, other.process({}).style)
+        self.assertIsNot(objs[2].style, objs[0].style)
+        self.assertEqual(objs[2].background, '#ff0000')
+        self.assertEqual(objs[0].font_size, 12)
+        # assigning a style attribute replaces the style of the prepared object
+        objs[1].font_size = 14
+        self.assertEqual(objs[1].font_size, 14)
+        self.assertEqual(objs[0].font_size, 12)
+        with self.assertRaises(AttributeError):
+            objs[0].style.font_size = 10
+        # the style keeps a copy of the border, changes made afterwards don't affect the shared style
+        style = other.style
+        other.border.left = True
+        other.padding.left = 8
+        self.assertIs(objs[0].style, style)
+        self.assertFalse(style.border)
+        self.assertEqual(style.padding.left, 2)
+        # the changes made in place are applied by the next preparation
+        self.assertIs(other.style, style)
+        rep = Report()
+        band = Band()
+        rep.new_page().add_band(band)
+        band.add_object(other)
+        rep.prepare()
+        self.assertTrue(other.style.border.left)
+        self.assertEqual(other.process({}).style.padding.left, 8)
+        # assigning a style attribute applies it immediately
+        font = Font()
+        font.bold = True
+        other.font = font
+        self.assertTrue(other.process({}).font_bold)
+        self.assertFalse(text.process({'record': {'value': 0}}).font_bold)
+
+    def test_text_render_modes(self):
+        import datetime
+        from reptile.core import DisplayFormat
+        context = {'record': {'name': 'Name', 'value': datetime.date(2024, 3, 1)}, 'line': 2}
+        static = Text('Static label')
+        field = Text("Value: {{ record['value'] }}")
+        field.display_format = DisplayFormat('%d/%m/%Y', 'DateTime')
+        expression = Text('{{ line + 1 }}')
+        missing = Text('{{ record.missing }}')
+        for text, expected in ((static, 'Static label'), (field, 'Value: 01/03/2024'), (expression, '3'), (missing, '')):
+            self.assertEqual(text.process(context).text, expected)
+        # static texts and fields are not rendered by jinja
+        self.assertIsNone(static._template)
+        self.assertIsNone(field._template)
+        for text in (static, field, expression, missing):
+            self.assertEqual(text.template.render(context), text.process(context).text)
+        self.assertEqual(Text('{{ record.name }}').process(context).text, 'Name')
+
+    def test_row_context(self):
+        from reptile import LayeredContext, render_template
+        from reptile.bands import FooterBand
+        rep = Report()
+        page = rep.new_page()
+        band = DataBand()
+        band.name = 'detail'
+        page.add_band(band)
+        band.row_count = 3
+        text = Text('{{ line }} {{ detail }} {{ odd }} {{ this.name }}')
+        text.name = 'label'
+        band.add_object(text)
+        footer = FooterBand()
+        page.add_band(footer)
+        band.footer = footer
+        footer.add_object(Text('{{ line }} {{ record }}'))
+        doc = rep.prepare(1)
+        bands = doc.pages[0].bands
+        self.assertEqual(bands[1].objects[0].text, '2 1 False label')
+        # the last row remains available to the footer
+        self.assertEqual(bands[-1].objects[0].text, '3 2')
+        parent = {'a': 1}
+        context = LayeredContext(parent, {'b': 2})
+        context['b'] = 3
+        context['c'] = 4
+        self.assertEqual(parent, {'a': 1, 'c': 4})
+        self.assertEqual(dict(context), {'a': 1, 'b': 3, 'c': 4})
+        template = EnvironmentSettings.template_cache.from_string('{{ a + b + c }} {{ str(b) }}')
+        self.assertEqual(render_template(template, context), '8 3')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,27 @@
+import copy
+from unittest import TestCase
+
+from benchmarks.runner import run_case, compare
+from benchmarks.shapes import SHAPES, generate_rows
+
+
+class BenchmarksTestCase(TestCase):
+    def test_shapes(self):
+        self.assertEqual(list(generate_rows(5, notes=True)), list(generate_rows(5, notes=True)))
+        results = {}
+        for shape in SHAPES:
+            result = results[shape] = run_case(shape, 20, exporters=['binary'])
+            self.assertGreaterEqual(result['pages'], 1)
+            self.assertGreater(result['prepare']['time'], 0)
+            self.assertGreater(result['exporters']['binary']['bytes'], 0)
+        # the detail band prints rows for every master row
+        self.assertGreater(results['subreport']['pages'], results['flat']['pages'])
+
+    def test_compare(self):
+        base = {'results': [run_case('flat', 10, exporters=[])]}
+        new = copy.deepcopy(base)
+        new['results'][0]['prepare']['time'] *= 2
+        diff = {item['metric']: item for item in compare(base, new, threshold=0.5)}
+        self.assertTrue(diff['prepare.time']['regression'])
+        self.assertAlmostEqual(diff['prepare.time']['ratio'], 2)
+        self.assertFalse(diff['prepare.peakRss']['regression'])
@@ -0,0 +1,449 @@
+from unittest import TestCase, skipIf
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from reptile.bands import Report, DataBand, GroupHeader, Text, DataSource
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class ColumnarTestCase(TestCase):
+    def test_columnar_datasource(self):
+        from reptile.data.columnar import ColumnarDataSource, ColumnarRow
+        records = [{'id': i, 'category': 'Category %s' % (i // 10), 'amount': i * 1.5} for i in range(30)]
+        datasource = ColumnarDataSource(records, 'data1')
+        data = datasource.data
+        self.assertEqual(len(data), 30)
+        self.assertIsInstance(data[3], ColumnarRow)
+        self.assertEqual(data[3]['id'], 3)
+        self.assertEqual(data[3].category, 'Category 0')
+        self.assertEqual(len(data[10:20]), 10)
+        self.assertEqual(data[10:20][0].id, 10)
+        self.assertEqual(datasource.data.avg('amount'), 21.75)
+
+        rep = Report()
+        rep.register_datasource(datasource)
+        page = rep.new_page()
+        group = GroupHeader()
+        page.add_band(group)
+        group.expression = "data1['category']"
+        group.add_object(Text('{{ group.grouper }}: {{ sum(data1.values("amount")) }}'))
+        band = DataBand()
+        page.add_band(band)
+        band.datasource = datasource
+        band.group_header = group
+        group.band = band
+        band.add_object(Text('{{ data1.id }} {{ data1.amount }}'))
+        doc = rep.prepare()
+        bands = doc.pages[0].bands
+        self.assertEqual(bands[0].objects[0].text, 'Category 0: 67.50')
+        self.assertEqual(bands[2].objects[0].text, '1 1.50')
+        self.assertEqual(bands[11].objects[0].text, 'Category 1: 217.50')
+
+
+class DataRangeTestCase(TestCase):
+    def test_group_ranges(self):
+        from reptile.data.ranges import DataRange, group_ranges
+        data = [{'id': i, 'category': i // 4, 'sub': i // 2} for i in range(10)]
+        groups = list(group_ranges(data, lambda rec: rec['category']))
+        self.assertEqual([(k, len(rows)) for k, rows in groups], [(0, 4), (1, 4), (2, 2)])
+        rows = groups[1][1]
+        self.assertIsInstance(rows, DataRange)
+        self.assertIs(rows.data, data)
+        self.assertEqual([rec['id'] for rec in rows], [4, 5, 6, 7])
+        self.assertEqual(rows[-1]['id'], 7)
+        # nested groups are ranges of the same list
+        sub = list(group_ranges(rows, lambda rec: rec['sub']))
+        self.assertIs(sub[1][1].data, data)
+        self.assertEqual((sub[1][1].start, sub[1][1].stop), (6, 8))
+        # streamed rows can't be sliced
+        groups = list(group_ranges(iter(data), lambda rec: rec['category']))
+        self.assertEqual(groups[2][1], data[8:])
+
+        rep = Report()
+        page = rep.new_page()
+        datasource = DataSource(data, 'data1')
+        group = GroupHeader()
+        page.add_band(group)
+        group.expression = "data1['category']"
+        group.add_object(Text('{{ group.grouper }}: {{ group.count }} {{ sum(data1.values("id")) }} {{ data1.id }}'))
+        band = DataBand()
+        page.add_band(band)
+        band.datasource = datasource
+        band.group_header = group
+        group.band = band
+        band.add_object(Text('{{ data1.id }}'))
+        bands = rep.prepare().pages[0].bands
+        self.assertEqual(bands[5].objects[0].text, '1: 4 22 4')
+        self.assertEqual(bands[9].objects[0].text, '7')
+
+
+class SortedGroupsTestCase(TestCase):
+    def make_report(self, data, mode, buffer_size=None):
+        rep = Report()
+        page = rep.new_page()
+        datasource = DataSource(data, 'data1')
+        group = GroupHeader()
+        page.add_band(group)
+        group.field = 'category'
+        group.group_mode = mode
+        group.sort_buffer_size = buffer_size
+        group.add_object(Text('{{ group.grouper }}'))
+        subgroup = GroupHeader()
+        page.add_band(subgroup)
+        subgroup.parent = group
+        subgroup.expression = 'data1.id % 2'
+        subgroup.add_object(Text('{{ group.grouper }}: {{ group.count }}'))
+        band = DataBand()
+        page.add_band(band)
+        band.datasource = datasource
+        band.parent = subgroup
+        band.add_object(Text('{{ data1.id }}'))
+        return rep
+
+    def test_group_mode(self):
+        data = [{'id': i, 'category': 'C%s' % (i * 7 % 3)} for i in range(12)]
+        expected = {
+            'sort': ['C0', '0: 2', '0', '6', '1: 2', '3', '9', 'C1'],
+            'hash': ['C0', '0: 2', '0', '6', '1: 2', '3', '9', 'C1'],
+        }
+        for mode, texts in expected.items():
+            bands = self.make_report(data, mode).prepare().pages[0].bands
+            self.assertEqual([b.objects[0].text for b in bands[:8]], texts)
+            self.assertEqual(len([b for b in bands if b.band_type == 'GroupHeader']), 9)
+        # hash partitioning keeps the groups in order of their first row
+        data.reverse()
+        bands = self.make_report(data, 'hash').prepare().pages[0].bands
+        self.assertEqual(bands[0].objects[0].text, 'C2')
+        bands = self.make_report(data, 'sort').prepare().pages[0].bands
+        self.assertEqual(bands[0].objects[0].text, 'C0')
+        # the rows are read once and sorted by runs written to disk
+        expected = [b.dump() for b in bands]
+        rows = iter(data)
+        bands = self.make_report(rows, 'sort', buffer_size=5).prepare().pages[0].bands
+        self.assertEqual([b.dump() for b in bands], expected)
+
+    def test_sort_rows(self):
+        from reptile.data.sorting import sort_rows
+        rows = [{'a': 2, 'b': None}, {'a': 1, 'b': 'x'}, {'a': 2, 'b': 'a'}, {'a': None, 'b': 'y'}, {'a': 1, 'b': 'x'}]
+        funcs = [lambda r: r['a'], lambda r: r['b']]
+        result = sort_rows(rows, funcs)
+        self.assertEqual(result.keys, [(1, 'x'), (1, 'x'), (2, 'a'), (2, None), (None, 'y')])
+        # stable
+        self.assertIs(result[0], rows[1])
+        self.assertEqual(sort_rows(iter(rows), funcs, buffer_size=2).keys, result.keys)
+        # keys of different types are sorted by their text, in memory and by the external sort
+        rows = [{'k': 'a'}, {'k': 1}, {'k': None}, {'k': 2}]
+        funcs = [lambda r: r['k']]
+        for data, buffer_size in ((rows, None), (iter(rows), 2), (iter(rows), 1), (iter(rows[::-1]), 2)):
+            self.assertEqual(sort_rows(data, funcs, buffer_size=buffer_size).keys, [(1,), (2,), ('a',), (None,)])
+        self.assertEqual(list(sort_rows(iter([{'k': 1}, {'k': 'a'}]), funcs, buffer_size=2)), [{'k': 1}, {'k': 'a'}])
+
+
+class SQLDataSourceTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import sqlite3
+        cls.db = sqlite3.connect(':memory:')
+        cls.db.execute('create table product (id integer, name varchar(100), category integer)')
+        cls.db.executemany(
+            'insert into product values (?, ?, ?)', [(i, 'Product %s' % i, i // 10) for i in range(100)]
+        )
+
+    def test_stream(self):
+        from reptile.data.sqlite import SqliteConnection
+        from reptile.data.buffer import SpillBuffer
+        conn = SqliteConnection(db=self.db)
+        datasource = conn.datasource_factory('data1', 'select * from product where category >= :category order by id')
+        datasource.params['category'] = 0
+        datasource.batch_size = 7
+        datasource.spill_threshold = 30
+        rep = Report(default_connection=conn)
+        rep.variables['category'] = 5
+        rep.register_datasource(datasource)
+        page = rep.new_page()
+        band = DataBand()
+        page.add_band(band)
+        band.datasource = datasource
+        band.add_object(Text('{{ data1.id }} {{ data1.name }}'))
+        executed = []
+        execute = datasource._execute
+        datasource._execute = lambda: executed.append(dict(datasource.params)) or execute()
+        doc = rep.prepare()
+        bands = [band for p in doc.pages for band in p.bands]
+        self.assertEqual(len(bands), 50)
+        self.assertEqual(bands[0].objects[0].text, '50 Product 50')
+        self.assertEqual(bands[-1].objects[0].text, '99 Product 99')
+        # a single pass streams the rows without keeping them
+        data = datasource.data
+        self.assertEqual(executed, [{'category': 5}])
+        self.assertFalse(data.buffered)
+        self.assertIsNone(data._rows)
+        # random access keeps the rows, for the next passes too
+        self.assertEqual(len(data), 50)
+        self.assertTrue(data.buffered)
+        self.assertIsInstance(data.buffer, SpillBuffer)
+        self.assertEqual(data[49]['name'], 'Product 99')
+        self.assertEqual([row['id'] for row in data][:3], [50, 51, 52])
+        self.assertEqual(sum(row['id'] for row in data), sum(range(50, 100)))
+        self.assertEqual(len(executed), 2)
+        # a parameter change fetches the rows again
+        datasource.params['category'] = 9
+        self.assertEqual([row['id'] for row in datasource.data][:2], [90, 91])
+        self.assertEqual(len(executed), 3)
+        # the second pass keeps the rows, a partial pass is resumed by the next pass
+        data = datasource.data
+        self.assertEqual(len([row for row in data]), 10)
+        it = iter(data)
+        self.assertEqual([next(it)['id'], next(it)['id']], [90, 91])
+        self.assertEqual(len([row for row in data]), 10)
+        self.assertTrue(data.buffered)
+        self.assertEqual(len(executed), 4)
+        # the first row is peeked to check an empty result, the next pass reads the same execution
+        datasource.close()
+        self.assertTrue(datasource.data)
+        self.assertEqual(len([row for row in datasource.data]), 10)
+        self.assertEqual(len(executed), 5)
+        datasource.params['category'] = 10
+        self.assertFalse(datasource.data)
+        self.assertEqual([row for row in datasource.data], [])
+        self.assertEqual(len(executed), 6)
+
+    def test_reprepare(self):
+        from reptile.data.sqlite import SqliteConnection
+        from reptile.bands import PageFooter
+        conn = SqliteConnection(db=self.db)
+
+        def make_report():
+            rep = Report(default_connection=conn)
+            master = DataSource([{'id': i} for i in range(60)], 'master')
+            detail = conn.datasource_factory('detail', 'select * from product where category >= :category order by id')
+            detail.params['category'] = 0
+            rep.register_datasource(master)
+            rep.register_datasource(detail)
+            page = rep.new_page()
+            footer = PageFooter()
+            page.add_band(footer)
+            footer.add_object(Text('Page ${page_index} of ${page_count}'))
+            for ds in (master, detail):
+                band = DataBand()
+                page.add_band(band)
+                band.datasource = ds
+                band.add_object(Text('{{ %s.id }}' % ds.name))
+            return rep
+
+        rep = make_report()
+        rep.variables['category'] = 1
+        doc = rep.prepare(track_sections=True)
+        first_page = doc.pages[0]
+        page_count = len(doc.pages)
+        rep.variables['category'] = 9
+        doc = rep.reprepare()
+        expected = make_report()
+        expected.variables['category'] = 9
+        self.assertEqual(doc.dump(), expected.prepare().dump())
+        # the sections are only tracked on demand
+        self.assertIsNone(expected._sections)
+        # the pages before the detail band are reused
+        self.assertIs(doc.pages[0], first_page)
+        self.assertEqual(doc.pages[-1].bands[-2].objects[0].text, '99')
+        self.assertLess(len(doc.pages), page_count)
+        self.assertEqual(doc.pages[0].bands[-1].objects[0].text, f'Page 1 of {len(doc.pages)}')
+        # nothing changed
+        self.assertIs(rep.reprepare(), doc)
+        # the rows added to a list datasource are detected
+        rep.datasources[0].data.append({'id': 60})
+        doc = rep.reprepare()
+        expected = make_report()
+        expected.variables['category'] = 9
+        expected.datasources[0].data.append({'id': 60})
+        self.assertEqual(doc.dump(), expected.prepare().dump())
+        # without the preparation state, the document is prepared again
+        rep.release_prepare_state()
+        self.assertEqual(rep._resolved_objects, [])
+        self.assertEqual(rep.reprepare().dump(), doc.dump())
+
+
+class ConnectionPoolTestCase(TestCase):
+    def test_pool(self):
+        import os
+        import sqlite3
+        import tempfile
+        from reptile.data.pool import ConnectionPool, PoolTimeout
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'test.db')
+            db = sqlite3.connect(filename)
+            db.execute('create table product (id integer, name varchar(100))')
+            db.executemany('insert into product values (?, ?)', [(i, 'Product %s' % i) for i in range(20)])
+            db.commit()
+            db.close()
+            pool = ConnectionPool(
+                lambda: sqlite3.connect(filename, check_same_thread=False), min_size=1, max_size=2,
+                health_check='select 1', param_marker='?',
+            )
+            for i in range(3):
+                rep = Report(default_connection=pool)
+                rep.load({'report': {
+                    'datasources': [{'name': 'data1', 'sql': 'select * from product where id < :max_id'}],
+                    'pages': [{'bands': [{
+                        'type': 'DataBand', 'name': 'band1', 'datasource': 'data1',
+                        'objects': [{'type': 'Text', 'text': '{{ data1.name }}', 'x': 0, 'y': 0, 'width': 100, 'height': 20}],
+                    }]}],
+                }})
+                # the parameters are declared by the sql
+                self.assertEqual(rep.datasources[0].params, {'max_id': None})
+                rep.variables['max_id'] = 5
+                doc = rep.prepare()
+                self.assertEqual(len(doc.pages[0].bands), 5)
+                self.assertEqual(doc.pages[0].bands[-1].objects[0].text, 'Product 4')
+            stats = pool.stats()
+            self.assertEqual(stats['size'], 1)
+            self.assertEqual(stats['statement_misses'], 1)
+            self.assertEqual(stats['statement_hits'], 2)
+            # pool exhausted
+            conn1 = pool.acquire()
+            conn2 = pool.acquire()
+            with self.assertRaises(PoolTimeout):
+                pool.acquire(timeout=.01)
+            pool.release(conn2)
+            # broken connections are replaced
+            conn2.raw.close()
+            conn3 = pool.acquire()
+            self.assertIsNot(conn3, conn2)
+            pool.release(conn1)
+            pool.release(conn3)
+            # the cursor of a failed execution is not cached
+            with self.assertRaises(sqlite3.Error):
+                pool.execute('select * from missing')
+            for conn in pool._idle:
+                self.assertNotIn('select * from missing', conn._statements)
+            pool.close()
+            self.assertEqual(pool.stats()['size'], 0)
+
+            # the health check runs without holding the pool lock
+            import threading
+            locked = []
+
+            def check(raw):
+                def probe():
+                    free = pool._cond.acquire(blocking=False)
+                    if free:
+                        pool._cond.release()
+                    locked.append(not free)
+                t = threading.Thread(target=probe)
+                t.start()
+                t.join()
+
+            pool = ConnectionPool(lambda: sqlite3.connect(filename, check_same_thread=False), health_check=check)
+            with pool.connection():
+                pass
+            pool.close()
+            self.assertEqual(locked, [False])
+
+
+class SlowDataSource(DataSource):
+    in_memory = False
+
+    def __init__(self, data, name, log, delay=.2, barrier=None):
+        super().__init__(data, name)
+        self.log = log
+        self.delay = delay
+        # the datasources opened concurrently wait for each other
+        self.barrier = barrier
+
+    def open(self):
+        import threading
+        import time
+        time.sleep(self.delay)
+        if self.barrier:
+            self.barrier.wait(5)
+        self.log.append((self.name, threading.current_thread()))
+        super().open()
+
+
+class OpenDataSourcesTestCase(TestCase):
+    def test_parallel_open(self):
+        import threading
+        log = []
+        rep = Report()
+        barrier = threading.Barrier(4)
+        for i in range(4):
+            rep.register_datasource(SlowDataSource([{'id': i}], 'data%s' % i, log, delay=.05, barrier=barrier))
+        detail = SlowDataSource([{'id': 10}], 'detail', log, delay=0)
+        detail.depends_on = ['data0', 'data3']
+        rep.register_datasource(detail)
+        # the barrier is broken unless the 4 datasources are opened at the same time
+        rep.prepare()
+        self.assertFalse(barrier.broken)
+        self.assertEqual(log[-1][0], 'detail')
+        self.assertEqual(set(rep.datasource_timings), {'data0', 'data1', 'data2', 'data3', 'detail'})
+        self.assertGreaterEqual(rep.datasource_timings['data1'], .05)
+        # sequential
+        rep.max_workers = 1
+        log.clear()
+        rep.datasources.reverse()
+        for ds in rep.datasources:
+            ds.barrier = None
+            ds.close()
+        rep.open_datasources()
+        self.assertEqual([name for name, _ in log], ['data3', 'data2', 'data1', 'data0', 'detail'])
+        # the in-memory datasources are opened by the calling thread
+        rep.max_workers = 4
+        log.clear()
+        for ds in rep.datasources:
+            ds.in_memory = True
+            ds.delay = 0
+            ds.close()
+        rep.open_datasources()
+        self.assertEqual({thread for _, thread in log}, {threading.current_thread()})
+        detail.depends_on = ['unknown']
+        with self.assertRaises(ValueError):
+            rep.open_datasources()
+
+    def test_parallel_open_sql(self):
+        import os
+        import sqlite3
+        import tempfile
+        import threading
+        from reptile.data.pool import ConnectionPool
+        from reptile.data.sqlite import SqliteConnection
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'test.db')
+            db = sqlite3.connect(filename)
+            db.execute('create table product (id integer)')
+            db.executemany('insert into product values (?)', [(i,) for i in range(100)])
+            db.commit()
+            threads = []
+            pool = ConnectionPool(
+                lambda: threads.append(threading.current_thread()) or sqlite3.connect(filename, check_same_thread=False),
+                min_size=0, max_size=4, param_marker='?',
+            )
+            # the connection can only be used by the thread that created it
+            conn = SqliteConnection(db=db)
+            rep = Report()
+            pooled = [pool.datasource_factory('data%s' % i, 'select * from product where id < %s' % (i * 10)) for i in range(3)]
+            shared = [conn.datasource_factory('shared%s' % i, 'select * from product') for i in range(2)]
+            for ds in pooled + shared:
+                rep.register_datasource(ds)
+            rep.register_datasource(DataSource([{'id': 1}]))
+            rep.register_datasource(DataSource([{'id': 2}]))
+            pooled[0].prefetch = pooled[1].prefetch = True
+            rep.open_datasources()
+            # the rows of the prefetched datasources are fetched by the workers, on pooled connections
+            self.assertTrue(pooled[0]._data.buffered and pooled[1]._data.buffered)
+            self.assertNotIn(threading.current_thread(), threads)
+            # the other datasources stream their rows
+            self.assertFalse(pooled[2]._data.buffered)
+            self.assertEqual(len([row for row in pooled[2].data]), 20)
+            self.assertIsNone(pooled[2]._data._rows)
+            # the rows of the shared connection are fetched by the bands, on the calling thread
+            self.assertFalse(any(ds._data.buffered for ds in shared))
+            self.assertEqual(len([row for row in shared[1].data]), 100)
+            self.assertEqual(
+                set(rep.datasource_timings), {'data0', 'data1', 'data2', 'shared0', 'shared1', '#5', '#6'},
+            )
+            for ds in pooled + shared:
+                ds.close()
+            pool.close()
+            db.close()
@@ -0,0 +1,118 @@
+import os
+import tempfile
+from unittest import TestCase, skipIf
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+from reptile.bands import Report, DataBand, Text, PageFooter
+from reptile.exports.pdf import PDF
+from reptile.runtime import binary
+
+
+class PDFTestCase(TestCase):
+    @skipIf(pypdf is None, 'pypdf is not installed')
+    def test_export_parallel(self):
+        rep = Report()
+        page = rep.new_page()
+        footer = PageFooter()
+        page.add_band(footer)
+        footer.add_object(Text('Page ${page_index} of ${page_count}'))
+        band = DataBand()
+        page.add_band(band)
+        band.row_count = 500
+        band.add_object(Text('Line: {{ line }}'))
+        doc = rep.prepare()
+        page_count = len(doc.pages)
+        self.assertGreater(page_count, 10)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'parallel.pdf')
+            PDF(doc).export_parallel(filename, processes=3)
+            reader = pypdf.PdfReader(filename)
+            self.assertEqual(len(reader.pages), page_count)
+            self.assertIn('Line: 1', reader.pages[0].extract_text().replace('\t', ' '))
+            self.assertIn(f'Page {page_count} of {page_count}', reader.pages[-1].extract_text().replace('\t', ' '))
+            # the workers load the pages of a binary container from the file
+            container = os.path.join(tmp, 'report.rptb')
+            doc.save(container)
+            with binary.load(container) as bin_doc:
+                PDF(bin_doc).export_parallel(filename, processes=3)
+            self.assertEqual(len(pypdf.PdfReader(filename).pages), page_count)
+
+    def test_text_measure_cache(self):
+        from reptile.engines.qt import measure_text_height, get_font
+        rep = Report()
+        page = rep.new_page()
+        band = DataBand()
+        page.add_band(band)
+        band.row_count = 50
+        text = Text('Long text {{ line % 2 }} ' * 10)
+        text.can_grow = True
+        band.add_object(text)
+        measure_text_height.cache_clear()
+        doc = rep.prepare()
+        info = measure_text_height.cache_info()
+        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.hits, 48)
+        self.assertGreater(doc.pages[0].bands[0].objects[0].height, text.height)
+        self.assertIs(get_font('Helvetica', 9), get_font('Helvetica', 9))
+
+    def test_export_stats(self):
+        from PySide6.QtCore import QBuffer, QIODevice
+        from PySide6.QtGui import QImage
+        from reptile.bands import Image
+        from reptile.exports.stats import ExportStats
+        buf = QBuffer()
+        buf.open(QIODevice.WriteOnly)
+        img = QImage(8, 8, QImage.Format.Format_RGB32)
+        img.fill(0)
+        img.save(buf, 'PNG')
+        picture = bytes(buf.data())
+        rep = Report()
+        page = rep.new_page()
+        band = DataBand()
+        page.add_band(band)
+        band.row_count = 100
+        band.add_object(Text('Line: {{ line }}'))
+        rich = Text('<b>{{ line }}</b>')
+        rich.allow_tags = True
+        rich.left = 200
+        band.add_object(rich)
+        image = Image()
+        image.picture = picture
+        image.left = 300
+        image.top = 0
+        image.width = image.height = 8
+        band.add_object(image)
+        doc = rep.prepare()
+        stats = ExportStats(log_pages=True)
+        pdf = PDF(doc)
+        pdf.stats = stats
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'stats.pdf')
+            with self.assertLogs('reptile', 'INFO') as logs:
+                pdf.export(filename)
+            size = os.path.getsize(filename)
+            # the output file can't be created
+            failed = PDF(doc)
+            failed.stats = ExportStats()
+            with self.assertRaises(OSError):
+                failed.export(os.path.join(tmp, 'missing', 'stats.pdf'))
+            self.assertIsNone(failed._output)
+            self.assertFalse(failed.stats.active)
+        self.assertEqual(stats.renderer('text').count, 100)
+        self.assertEqual(stats.renderer('rich_text').count, 100)
+        self.assertEqual(stats.renderer('image').count, 100)
+        self.assertEqual(stats.renderer('barcode').count, 0)
+        self.assertEqual(stats.renderer('band').count, 100)
+        self.assertEqual(stats.images_decoded, 100)
+        self.assertEqual(stats.image_bytes, 100 * len(picture))
+        self.assertEqual(len(stats.pages), len(doc.pages))
+        self.assertEqual(len(logs.output), len(doc.pages))
+        self.assertEqual(sum(p.images for p in stats.pages), 100)
+        self.assertTrue(all(p.bytes > 0 for p in stats.pages))
+        self.assertLessEqual(sum(p.bytes for p in stats.pages), stats.bytes)
+        self.assertLessEqual(stats.bytes, size)
+        self.assertGreater(stats.renderer('rich_text').time, 0)
+        self.assertEqual(stats.dump()['imagesDecoded'], 100)
@@ -1,6 +1,6 @@
 from unittest import TestCase
 from reptile.bands import (
-    Report, Page, GroupHeader, DataBand, Text, ReportSummary, DataSource, Band,
+    Report, Page, GroupHeader, DataBand, Text, ReportSummary, DataSource, Band, PageFooter,
 )
 
 
@@ -153,3 +153,342 @@ class ReportTestCase(TestCase):
         self.assertEqual(bands[11].objects[2].text, 'Name: Object 5')
         self.assertEqual(bands[-1].objects[2].text, 'Name: Object 15')
         self.assertEqual(doc.pages[-1].bands[-1].objects[1].text, 'ID: 99')
+
+    def test_iter_pages(self):
+        rep = Report()
+        page = rep.new_page()
+        footer = PageFooter()
+        page.add_band(footer)
+        footer.add_object(Text('Page {{ page_index }} of ${page_count}'))
+        band = DataBand()
+        page.add_band(band)
+        band.row_count = 100
+        band.add_object(Text('Line: {{ line }}'))
+        doc = rep.prepare()
+        expected = [[obj.text for band in p.bands for obj in band.objects] for p in doc.pages]
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(expected[0][-1], 'Page 1 of 4')
+        for double_pass in (False, True):
+            pages = [
+                [obj.text for band in p.bands for obj in band.objects]
+                for p in rep.iter_pages(double_pass=double_pass)
+            ]
+            self.assertEqual(pages, expected)
+            self.assertEqual(rep.stream.pages, [])
+        # stop consuming after the first page
+        for p in rep.iter_pages(double_pass=True):
+            self.assertEqual(p.bands[-1].objects[0].text, 'Page 1 of 4')
+            break
+
+    def test_page_count_placeholders(self):
+        rep = Report()
+        page = rep.new_page()
+        footer = PageFooter()
+        page.add_band(footer)
+        footer.add_object(Text('Page ${page_index} of ${ page_count } (${page_count - page_index} left)'))
+        band = DataBand()
+        page.add_band(band)
+        band.row_count = 100
+        band.add_object(Text('Line: {{ line }}'))
+        doc = rep.prepare()
+        self.assertEqual(len(doc.pages), 4)
+        self.assertEqual(doc.pages[0].bands[-1].objects[0].text, 'Page 1 of 4 (3 left)')
+        self.assertEqual(doc.pages[-1].bands[-1].objects[0].text, 'Page 4 of 4 (0 left)')
+        self.assertEqual(rep._pending_objects, [])
+
+    def test_group_field(self):
+        rep = Report()
+        page = rep.new_page()
+        datasource = DataSource([{'id': i, 'category': i // 10, 'name': 'Object %s' % i} for i in range(30)])
+        datasource.name = 'data1'
+        group = GroupHeader()
+        page.add_band(group)
+        group.add_object(Text('Group: {{ group.grouper }} ({{ group.count }})'))
+        group.field = 'category'
+        band = DataBand()
+        page.add_band(band)
+        band.datasource = datasource
+        band.group_header = group
+        group.band = band
+        band.add_object(Text('ID: {{ data1.id }}'))
+        key = group.get_group_key({})
+        self.assertEqual(key({'category': 1}), '1')
+        self.assertEqual(key({'category': None}), '')
+        doc = rep.prepare()
+        bands = doc.pages[0].bands
+        self.assertEqual(bands[0].objects[0].text, 'Group: 0 (10)')
+        self.assertEqual(bands[11].objects[0].text, 'Group: 1 (10)')
+        self.assertEqual(bands[12].objects[0].text, 'ID: 10')
+
+    def test_packed_pages(self):
+        from reptile.runtime.packed import PackedPage
+
+        def make_report():
+            rep = Report()
+            page = rep.new_page()
+            footer = PageFooter()
+            page.add_band(footer)
+            footer.add_object(Text('Page ${page_index} of ${page_count}'))
+            band = DataBand()
+            page.add_band(band)
+            band.row_count = 100
+            band.add_object(Text('Line: {{ line }}'))
+            return rep
+
+        expected = make_report().prepare().dump()
+        rep = make_report()
+        doc = rep.prepare(packed=True)
+        self.assertEqual(len(doc.pages), 4)
+        self.assertIsInstance(doc.pages[0], PackedPage)
+        self.assertEqual(doc.dump(), expected)
+        self.assertEqual(doc.pages[-1].bands[-1].objects[0].text, 'Page 4 of 4')
+        # all the texts share the same style record
+        self.assertEqual(len(doc.packed_tables.styles), 1)
+        self.assertEqual(rep._pending_objects, [])
+
+    def test_binary_container(self):
+        import pickle
+        from reptile.runtime import binary
+        from reptile.core import Highlight
+        rep = Report()
+        page = rep.new_page()
+        footer = PageFooter()
+        page.add_band(footer)
+        footer.add_object(Text('Page ${page_index} of ${page_count}'))
+        band = DataBand()
+        page.add_band(band)
+        band.row_count = 100
+        text = Text('Line: {{ line }}')
+        text.font.bold = True
+        text.border.bottom = True
+        text.highlight = Highlight({'condition': 'line % 2 == 1', 'background': {'color': '#ffff00'}})
+        band.add_object(text)
+        doc = rep.prepare()
+        doc_bin = binary.load(binary.dumps(doc))
+        self.assertEqual(len(doc_bin), len(doc.pages))
+        self.assertEqual([p.dump() for p in doc_bin], doc.dump()['pages'])
+        texts = {obj.text: obj for band in doc_bin[0].bands for obj in band.objects}
+        self.assertIs(texts['Line: 1'].style, doc.pages[0].bands[0].objects[0].style)
+        self.assertEqual(texts['Line: 1'].background, '#ffff00')
+        self.assertIsNone(texts['Line: 2'].background)
+        self.assertTrue(texts['Line: 2'].border.bottom)
+        self.assertEqual(doc_bin[-1].bands[-1].objects[0].text, 'Page 4 of 4')
+        self.assertEqual(doc_bin[0].margin.top, doc.pages[0].margin.top)
+        view = pickle.loads(pickle.dumps(doc_bin.view(1, 3)))
+        self.assertEqual(len(view), 2)
+        self.assertEqual(view[0].index, 2)
+
+    def test_prepared_report_cache(self):
+        import tempfile
+        from reptile.core import Highlight
+        from reptile.core.cache import PreparedReportCache
+        from reptile.runtime.binary import BinaryDocument
+        from reptile.bands import Image, Line
+
+        def make_report():
+            rep = Report()
+            page = rep.new_page()
+            datasource = DataSource([{'id': i} for i in range(50)], 'data1')
+            datasource.version = 1
+            rep.register_datasource(datasource)
+            band = DataBand()
+            page.add_band(band)
+            band.datasource = datasource
+            band.add_object(Text('{{ params.title }} {{ data1.id }}'))
+            rep.variables['title'] = 'ID'
+            return rep
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = PreparedReportCache(directory=tmp)
+            expected = cache.prepare(make_report()).dump()['pages']
+            self.assertEqual(cache.misses, 1)
+            doc = cache.prepare(make_report())
+            self.assertIsInstance(doc, BinaryDocument)
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(doc.dump()['pages'], expected)
+            # parameters and data versions are part of the key
+            rep = make_report()
+            rep.variables['title'] = 'Code'
+            self.assertEqual(cache.prepare(rep).pages[0].bands[0].objects[0].text, 'Code 0')
+            rep = make_report()
+            rep.datasources[0].version = 2
+            cache.prepare(rep)
+            self.assertEqual(cache.misses, 3)
+            # loaded from the disk cache
+            cache = PreparedReportCache(directory=tmp)
+            self.assertEqual(cache.prepare(make_report()).dump()['pages'], expected)
+            self.assertEqual(cache.hits, 1)
+            # size based eviction
+            cache = PreparedReportCache(max_size=1)
+            cache.prepare(make_report())
+            self.assertEqual(len(cache), 0)
+            # every attribute of the band objects is part of the key
+            rep1, rep2 = make_report(), make_report()
+            rep2.pages[0].bands[0].objects[0].highlight = Highlight({
+                'condition': 'data1.id == 0', 'background': {'color': '#ff0000'},
+            })
+            self.assertNotEqual(cache.key(rep1), cache.key(rep2))
+            self.assertIsNone(cache.prepare(rep1).pages[0].bands[0].objects[0].background)
+            self.assertEqual(cache.prepare(rep2).pages[0].bands[0].objects[0].background, '#ff0000')
+            band = rep1.pages[0].bands[0]
+            image = Image()
+            image.picture = b'logo'
+            band.add_object(image)
+            key = cache.key(rep1)
+            band.add_object(Line())
+            self.assertNotEqual(cache.key(rep1), key)
+            key = cache.key(rep1)
+            image.picture = b'other'
+            self.assertNotEqual(cache.key(rep1), key)
+            self.assertIsInstance(cache.prepare(rep1), BinaryDocument)
+            # without version, the rows of a list are part of the key
+            rep = make_report()
+            rep.datasources[0].version = None
+            key = cache.key(rep)
+            self.assertIsNotNone(key)
+            rep.datasources[0].data.append({'id': 50})
+            self.assertNotEqual(cache.key(rep), key)
+            cache.prepare(rep)
+            self.assertIsNone(rep._sections)
+            # datasources without fingerprint (streamed rows) are not cached
+            rep.register_datasource(DataSource(iter([{'id': 1}]), 'data2'))
+            self.assertIsNone(cache.key(rep))
+
+    def test_compiled_layout(self):
+        from reptile.bands import CompiledLayout
+
+        def text(s, **kwargs):
+            return {'type': 'Text', 'text': s, 'x': 0, 'y': 0, 'width': 200, 'height': 20, **kwargs}
+
+        structure = {'report': {
+            'datasources': [{'name': 'data1', 'data': [{'id': i, 'category': i // 5} for i in range(20)]}],
+            'pages': [{'bands': [
+                {'type': 'GroupHeader', 'name': 'group1', 'field': 'category', 'dataBand': 'band1', 'objects': [
+                    text('Group {{ group.grouper }}'),
+                ]},
+                {'type': 'DataBand', 'name': 'band1', 'datasource': 'data1', 'groupHeader': 'group1', 'objects': [
+                    text('{{ params.title }} {{ data1.id }}', highlight={'condition': 'data1.id == 1'}),
+                ]},
+            ]}],
+        }}
+        layout = CompiledLayout(structure)
+        expected = Report(structure)
+        expected.variables['title'] = 'ID'
+        expected = expected.prepare().dump()
+        rep1 = layout.instantiate(variables={'title': 'ID'})
+        rep2 = layout.instantiate(variables={'title': 'Code'})
+        self.assertIsNot(rep1.pages[0].bands[1], layout.report.pages[0].bands[1])
+        self.assertIs(rep1.pages[0].bands[1].datasource, rep1.datasources[0])
+        # the compiled templates are shared
+        self.assertIs(rep1.pages[0].bands[1].objects[0].template, layout.report.pages[0].bands[1].objects[0].template)
+        self.assertEqual(rep1.prepare().dump(), expected)
+        doc = rep2.prepare()
+        self.assertEqual(doc.pages[0].bands[1].objects[0].text, 'Code 0')
+        self.assertEqual(rep1.prepare().dump(), expected)
+        self.assertEqual(layout.report.variables, {})
+
+    def test_aggregates(self):
+        from reptile.bands import CompiledLayout
+
+        def text(s):
+            return {'type': 'Text', 'text': s, 'x': 0, 'y': 0, 'width': 200, 'height': 20}
+
+        structure = {'report': {
+            'datasources': [{'name': 'data1', 'data': None}],
+            'aggregates': [{'name': 'grand_total', 'function': 'sum', 'field': 'amount'}],
+            'pages': [{'bands': [
+                {'type': 'GroupHeader', 'name': 'group1', 'field': 'category', 'dataBand': 'band1', 'footer': 'footer1',
+                 'objects': [text('Group {{ group.grouper }}')], 'aggregates': [
+                    {'name': 'group_total', 'function': 'sum', 'field': 'amount'},
+                    {'name': 'group_max', 'function': 'max', 'expression': 'data1.amount * 2'},
+                ]},
+                {'type': 'DataBand', 'name': 'band1', 'datasource': 'data1', 'groupHeader': 'group1', 'footer': 'summary',
+                 'objects': [text('{{ data1.id }} {{ running }} {{ categories }}')], 'aggregates': [
+                    {'name': 'running', 'function': 'count'},
+                    {'name': 'categories', 'function': 'distinct', 'field': 'category'},
+                ]},
+                {'type': 'GroupFooter', 'name': 'footer1', 'objects': [text('Total {{ group_total }} max {{ group_max }}')]},
+                {'type': 'FooterBand', 'name': 'summary', 'objects': [text('Grand total {{ grand_total }}')]},
+            ]}],
+        }}
+        layout = CompiledLayout(structure)
+        for rep in (Report(structure), layout.instantiate(), layout.instantiate()):
+            # streamed data, the rows can't be read again
+            rep.set_data('data1', ({'id': i, 'category': i // 3, 'amount': i} for i in range(7)))
+            bands = rep.prepare().pages[0].bands
+            self.assertEqual(bands[3].objects[0].text, '2 3 1')
+            self.assertEqual(bands[4].objects[0].text, 'Total 3 max 4')
+            self.assertEqual(bands[9].objects[0].text, 'Total 12 max 10')
+            self.assertEqual(bands[11].objects[0].text, '6 1 1')
+            self.assertEqual(bands[12].objects[0].text, 'Total 6 max 12')
+            self.assertEqual(bands[-1].objects[0].text, 'Grand total 21')
+        self.assertEqual(rep.dump()['report']['aggregates'][0]['function'], 'sum')
+
+    def test_profiler(self):
+        import json
+        from reptile.core import PrepareProfiler
+        rep = Report()
+        page = rep.new_page()
+        datasource = DataSource([{'id': i, 'category': i // 10} for i in range(50)], 'data1')
+        rep.register_datasource(datasource)
+        group = GroupHeader()
+        group.name = 'group1'
+        page.add_band(group)
+        group.field = 'category'
+        group.add_object(Text('{{ group.grouper }}'))
+        band = DataBand()
+        band.name = 'band1'
+        page.add_band(band)
+        band.datasource = datasource
+        band.group_header = group
+        group.band = band
+        text = Text('{{ data1.id }}')
+        text.name = 'id'
+        band.add_object(text)
+        profiler = rep.profiler = PrepareProfiler(memory=True)
+        rep.prepare()
+        rows = profiler.find('Page', 'groups:group1', 'rows:band1')
+        self.assertEqual(rows.calls, 5)
+        self.assertEqual(rows.children['DataBand:band1'].children['Text:id'].calls, 50)
+        self.assertEqual(rows.children['fetch:data1'].calls, 55)
+        self.assertGreaterEqual(rows.time, rows.children['DataBand:band1'].time)
+        self.assertIn('data1', profiler.datasource_timings)
+        data = json.loads(profiler.to_json())
+        self.assertEqual(data['profile']['name'], 'report')
+        lines = profiler.to_collapsed().splitlines()
+        self.assertTrue(any(line.startswith('report;Page;groups:group1;rows:band1;DataBand:band1;Text:id ') for line in lines))
+        # profiling is opt-in
+        rep.profiler = None
+        rep.prepare()
+        self.assertEqual(rows.calls, 5)
+
+    def test_prepare_lazy(self):
+        def make_report():
+            rep = Report()
+            page = rep.new_page()
+            footer = PageFooter()
+            page.add_band(footer)
+            footer.add_object(Text('Page ${page_index} of ${page_count}'))
+            band = DataBand()
+            page.add_band(band)
+            band.row_count = 1000
+            band.add_object(Text('Line: {{ line }}'))
+            return rep
+
+        expected = make_report().prepare().dump()
+        rep = make_report()
+        with rep.prepare_lazy() as doc:
+            page = doc[1]
+            self.assertEqual(page.bands[0].dump(), expected['pages'][1]['bands'][0])
+            self.assertLess(len(doc.prepared_pages), 5)
+            self.assertIsNone(doc.page_count)
+            # resolved at the end of the preparation
+            self.assertIn('${page_count}', page.bands[-1].objects[0].text)
+            self.assertEqual(len(doc.get_pages(3, 5)), 2)
+            self.assertEqual(doc.finish(), len(expected['pages']))
+            self.assertEqual(page.bands[-1].objects[0].text, f'Page 2 of {doc.page_count}')
+            self.assertEqual([p.dump() for p in doc], expected['pages'])
+        # stopped before the end
+        with make_report().prepare_lazy() as doc:
+            doc[0]
+        self.assertTrue(doc.finished)